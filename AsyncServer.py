@@ -0,0 +1,192 @@
+import asyncio, signal, socket
+from ServerWorker import ServerWorker
+from ServerMetrics import serverMetrics
+
+
+class RtpDatagramProtocol(asyncio.DatagramProtocol):
+    """Single UDP endpoint shared by every session for sending RTP."""
+
+    def __init__(self):
+        self.transport = None
+        self.paused = False
+        self.waiting = []  # sessions blocked by flow control
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        waiting, self.waiting = self.waiting, []
+        for worker in waiting:
+            worker.resumeStream()
+
+    def error_received(self, exc):
+        print("RTP send error:", exc)
+
+
+class AsyncServerWorker(ServerWorker):
+    """ServerWorker whose RTSP connection and RTP sending run on an asyncio event loop."""
+
+    # the datagram transport owns the socket, packets go through transport.sendto
+    batchSend = False
+
+    def __init__(self, clientInfo, loop, writer, rtpProtocol):
+        super().__init__(clientInfo)
+        self.loop = loop
+        self.writer = writer
+        self.rtpProtocol = rtpProtocol
+        self.sendHandle = None
+
+    async def serve(self, reader):
+        """Receive RTSP requests until the client disconnects."""
+        try:
+            while True:
+                data = await reader.read(256)
+                if not data:
+                    break
+                data_str = data.decode("utf-8").strip()
+                print("Data received:\n" + data_str)
+
+                if data_str == "STOP_STREAMING":
+                    self.pauseStream()  # tạm dừng
+                    continue
+
+                self.processRtspRequest(data_str)
+        except ConnectionError:
+            pass
+        finally:
+            self.closeRtpTransport()
+            self.writer.close()
+
+    def sendRtspReply(self, reply):
+        self.writer.write(reply.encode())
+
+    def openRtpTransport(self):
+        """Start streaming right after SETUP, like the threaded engine."""
+        self.resumeStream()
+
+    def openRtcp(self):
+        """Bind the session's RTCP socket, read by the event loop; RTP goes out of the shared endpoint."""
+        rtcpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rtcpSocket.bind(('', 0))
+        rtcpSocket.setblocking(False)
+        self.clientInfo['rtcpSocket'] = rtcpSocket
+        self.loop.add_reader(rtcpSocket, self.readRtcp, rtcpSocket)
+        return self.rtpProtocol.transport.get_extra_info('sockname')[1], rtcpSocket.getsockname()[1]
+
+    def readRtcp(self, rtcpSocket):
+        try:
+            data, addr = rtcpSocket.recvfrom(2048)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            self.loop.remove_reader(rtcpSocket)
+            return
+        self.rtcpReceived(data, addr)
+
+    def resumeStream(self):
+        if self.sendHandle is None and not self.closed:
+            self.nextFrameDue = None
+            self.lastFrameStart = None
+            self.sendHandle = self.loop.call_soon(self.sendNextFrame)
+
+    def pauseStream(self):
+        self.pauseBroadcast()
+        if self.sendHandle is not None:
+            self.sendHandle.cancel()
+            self.sendHandle = None
+        if self in self.rtpProtocol.waiting:
+            self.rtpProtocol.waiting.remove(self)
+
+    def closeRtpTransport(self):
+        self.pauseStream()
+        self.leaveBroadcast()
+        self.closed = True
+        serverMetrics.remove(self.metrics)
+        rtcpSocket = self.clientInfo.pop('rtcpSocket', None)
+        if rtcpSocket is not None:
+            self.loop.remove_reader(rtcpSocket)
+            rtcpSocket.close()
+        video = self.clientInfo.get('videoStream')
+        if video is not None:
+            video.close()
+            del self.clientInfo['videoStream']
+
+    def transmit(self, packet):
+        self.rtpProtocol.transport.sendto(b''.join(packet), self.rtpAddress())
+
+    def transmitEnd(self):
+        print("End of video reached. Stopping RTP stream.")
+        self.rtpProtocol.transport.sendto(self.END_OF_VIDEO, self.rtpAddress())
+
+    def sendNextFrame(self):
+        """Send one frame (or one paced burst) and schedule the next one."""
+        self.sendHandle = None
+        if self.rtpProtocol.paused:
+            self.rtpProtocol.waiting.append(self)
+            return
+
+        # the event loop's timer heap does the pacing
+        if self.paced:
+            due = self.sendPacedBurst(self.loop.time())
+            if due is not None:
+                self.sendHandle = self.loop.call_at(due, self.sendNextFrame)
+            return
+
+        video = self.clientInfo['videoStream']
+        self.frameStarted(self.loop.time())
+        data = self.readFrame(video)
+        if not data:
+            self.transmitEnd()
+            return
+
+        self.transmitBatch(self.packetizeFrame(data, video.frameNbr()))
+        self.transmitFec()
+
+        self.sendHandle = self.loop.call_later(self.frameDelay(), self.sendNextFrame)
+
+
+class AsyncServer:
+    """RTSP/RTP server running every session on one asyncio event loop."""
+
+    def __init__(self, port, sock=None):
+        self.port = port
+        self.sock = sock  # listening socket opened by the caller, instead of binding port
+
+    def run(self, drainTimeout=None):
+        asyncio.run(self.serveForever(drainTimeout))
+
+    async def serveForever(self, drainTimeout=None):
+        """Serve until SIGTERM, then wait up to drainTimeout seconds for the sessions to end.
+
+        Without drainTimeout, serve until the process is stopped.
+        """
+        loop = asyncio.get_running_loop()
+        _, self.rtpProtocol = await loop.create_datagram_endpoint(
+            RtpDatagramProtocol, family=socket.AF_INET, local_addr=('0.0.0.0', 0))
+
+        if self.sock is not None:
+            server = await asyncio.start_server(self.handleClient, sock=self.sock)
+        else:
+            server = await asyncio.start_server(self.handleClient, '', self.port)
+        if drainTimeout is None:
+            async with server:
+                await server.serve_forever()
+            return
+
+        stop = asyncio.Event()
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+        await stop.wait()
+        print("Draining: no new connections")
+        server.close()
+        # sessions end on this loop, wait for them from another thread
+        await loop.run_in_executor(None, serverMetrics.waitIdle, drainTimeout)
+
+    async def handleClient(self, reader, writer):
+        clientInfo = {}
+        clientInfo['rtspSocket'] = (writer.get_extra_info('socket'), writer.get_extra_info('peername'))
+        worker = AsyncServerWorker(clientInfo, asyncio.get_running_loop(), writer, self.rtpProtocol)
+        await worker.serve(reader)
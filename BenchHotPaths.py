@@ -0,0 +1,219 @@
+"""Microbenchmarks of the per-packet and per-frame hot paths, on synthetic
+MJPEG files with frames from SD to 4K size.
+
+For every operation it reports:
+  ns/op        best of --repeat timings of --number calls
+  allocs/op    memory blocks created per call and kept alive by its result
+  alloc B/op   bytes of those blocks
+  peak B/op    transient memory high-water mark of one call (tracemalloc)
+  copied B/op  payload bytes the code path copies, counted from the code
+               (kernel to user copies of file reads included)
+
+Usage: BenchHotPaths.py [--sizes sd,720p,1080p,4k] [--number N] [--repeat N] [--json FILE]
+"""
+import argparse, json, os, sys, tempfile, time, tracemalloc
+from RtpPacket import RtpPacket, RtpPacketizer, HEADER_SIZE, RTP_CLOCK_RATE
+from RtpStats import RtpReceiverStats
+from FrameAssembler import FrameAssembler
+from FrameCache import FrameCache
+from FrameIndex import FrameIndex
+from PacketTable import PacketTable
+from ServerWorker import ServerWorker
+from VideoStream import VideoStream
+import SyntheticVideo
+
+# average JPEG frame size per resolution (bytes)
+FRAME_SIZES = {'sd': 30000, '720p': 100000, '1080p': 250000, '4k': 800000}
+VIDEO_FRAMES = 30
+# frames prepared for the reassembly benchmark before its state is reset
+ASSEMBLY_FRAMES = 64
+
+
+class Bench:
+    """One operation: op() is timed, copied is the bytes it copies per call."""
+
+    def __init__(self, name, op, copied):
+        self.name = name
+        self.op = op
+        self.copied = copied
+
+
+def timeOp(op, number, repeat):
+    """Best time of one call, in ns."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        for _ in range(number):
+            op()
+        elapsed = (time.perf_counter_ns() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def allocations(op, number):
+    """Return (blocks, bytes) kept per call with the results alive, and the peak bytes of one call."""
+    op()  # warm up caches and lazily built state
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        op()
+        _, peak = tracemalloc.get_traced_memory()
+
+        blocksBefore = sys.getallocatedblocks()
+        bytesBefore, _ = tracemalloc.get_traced_memory()
+        kept = [op() for _ in range(number)]
+        bytesAfter, _ = tracemalloc.get_traced_memory()
+        blocksAfter = sys.getallocatedblocks()
+    finally:
+        tracemalloc.stop()
+    # the list holding the results is not the operation's
+    listBlocks = 1 if kept else 0
+    return ((blocksAfter - blocksBefore - listBlocks) / number,
+            (bytesAfter - bytesBefore - sys.getsizeof(kept)) / number,
+            peak - base)
+
+
+def packetBenches(frame):
+    """RtpPacket on one full-size packet of frame."""
+    chunk = memoryview(frame)[:ServerWorker.MAX_RTP_PAYLOAD]
+    packet = RtpPacket()
+    packet.encode(2, 0, 0, 0, 1, 0, 26, 0, chunk, 0)
+    datagram = packet.getPacket()
+
+    def encode():
+        p = RtpPacket()
+        p.encode(2, 0, 0, 0, 1, 0, 26, 0, chunk, 0)
+        return p
+
+    def decode():
+        p = RtpPacket()
+        p.decode(datagram)
+        return p
+
+    return [
+        Bench("RtpPacket.encode", encode, HEADER_SIZE),
+        Bench("RtpPacket.getPacket", packet.getPacket, len(datagram)),
+        Bench("RtpPacket.decode", decode, len(datagram)),
+        Bench("RtpPacket.parse", lambda: RtpPacket.parse(datagram), 0),
+    ]
+
+
+def streamBenches(filename, mode):
+    """VideoStream.nextFrame through the OS, the frame cache and an mmap, wrapping at the end."""
+    benches = []
+    for label, stream in (("read", VideoStream(filename, mode, frameCache=None)),
+                          ("cache", VideoStream(filename, mode, frameCache=FrameCache(1 << 30))),
+                          ("mmap", VideoStream(filename, mode, useMmap=True))):
+        def nextFrame(stream=stream):
+            data = stream.nextFrame()
+            if data is None:
+                stream.seek(0)
+                data = stream.nextFrame()
+            return data
+        average = sum(stream.index.lengths) // stream.frameCount()
+        # pread copies every frame out of the page cache; hits and mmap slices copy nothing
+        benches.append(Bench(f"VideoStream.nextFrame {mode} {label}", nextFrame,
+                             average if label == "read" else 0))
+    return benches
+
+
+def serverBenches(frame):
+    """Per-frame packetization: RtpPacketizer alone, in the session (history, counters) and with the PacketTable."""
+    worker = ServerWorker({})
+    chunkSize = worker.MAX_RTP_PAYLOAD
+    count = (len(frame) + chunkSize - 1) // chunkSize
+    packetizer = RtpPacketizer(pt=26)
+
+    tabled = ServerWorker({})
+    tabled.packetTable = PacketTable(FrameIndex([0], [len(frame)]), chunkSize, tabled.frameTicks())
+
+    return [
+        Bench("RtpPacketizer.packetize", lambda: packetizer.packetize(frame, chunkSize, 0, 0), count * HEADER_SIZE),
+        Bench("ServerWorker.packetizeFrame", lambda: worker.packetizeFrame(frame, 1), count * HEADER_SIZE),
+        # header templates copied, then patched in place
+        Bench("packetizeFrame (PacketTable)", lambda: tabled.packetizeFrame(frame, 1), count * HEADER_SIZE),
+    ]
+
+
+def reassemblyBench(frame):
+    """What listenRtp does with the datagrams of one frame: parse, sequence/timestamp
+    extension and reassembly into the frame bytes."""
+    packetizer = RtpPacketizer(pt=26)
+    ticks = RTP_CLOCK_RATE // 24
+    frames, seq = [], 0
+    for i in range(ASSEMBLY_FRAMES):
+        pairs = packetizer.packetize(frame, ServerWorker.MAX_RTP_PAYLOAD, seq, i * ticks)
+        frames.append([b''.join(pair) for pair in pairs])
+        seq += len(pairs)
+
+    state = {'next': 0}
+    stats = RtpReceiverStats()
+    assembler = FrameAssembler()
+
+    def receive():
+        i = state['next']
+        if i == ASSEMBLY_FRAMES:
+            stats.reset()
+            assembler.reset()
+            i = 0
+        state['next'] = i + 1
+        ready = []
+        now = time.monotonic()
+        for datagram in frames[i]:
+            packet = RtpPacket.parse(datagram)
+            extSeq = stats.update(packet.seqNum)
+            extTs = stats.unwrapTimestamp(packet.timestamp)
+            ready += assembler.add(extSeq, extTs, packet.marker, packet.payload, now)
+        return ready
+
+    return Bench("client reassembly (frame)", receive, len(frame))
+
+
+def runBench(bench, number, repeat):
+    ns = timeOp(bench.op, number, repeat)
+    blocks, allocBytes, peak = allocations(bench.op, min(number, 1000))
+    return {'name': bench.name, 'nsPerOp': ns, 'allocsPerOp': blocks, 'allocBytesPerOp': allocBytes,
+            'peakBytesPerOp': peak, 'bytesCopiedPerOp': bench.copied}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-frame hot path microbenchmarks")
+    parser.add_argument('--sizes', default=",".join(FRAME_SIZES), help="frame sizes: " + ", ".join(FRAME_SIZES))
+    parser.add_argument('--number', type=int, default=2000, help="calls per timing")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', default=None, help="also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes.split(","):
+            frameSize = FRAME_SIZES[size]
+            hdFile = SyntheticVideo.writeVideo(os.path.join(workdir, f"{size}.hd.mjpeg"), 'hd', VIDEO_FRAMES, frameSize)
+            frame = SyntheticVideo.makeFrame(frameSize)
+            benches = packetBenches(frame) + serverBenches(frame) + [reassemblyBench(frame)]
+            if frameSize <= SyntheticVideo.MAX_NORMAL_FRAME:
+                normalFile = SyntheticVideo.writeVideo(os.path.join(workdir, f"{size}.mjpeg"), 'normal',
+                                                       VIDEO_FRAMES, frameSize)
+                benches += streamBenches(normalFile, 'normal')
+            benches += streamBenches(hdFile, 'hd')
+
+            print(f"\n{size}: {frameSize:,} byte frames")
+            print(f"{'operation':<36} {'ns/op':>12} {'allocs/op':>10} {'alloc B/op':>11} {'peak B/op':>10} {'copied B/op':>12}")
+            for bench in benches:
+                result = runBench(bench, args.number, args.repeat)
+                result['size'] = size
+                result['frameBytes'] = frameSize
+                results.append(result)
+                print(f"{bench.name:<36} {result['nsPerOp']:>12,.0f} {result['allocsPerOp']:>10.1f} "
+                      f"{result['allocBytesPerOp']:>11,.0f} {result['peakBytesPerOp']:>10,} "
+                      f"{result['bytesCopiedPerOp']:>12,}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'number': args.number, 'repeat': args.repeat, 'results': results}, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
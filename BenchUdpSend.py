@@ -0,0 +1,63 @@
+"""Packets per second of the RTP send paths: one sendto per packet (header and
+payload joined), one sendmsg per packet (scatter/gather), and one sendmmsg per
+frame's worth of packets (UdpBatch.sendFrame, what ServerWorker uses).
+
+Usage: BenchUdpSend.py [--packets N] [--payload BYTES] [--batch PACKETS]
+"""
+import argparse, socket, time
+import UdpBatch
+from RtpPacket import RtpPacketizer
+
+def makePackets(frame, payloadSize):
+    return RtpPacketizer(pt=26).packetize(frame, payloadSize, 0, 0)
+
+
+def benchSendto(sock, packets, address):
+    for packet in packets:
+        sock.sendto(b''.join(packet), address)
+
+
+def benchSendmsg(sock, packets, address):
+    for packet in packets:
+        sock.sendmsg(packet, [], 0, address)
+
+
+def benchSendmmsg(sock, packets, address, batch, frame, payloadSize):
+    for start in range(0, len(packets), batch):
+        UdpBatch.sendFrame(sock, [header for header, _ in packets[start:start + batch]],
+                           frame, start * payloadSize, payloadSize, address)
+
+
+def run(name, fn, packets, *args):
+    start = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - start
+    pps = len(packets) / elapsed
+    print(f"{name:<10} {pps:>12,.0f} packets/s  {elapsed * 1e9 / len(packets):>8,.0f} ns/packet")
+    return pps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RTP send path benchmark")
+    parser.add_argument('--packets', type=int, default=200000)
+    parser.add_argument('--payload', type=int, default=1500)
+    parser.add_argument('--batch', type=int, default=135, help="packets per sendmmsg call (one 200 KB HD frame)")
+    args = parser.parse_args()
+
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))  # never read: the kernel drops what does not fit
+    address = sink.getsockname()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    frame = bytes(args.packets * args.payload)
+    packets = makePackets(frame, args.payload)
+    print(f"{args.packets} packets of {args.payload} bytes to {address[0]}:{address[1]}"
+          f" (sendmmsg {'available' if UdpBatch.available() else 'not available, looping'})")
+    base = run("sendto", benchSendto, packets, sock, packets, address)
+    run("sendmsg", benchSendmsg, packets, sock, packets, address)
+    batched = run("sendmmsg", benchSendmmsg, packets, sock, packets, address, args.batch, frame, args.payload)
+    print(f"speedup sendmmsg/sendto: {batched / base:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import socket, threading
+from random import randint
+from time import monotonic, perf_counter
+from RtpPacket import RtpPacketizer, RTP_CLOCK_RATE
+from PacketHistory import PacketHistory
+from Rtcp import SenderReport, ntpTime
+from VideoStream import VideoStream
+import UdpBatch
+
+END_OF_VIDEO = b"END_OF_VIDEO"
+
+
+class BroadcastChannel:
+    """A live stream of one video, read and packetized once and sent to every subscriber.
+
+    A reader thread reads the frames at the frame rate of the mode and sends
+    the packets of each frame to all subscribers with UdpBatch.sendBatchTo:
+    headers and payloads are shared, only the destination changes, and the
+    kernel gets them in as few sendmmsg calls as possible. A subscriber gets
+    the stream from the next frame on (every MJPEG frame is a keyframe). A
+    paused subscriber stays subscribed and is skipped until it resumes, so a
+    viewer that pauses or stops after buffering does not restart the stream.
+    Every RTCP_INTERVAL the channel sends an RTCP sender report to each
+    subscriber, so its session's receiver reports carry a round-trip time.
+    The channel stops when its last subscriber leaves (teardown), or with the
+    video after sending END_OF_VIDEO to the subscribers left.
+    """
+
+    # (video file, mode) -> running channel
+    channels = {}
+    channelsLock = threading.Lock()
+
+    RTCP_INTERVAL = 1.0  # seconds between sender reports
+
+    def __init__(self, filename, mode, fps, chunkSize, useMmap=False):
+        self.key = (filename, mode)
+        self.video = VideoStream(filename, mode=mode, useMmap=useMmap)  # IOError if it cannot be opened
+        self.fps = fps
+        self.frameTicks = RTP_CLOCK_RATE // fps
+        self.chunkSize = chunkSize
+        self.ssrc = randint(0, 0xFFFFFFFF)
+        self.rtpSeq = randint(0, 0xFFFF)
+        self.packetizer = RtpPacketizer(pt=26, ssrc=self.ssrc)
+        # shared by the subscribers' sessions, which answer their NACKs from it
+        self.history = PacketHistory(chunkSize)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('', 0))
+        self.lock = threading.Lock()
+        self.subscribers = {}  # session -> (address, port) of its RTP port
+        self.paused = set()    # subscribers skipped until they resume
+        self.stopped = threading.Event()
+        # sender report counts: packets and payload octets sent since the start
+        self.packetsSent = 0
+        self.octetsSent = 0
+        self.nextSenderReport = 0.0
+
+    @classmethod
+    def join(cls, filename, mode, fps, chunkSize, session, address, useMmap=False):
+        """Subscribe session to the channel of (filename, mode), starting it if none is running.
+
+        Returns (channel, seq, rtptime): the sequence number and RTP timestamp
+        of the first packet the session gets.
+        """
+        with cls.channelsLock:
+            channel = cls.channels.get((filename, mode))
+            if channel is not None:
+                seq, rtptime = channel.subscribe(session, address)
+                return channel, seq, rtptime
+            channel = cls(filename, mode, fps, chunkSize, useMmap)
+            cls.channels[channel.key] = channel
+            # subscribed before the first frame is read
+            seq, rtptime = channel.subscribe(session, address)
+            threading.Thread(target=channel.run, daemon=True).start()
+        return channel, seq, rtptime
+
+    @classmethod
+    def stats(cls):
+        """(running channels, subscribers) of this process, for ServerMetrics."""
+        with cls.channelsLock:
+            channels = list(cls.channels.values())
+        return len(channels), sum(len(channel.subscribers) for channel in channels)
+
+    def subscribe(self, session, address):
+        with self.lock:
+            self.subscribers[session] = address
+            return self.nextPacket()
+
+    def nextPacket(self):
+        """(seq, rtptime) of the first packet of the next frame."""
+        return self.rtpSeq, (self.video.frameNbr() * self.frameTicks) & 0xFFFFFFFF
+
+    def pause(self, session):
+        """Stop sending to session, which stays subscribed until it leaves."""
+        with self.lock:
+            if session in self.subscribers:
+                self.paused.add(session)
+
+    def resume(self, session):
+        """Send to session again from the next frame; return (seq, rtptime) of its first packet."""
+        with self.lock:
+            self.paused.discard(session)
+            return self.nextPacket()
+
+    def leave(self, session):
+        """Unsubscribe session; the last one to leave stops the channel."""
+        with self.channelsLock:
+            with self.lock:
+                self.subscribers.pop(session, None)
+                self.paused.discard(session)
+                if self.subscribers:
+                    return
+            if self.channels.get(self.key) is self:
+                del self.channels[self.key]
+        self.stopped.set()
+
+    def run(self):
+        """Reader thread: one frame every 1/fps seconds to every subscriber."""
+        interval = 1.0 / self.fps
+        due = monotonic()
+        try:
+            while not self.stopped.wait(max(0.0, due - monotonic())):
+                data = self.video.nextFrame()
+                if not data:
+                    self.end()
+                    return
+                with self.lock:
+                    frameNumber = self.video.frameNbr()
+                    packets = self.packetizer.packetize(data, self.chunkSize, self.rtpSeq,
+                                                        (frameNumber - 1) * self.frameTicks)
+                    self.rtpSeq = (self.rtpSeq + len(packets)) & 0xFFFF
+                    subscribers = [(session, address) for session, address in self.subscribers.items()
+                                   if session not in self.paused]
+                self.history.record(packets, data)
+                self.fanOut(packets, subscribers)
+                self.packetsSent += len(packets)
+                self.octetsSent += sum([len(payload) for _, payload in packets])
+                if monotonic() >= self.nextSenderReport:
+                    self.sendSenderReports((frameNumber - 1) * self.frameTicks)
+
+                due += interval
+                if monotonic() - due > interval:
+                    due = monotonic()  # too late to catch up without a burst
+        finally:
+            self.video.close()
+            self.socket.close()
+
+    def fanOut(self, packets, subscribers):
+        """Send the packets of one frame to every subscriber, in its session's metrics."""
+        if not subscribers:
+            return
+        items = [(packet, address) for _, address in subscribers for packet in packets]
+        start = perf_counter()
+        try:
+            UdpBatch.sendBatchTo(self.socket, items)
+        except OSError:
+            for session, _ in subscribers:
+                session.metrics.sendErrors += 1
+            return
+        elapsed = (perf_counter() - start) / len(subscribers)
+        size = sum([len(header) + len(payload) for header, payload in packets])
+        for session, _ in subscribers:
+            session.metrics.sent(len(packets), size, elapsed)
+
+    def sendSenderReports(self, rtpTime):
+        """Send an RTCP SR of the stream to every subscriber, paused ones included: wall clock against rtpTime."""
+        self.nextSenderReport = monotonic() + self.RTCP_INTERVAL
+        report = SenderReport(self.ssrc, ntpTime(), rtpTime, self.packetsSent, self.octetsSent).pack()
+        with self.lock:
+            sessions = list(self.subscribers)
+        for session in sessions:
+            session.sendRtcp(report)
+
+    def end(self):
+        """End of the video: no more subscribers, END_OF_VIDEO to those left."""
+        with self.channelsLock:
+            if self.channels.get(self.key) is self:
+                del self.channels[self.key]
+            with self.lock:
+                subscribers, self.subscribers = self.subscribers, {}
+                self.paused.clear()
+        self.stopped.set()
+        for address in subscribers.values():
+            try:
+                self.socket.sendto(END_OF_VIDEO, address)
+            except OSError:
+                pass
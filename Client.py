@@ -3,9 +3,21 @@ import time
 from collections import deque
 from tkinter import *
 import tkinter.messagebox as tkMessageBox
-from PIL import Image, ImageTk
-import socket, threading, sys, traceback, os
-from RtpPacket import RtpPacket
+from PIL import ImageTk
+import socket, selectors, threading, sys, traceback, os
+from random import randint
+from concurrent.futures import Future
+from RtpPacket import RtpPacket, RTP_CLOCK_RATE
+from RtpStats import RtpReceiverStats
+from FrameAssembler import FrameAssembler
+from FrameDecoder import FrameDecoder
+from RtspMessage import formatRequest, parseReply, parseRtpInfo
+from RateAdapter import RateAdapter
+from Rtcp import ReceiverReport, SenderReport, GenericNack, ntpMiddle
+from Fec import FecPacket, FEC_PT
+from PacketHistory import RTX_PT
+import Rtcp
+from Tracing import tracer
 
 CACHE_FILE_NAME = "cache-"
 CACHE_FILE_EXT = ".jpg"
@@ -20,12 +32,30 @@ class Client:
     PAUSE = 2
     TEARDOWN = 3
     DESCRIBE = 4
+    SET_PARAMETER = 5
+
+    # frame rate per mode, as ServerWorker.FRAME_RATES
+    FRAME_RATES = {'normal': 24, 'hd': 30}
 
     # Cấu hình buffer
     MIN_BUFFER_FRAMES = 10
     MAX_BUFFER_FRAMES = 120
 
-    def __init__(self, master, serveraddr, serverport, rtpport, filename):
+    # seconds between RTCP receiver reports
+    RTCP_INTERVAL = 1.0
+    # seconds a packet is missing before it is NACKed, so reordering and FEC get a chance
+    NACK_DELAY = 0.02
+
+    # packets kept while waiting for the reply to a seek
+    MAX_HELD_PACKETS = 4096
+    # seconds a seek waits for its reply before it is given up
+    SEEK_TIMEOUT = 5.0
+
+    # chiều cao cố định của khung video (pixel)
+    DISPLAY_HEIGHT = 288
+
+    def __init__(self, master, serveraddr, serverport, rtpport, filename, dumpFrames=False, fullDecode=False,
+                 fecRatio=None):
         self.master = master
         self.master.protocol("WM_DELETE_WINDOW", self.handler)
         self.createWidgets()
@@ -35,6 +65,13 @@ class Client:
         self.serverPort = int(serverport)
         self.rtpPort = int(rtpport)
         self.fileName = filename
+        # debug: also write every displayed frame to cache-<session>.jpg
+        self.dumpFrames = dumpFrames
+        # decode frames at full resolution instead of at the widget size
+        self.fullDecode = fullDecode
+        # FEC overhead asked for in DESCRIBE, e.g. '0.25' for one parity packet per 4 RTP packets
+        self.fecRatio = fecRatio
+        self.described = False
 
         # RTSP state
         self.state = self.INIT
@@ -42,18 +79,53 @@ class Client:
         self.sessionId = 0
         self.requestSent = -1
         self.teardownAcked = 0
+        self.rtspReplies = {}  # CSeq -> Future of the reply
 
         # frame/state tracking
         self.frameNbr = 0
-        self.rtpBuffer = b''
         self.prevSeqNum = 0
-        self.currentFrameNum = 0
         self.sentStop = False
+        # packets -> frames, tolerating reordering within the deadline
+        self.reassembler = FrameAssembler(deadline=0.2)
+
+        # seek state
+        self.duration = 0.0      # seconds, from the Range header of the SETUP reply
+        self.seeking = False     # PLAY with Range sent, reply not received yet
+        self.seekResume = False  # keep playing once the seek is done
+        self.seekSeq = None      # RTP-Info seq of the first packet from the new position
+        self.seekFloor = None    # extended sequence number of that packet
+        self.seekHeld = []       # packets received before the seek reply
+        self.seekDragging = False
+        # resume: a live (broadcast) stream continues at the RTP-Info seq of the PLAY reply
+        self.resuming = False    # PLAY sent, reply not received yet
+        self.resumeSeq = None    # RTP-Info seq, the numbers before it were skipped while paused
+
+        # adaptive bitrate: renditions from the SETUP reply, switched with SET_PARAMETER
+        self.rateAdapter = None
+        self.switching = False        # SET_PARAMETER sent, reply not received yet
+        self.renditionSwitch = None   # (rtptime, mode): frames from this timestamp on are in mode
+        self.displaySwitch = None     # (frameNbr, mode): apply mode's playback settings from this frame on
+        self.trainMark = (0, 0.0)     # reassembler packet-train counters at the last sample
+
+        # RTCP: receiver reports on rtpPort + 1 to the server_port of the SETUP reply
+        self.ssrc = randint(0, 0xFFFFFFFF)
+        self.serverSsrc = None        # SSRC of the RTP stream
+        self.serverRtcpAddr = None
+        self.lastSenderReport = None  # (LSR, arrival time) of the last SR
+        self.nextReceiverReport = 0.0
+        self.nacksSent = 0            # sequence numbers NACKed
+        self.retransmitted = 0        # packets received again after a NACK
 
         # event to stop RTP listening loop
         self.playEvent = threading.Event()
         self.playEvent.clear()
         self.bufferReadyEvent = threading.Event()
+        # notified when frames are buffered or the video ends, for waitForBufferThenPlay
+        self.bufferCond = threading.Condition()
+        # a byte on rtpWakeup wakes listenRtp out of its select (stop, seek done)
+        self.rtpWakeup = socket.socketpair()
+        for end in self.rtpWakeup:
+            end.setblocking(False)
 
         # Thêm biến để phát hiện server ngừng gửi
         self.endVideo = False
@@ -64,6 +136,7 @@ class Client:
         # sockets
         self.rtspSocket = None
         self.rtpSocket = None
+        self.rtcpSocket = None
 
         # THÊM: Biến cho HD streaming
         self.bandwidth_stats = {
@@ -74,6 +147,10 @@ class Client:
         }
         self.total_lost_frames = 0
         self.total_frames_received = 0  # Tổng số frame đã nhận
+        # extended sequence numbers / timestamps, packet loss
+        self.rtpStats = RtpReceiverStats()
+        self.rtpFrameTicks = RTP_CLOCK_RATE // 24  # 90 kHz ticks per frame at 24 fps
+        self.displayFrameTicks = self.rtpFrameTicks  # of the frame on screen, for the seek bar
         self.hd_buffer_size = 150  # Buffer lớn hơn cho HD
         self.hd_min_buffer = 15  # Min buffer cho HD
 
@@ -93,9 +170,17 @@ class Client:
         self.label = Label(self.videoFrame, bg="black")
         self.label.pack(fill=BOTH, expand=True)
 
+        # --- Seek bar (seconds) ---
+        self.seekPosition = DoubleVar()
+        self.seekBar = Scale(self.master, variable=self.seekPosition, from_=0, to=0, resolution=0.1,
+                             orient=HORIZONTAL, showvalue=0)
+        self.seekBar.grid(row=1, column=0, sticky=E + W, padx=5)
+        self.seekBar.bind("<ButtonPress-1>", self.seekPressed)
+        self.seekBar.bind("<ButtonRelease-1>", self.seekReleased)
+
         # --- Info: Buffer + Time + Describe ---
         self.infoFrame = Frame(self.master)
-        self.infoFrame.grid(row=1, column=0, columnspan=4, pady=5)
+        self.infoFrame.grid(row=2, column=0, columnspan=4, pady=5)
 
         self.bufferLabel = Label(self.infoFrame, text="Buffer: 0/120")
         self.bufferLabel.pack(side=LEFT, padx=5)
@@ -121,7 +206,7 @@ class Client:
 
         # --- Control buttons ---
         self.controlFrame = Frame(self.master)
-        self.controlFrame.grid(row=2, column=0, columnspan=4, pady=5)
+        self.controlFrame.grid(row=3, column=0, columnspan=4, pady=5)
         self.setup = Button(self.controlFrame, width=15, text="Setup", command=self.setupMovie)
         self.setup.pack(side=LEFT, padx=5)
         self.start = Button(self.controlFrame, width=15, text="Play", command=self.playMovie)
@@ -139,6 +224,7 @@ class Client:
         self.timeLabel.config(text=time_str)
 
     def updateButtons(self):
+        self.seekBar.config(state="disabled" if self.state == self.INIT or self.duration <= 0 else "normal")
         if self.state == self.INIT:
             self.setup.config(state="normal")
             self.describe.config(state="normal")
@@ -150,8 +236,8 @@ class Client:
             self.setup.config(state="disabled")
             self.describe.config(state="disabled")
 
-            buffer_condition = len(self.frameBuffer) >= self.MIN_BUFFER_FRAMES
-            end_video = self.endVideo and len(self.frameBuffer) > 0
+            buffer_condition = self.bufferedFrames() >= self.MIN_BUFFER_FRAMES
+            end_video = self.endVideo and self.bufferedFrames() > 0
 
             if buffer_condition or end_video:
                 self.start.config(state="normal")
@@ -169,7 +255,7 @@ class Client:
 
     def updateBufferLabel(self):
         """Cập nhật Buffer Label"""
-        current_length = len(self.frameBuffer)
+        current_length = self.bufferedFrames()
         buffer_ratio = current_length / self.bufferSize
 
         fps = 1 / self.currentFrameInterval if self.currentFrameInterval > 0 else 0
@@ -228,11 +314,49 @@ class Client:
                 self.bandwidth_stats['total_bytes'] = 0
                 self.bandwidth_stats['last_check'] = current_time
 
+                self.adaptRendition(current_time)
+
+    def adaptRendition(self, now):
+        """Ask the server for another rendition when throughput or buffer level call for it."""
+        adapter = self.rateAdapter
+        if adapter is None or self.switching or self.seeking or self.state == self.INIT:
+            return
+        trainBytes, trainSeconds = self.reassembler.trainBytes, self.reassembler.trainSeconds
+        adapter.sample(trainBytes - self.trainMark[0], trainSeconds - self.trainMark[1])
+        self.trainMark = (trainBytes, trainSeconds)
+
+        mode = adapter.choose(self.bufferedFrames(), self.MIN_BUFFER_FRAMES, self.isPlaying, now)
+        if mode is not None:
+            estimate = adapter.estimate / 1000 if adapter.estimate else 0
+            print(f"Rendition: {adapter.mode} -> {mode} (throughput {estimate:.0f} kbps, "
+                  f"buffer {self.bufferedFrames()})")
+            self.switching = True
+            reply = self.sendRtspRequest(self.SET_PARAMETER, mode=mode)
+            reply.add_done_callback(lambda future: self.renditionSwitched(
+                mode, future.result() if future.exception() is None else None))
+
+    def renditionSwitched(self, mode, reply):
+        """SET_PARAMETER answered (reply None without an answer): frames from its RTP-Info rtptime on are in mode."""
+        if reply is not None and reply.code == 200:
+            info = parseRtpInfo(reply.headers.get('rtp-info', ''))
+            if 'rtptime' in info:
+                self.renditionSwitch = (int(info['rtptime']), mode)
+            self.rateAdapter.switched(mode, time.time())
+        self.switching = False
+        self.wakeListener()  # hand it the packets held during the switch
+
     def adjust_for_hd(self):
         """Điều chỉnh cài đặt cho video HD"""
-        if self.videoMode.get() == "hd":
+        self.applyRendition(self.videoMode.get())
+        self.rtpFrameTicks = self.displayFrameTicks
+
+    def applyRendition(self, mode):
+        """Buffer and playback settings of mode ('normal' or 'hd')."""
+        self.displayFrameTicks = RTP_CLOCK_RATE // self.FRAME_RATES.get(mode, 24)
+        if mode == "hd":
             self.bufferSize = self.hd_buffer_size
             self.MIN_BUFFER_FRAMES = self.hd_min_buffer
+            self.decoder.capacity = self.MIN_BUFFER_FRAMES
 
             self.frameReceiveTimeout = 1.5
 
@@ -245,6 +369,7 @@ class Client:
             # Normal mode
             self.bufferSize = self.MAX_BUFFER_FRAMES
             self.MIN_BUFFER_FRAMES = 10
+            self.decoder.capacity = self.MIN_BUFFER_FRAMES
             self.frameReceiveTimeout = 2.0
             self.baseFrameInterval = 0.042  # ~24fps
 
@@ -288,10 +413,22 @@ class Client:
             print(f"Total Frames Received: {self.total_frames_received}")
             print(f"Total Lost Frames: {self.total_lost_frames}")
             print(f"Loss Rate: {loss_rate:.2f}%")
+            print(f"Lost Packets: {self.rtpStats.lost()} of {self.rtpStats.expected()}")
+            print(f"Reordered Packets: {self.reassembler.reordered}")
+            print(f"Late Packets: {self.reassembler.late}")
+            print(f"Incomplete Frames Dropped: {self.reassembler.incomplete}")
+            print(f"Packets Recovered by FEC: {self.reassembler.recovered}")
+            print(f"Packets NACKed: {self.nacksSent}, Retransmitted: {self.retransmitted}")
+            if self.rateAdapter is not None:
+                print(f"Rendition Switches: {self.rateAdapter.switches} (now {self.rateAdapter.mode})")
             print(f"Average Bandwidth: {avg_kbps:.0f} kbps")
+            print(f"Interarrival Jitter: {self.rtpStats.jitter * 1000 / RTP_CLOCK_RATE:.1f} ms")
             print(f"Total Duration: {elapsed_time:.1f} seconds")
             print(f"Total Packets: {self.bandwidth_stats['total_packets']}")
             print(f"Buffer Size Used: {self.bufferSize}")
+            last_ms, avg_ms, max_ms = self.decoder.latencyStats()
+            print(f"Decode Latency: avg {avg_ms:.1f} ms, max {max_ms:.1f} ms (last 100), "
+                  f"{self.decoder.framesDecoded} frames")
             print("=" * 50 + "\n")
 
     # Yêu Cầu 3: Client-Side Caching
@@ -301,6 +438,11 @@ class Client:
         # Buffer cho frames
         self.frameBuffer = deque()
         self.bufferSize = self.MAX_BUFFER_FRAMES
+        # decodes frames from frameBuffer ahead of the playhead, at the widget size
+        self.decoder = FrameDecoder(self.frameBuffer, self.MIN_BUFFER_FRAMES)
+        if not self.fullDecode:
+            self.decoder.setTargetSize((self.label.winfo_width(), self.DISPLAY_HEIGHT))
+            self.label.bind("<Configure>", self.onVideoResize)
 
         # Control flags
         self.isReceivingFrames = False
@@ -326,29 +468,34 @@ class Client:
     def waitForBufferThenPlay(self):
         """Đợi đủ buffer rồi mới play, không còn bufferFullPause."""
         timeout = 15
-        start_time = time.time()
 
-        while self.state == self.READY:
-            buffer_ready = len(self.frameBuffer) >= self.MIN_BUFFER_FRAMES
-            server_has_frames = len(self.frameBuffer) > 0
+        def ready():
+            buffered = self.bufferedFrames()
+            return buffered >= self.MIN_BUFFER_FRAMES or (self.endVideo and buffered > 0)
 
-            if buffer_ready or (self.endVideo and server_has_frames):
-                self.startFrameReceiver()
-                self.master.after(0, self.bufferAndPlay)
-                return
-
-            # Timeout
-            if time.time() - start_time > timeout:
-                return
+        # frameAssembled and the end of the video notify bufferCond
+        with self.bufferCond:
+            if not self.bufferCond.wait_for(lambda: self.state != self.READY or ready(), timeout):
+                return  # Timeout
 
-            time.sleep(0.1)
+        if self.state == self.READY:
+            self.startFrameReceiver()
+            self.master.after(0, self.bufferAndPlay)
 
     def bufferAndPlay(self):
         """Bắt đầu phát video từ buffer"""
         if self.state == self.READY:
-            self.sendRtspRequest(self.PLAY)
-            while self.state != self.PLAYING:
-                time.sleep(0.01)
+            self.resuming = True
+            reply = self.sendRtspRequest(self.PLAY)
+            # play once the server acknowledged, without blocking the GUI thread
+            reply.add_done_callback(self.playAcknowledged)
+
+    def playAcknowledged(self, reply):
+        if self.resuming:
+            # refused: nothing to skip, let the held packets through
+            self.resuming = False
+            self.wakeListener()
+        if self.state == self.PLAYING:
             self.startPlayback()
 
     def startFrameReceiver(self):
@@ -366,7 +513,7 @@ class Client:
 
     def adjustPlaybackSpeed(self):
         """Điều chỉnh tốc độ phát dựa trên buffer hiện tại và lịch sử"""
-        current_buffer = len(self.frameBuffer)
+        current_buffer = self.bufferedFrames()
         self.bufferHistory.append(current_buffer)
 
         avg_buffer = sum(self.bufferHistory) / len(self.bufferHistory)
@@ -379,9 +526,21 @@ class Client:
         if self.videoMode.get() == "hd":
             self.currentFrameInterval = max(self.currentFrameInterval, 0.035)
 
+    def bufferedFrames(self):
+        """Frames waiting to be shown: raw in frameBuffer plus decoded in the decoder ring."""
+        return len(self.frameBuffer) + len(self.decoder)
+
     def stopFrameReceiver(self):
         """Stop receiving frames"""
         self.isReceivingFrames = False
+        self.wakeListener()
+
+    def wakeListener(self):
+        """Make listenRtp re-check its state now."""
+        try:
+            self.rtpWakeup[1].send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # a wakeup is already pending
 
     def startPlayback(self):
         """Bắt đầu phát video từ buffer"""
@@ -390,6 +549,7 @@ class Client:
 
         self.isPlaying = True
         self.playEvent.clear()
+        self.decoder.start()
 
         self.startTime = time.time() - self.pausedTime
 
@@ -406,6 +566,7 @@ class Client:
 
         self.isPlaying = False
         self.playEvent.set()
+        self.decoder.stop()
         self.pausedTime = self.currentPlaybackTime
 
     def playFromBuffer(self):
@@ -423,128 +584,409 @@ class Client:
             elapsed = currentTime - self.lastDisplayTime
 
             if elapsed >= self.currentFrameInterval:
-                if self.frameBuffer:
-                    # Lấy frame từ buffer
-                    frameNbr, frame_data = self.frameBuffer.popleft()
+                # Lấy frame đã giải mã sẵn từ decoder
+                wakeups = self.decoder.wakeups  # before the checks, so no wake() is missed
+                decoded = self.decoder.get()
+                if decoded is not None:
+                    traceStart = tracer.clock() if tracer.enabled else None
+                    frameNbr, image, frame_data = decoded
+                    if self.displaySwitch is not None and frameNbr >= self.displaySwitch[0]:
+                        # first frame of the new rendition
+                        self.applyRendition(self.displaySwitch[1])
+                        self.master.after(0, self.videoMode.set, self.displaySwitch[1])
+                        self.displaySwitch = None
+                        self.frameNbr = None
                     if self.frameNbr is not None and frameNbr != self.frameNbr + 1:
                         print(f"Lost frame(s) detected: expected {self.frameNbr + 1}, got {frameNbr}")
 
                     self.updateBufferLabel()
 
-                    # Ghi frame ra file tạm
-                    cachename = self.writeFrame(frame_data)
+                    # Ghi frame ra file tạm (chỉ khi debug)
+                    if self.dumpFrames:
+                        self.writeFrame(frame_data)
 
-                    # Cập nhật GUI
+                    # Cập nhật GUI, frame đã được giải mã ở luồng decoder
                     try:
-                        self.updateMovie(cachename)
+                        self.updateMovie(image)
                     except Exception as e:
                         print("Failed to update frame:", e)
 
                     self.frameNbr = frameNbr
                     print("Current Seq Num: ", self.frameNbr)
+                    self.updateSeekBar(frameNbr)
 
                     # Cập nhật thời gian phát
                     self.currentPlaybackTime = currentTime - self.startTime
                     self.updateTimeLabel()
 
                     self.lastDisplayTime = currentTime
+                    if traceStart is not None:
+                        tracer.complete("playFromBuffer", traceStart, 'client', frame=frameNbr)
 
                 else:
                     # Buffer rỗng
-                    if self.endVideo:
+                    if self.endVideo and self.bufferedFrames() == 0:
                         self.isPlaying = False
                         self.state = self.READY
                         self.master.after(0, self.updateButtons)
                         break
                     else:
-                        time.sleep(0.1)
+                        # until the decoder has a frame, playback stops or the video ends
+                        self.decoder.waitFrame(wakeups)
             else:
-                sleep_time = max(0.001, (self.currentFrameInterval - elapsed) / 2)
-                time.sleep(sleep_time)
+                # sleep until the frame is due; stopPlayback ends the wait early
+                self.playEvent.wait(self.currentFrameInterval - elapsed)
 
     # Yêu Cầu 1: Implement the RTSP protocol in the client and implement
     # the RTP packetization in the server.
 
     def setupMovie(self):
         if self.state == self.INIT:
+            if self.fecRatio and not self.described:
+                # FEC is asked for in DESCRIBE: SETUP once it is answered
+                self.sendRtspRequest(self.DESCRIBE).add_done_callback(lambda reply: self.setupMovie())
+                return
             self.sendRtspRequest(self.SETUP)
 
     def playMovie(self):
         if self.state == self.READY:
-            if len(self.frameBuffer) < self.MIN_BUFFER_FRAMES:
+            if self.bufferedFrames() < self.MIN_BUFFER_FRAMES:
                 threading.Thread(target=self.waitForBufferThenPlay, daemon=True).start()
             else:
                 self.bufferAndPlay()
 
-    def listenRtp(self):
-        """Nhận frames và đổ vào buffer."""
-        while self.isReceivingFrames:
-            try:
-                self.rtpSocket.settimeout(0.02)
-                data, addr = self.rtpSocket.recvfrom(65536)
+    def seekPressed(self, event):
+        self.seekDragging = True
 
-                if not data:
-                    continue
+    def seekReleased(self, event):
+        self.seekDragging = False
+        self.seekMovie(self.seekPosition.get())
 
-                # Kiểm tra END_OF_VIDEO
-                if data == b"END_OF_VIDEO":
-                    self.endVideo = True
-                    self.isReceivingFrames = False
-                    self.master.after(0, self.updateButtons)
-                    break
+    def updateSeekBar(self, frameNbr):
+        """Move the seek bar to the frame on screen, unless the user is dragging it."""
+        if not self.seekDragging:
+            position = (frameNbr - 1) * self.displayFrameTicks / RTP_CLOCK_RATE
+            self.master.after(0, self.seekPosition.set, position)
 
-                rtpPacket = RtpPacket()
-                rtpPacket.decode(data)
-                currFrameNbr = rtpPacket.seqNum()
-                markerBit = rtpPacket.marker()
-                payload = rtpPacket.getPayload()
+    def seekMovie(self, position):
+        """Continue from position (seconds): flush every buffer and PLAY from there."""
+        if self.state == self.INIT or self.seeking or self.switching or self.resuming:
+            return
+        if self.displaySwitch is not None:
+            # the frames of the old rendition are flushed below
+            self.applyRendition(self.displaySwitch[1])
+            self.master.after(0, self.videoMode.set, self.displaySwitch[1])
+            self.displaySwitch = None
+
+        self.seekResume = self.state == self.PLAYING
+        self.seeking = True
+        self.stopPlayback()
+        self.frameBuffer.clear()
+        self.decoder.clear()
 
-                self.calculate_bandwidth(len(data))
-                self.check_network_quality()
+        self.pausedTime = position
+        self.currentPlaybackTime = position
+        self.frameNbr = None
+        self.prevSeqNum = 0
+        self.sentStop = False  # pre-buffer again from the new position
+        self.startFrameReceiver()
+        reply = self.sendRtspRequest(self.PLAY, position)
+        reply.add_done_callback(self.seekAnswered)
+        cseq = self.rtspSeq
+        self.master.after(int(self.SEEK_TIMEOUT * 1000), self.expireReply, cseq)
+
+    def seekAnswered(self, reply):
+        """Done-callback of the seek's PLAY: give the seek up when it failed, seekDone handles a 200."""
+        if reply.exception() is None and reply.result().code == 200:
+            return
+        if not self.seeking:
+            return
+        print("RTSP: seek failed")
+        self.seeking = False
+        self.seekSeq = None
+        self.wakeListener()  # hand it the packets held during the seek
 
-                if currFrameNbr != self.currentFrameNum:
-                    self.rtpBuffer = b''
-                    self.currentFrameNum = currFrameNbr
+        if self.seekResume:
+            self.state = self.PLAYING
+            self.startPlayback()
+        self.master.after(0, self.updateButtons)
 
-                self.rtpBuffer += payload
+    def seekDone(self, headers):
+        """PLAY with Range acknowledged: wait for the RTP-Info seq, then resume if playing."""
+        info = parseRtpInfo(headers.get('rtp-info', ''))
+        self.seekSeq = int(info['seq']) if 'seq' in info else None
+        self.seeking = False
+        self.wakeListener()  # hand it the packets held during the seek
 
-                if markerBit == 1:
-                    self.lastFrameReceivedTime = time.time()
+        if self.seekResume:
+            self.state = self.PLAYING
+            self.startPlayback()
+        self.master.after(0, self.updateButtons)
+
+    def resumeDone(self, headers):
+        """PLAY acknowledged: the packets held for it go through once the skip to its RTP-Info seq is known."""
+        info = parseRtpInfo(headers.get('rtp-info', ''))
+        self.resumeSeq = int(info['seq']) if 'seq' in info else None
+        self.resuming = False
+        self.wakeListener()
+
+    def afterSeek(self, seq, extSeq):
+        """False for a packet sent before the last seek (older than its RTP-Info seq)."""
+        if self.seekSeq is not None:
+            if (seq - self.seekSeq) & 0xFFFF >= 0x8000:
+                return False
+            # first packet from the new position: drop what is left of the old one
+            self.seekFloor = extSeq - ((seq - self.seekSeq) & 0xFFFF)
+            self.seekSeq = None
+            self.frameBuffer.clear()
+            self.decoder.clear()
+            self.reassembler.reset()
+        return self.seekFloor is None or extSeq >= self.seekFloor
 
-                    self.analyze_frame_loss(currFrameNbr)
+    def listenRtp(self):
+        """Nhận frames và đổ vào buffer."""
+        # sleep in select until a packet, a wakeListener() or the deadline of a pending frame
+        selector = selectors.DefaultSelector()
+        self.rtpSocket.setblocking(False)
+        selector.register(self.rtpSocket, selectors.EVENT_READ)
+        selector.register(self.rtpWakeup[0], selectors.EVENT_READ)
+        if self.rtcpSocket is not None:
+            selector.register(self.rtcpSocket, selectors.EVENT_READ)
+        try:
+            while self.isReceivingFrames:
+                # ... or until the next receiver report or NACK is due
+                wakeAt = [self.reassembler.nextDeadline()]
+                if self.serverRtcpAddr is not None:
+                    wakeAt.append(self.nextReceiverReport)
+                    wakeAt.append(self.reassembler.nextNack(self.NACK_DELAY))
+                wakeAt = [t for t in wakeAt if t is not None]
+                events = selector.select(max(0.0, min(wakeAt) - time.time()) if wakeAt else None)
+                for key, _ in events:
+                    if key.fileobj is self.rtpWakeup[0]:
+                        self.rtpWakeup[0].recv(64)
+                    elif key.fileobj is self.rtcpSocket:
+                        self.receiveRtcp()
+                if not self.isReceivingFrames:
+                    break
+                now = time.time()
+                if self.serverRtcpAddr is not None and now >= self.nextReceiverReport:
+                    self.sendReceiverReport(now)
+                self.releaseHeldPackets()
+                # drop frames whose missing packets are past the deadline
+                for frameTs, frame in self.reassembler.poll(time.time()):
+                    self.frameAssembled(frameTs, frame)
+
+                # every datagram queued on the socket
+                while True:
+                    try:
+                        data = self.rtpSocket.recv(65536)
+                    except BlockingIOError:
+                        break
 
-                    if (len(self.frameBuffer) >= self.MIN_BUFFER_FRAMES
-                            and not self.sentStop
-                            and self.state == self.READY):
+                    if not data:
+                        continue
+
+                    # Kiểm tra END_OF_VIDEO
+                    if data == b"END_OF_VIDEO":
+                        if self.seeking or self.seekSeq is not None:
+                            continue  # end of the stream before the seek
+                        if self.switching or self.resuming:
+                            self.seekHeld.append(data)  # after the packets held for the reply
+                            continue
+                        self.videoEnded()
+                        break
 
-                        try:
-                            self.rtspSocket.sendall(b"STOP_STREAMING")
-                        except:
-                            print("Failed to send STOP_STREAMING")
+                    if self.seeking or self.switching or self.resuming:
+                        # RTP-Info not known yet, keep the packets until the PLAY / SET_PARAMETER reply
+                        if len(self.seekHeld) < self.MAX_HELD_PACKETS:
+                            self.seekHeld.append(data)
+                        continue
+                    self.releaseHeldPackets()
+                    self.receiveRtp(data)
+
+                if self.serverRtcpAddr is not None:
+                    self.sendNacks(time.time())
+        except OSError:
+            pass  # sockets closed by stopFrameReceiver or teardown
+        except Exception:
+            traceback.print_exc()
+        finally:
+            selector.close()
+
+        if self.state == self.READY and self.bufferedFrames() > 0:
+            self.master.after(0, self.updateButtons)
 
-                        self.sentStop = True
-                        self.master.after(0, self.updateButtons)
+    def videoEnded(self):
+        """END_OF_VIDEO received: stop listening, wake whoever waits for more frames."""
+        self.endVideo = True
+        self.isReceivingFrames = False
+        with self.bufferCond:
+            self.bufferCond.notify_all()
+        self.decoder.wake()
+        self.master.after(0, self.updateButtons)
+
+    def receiveRtcp(self):
+        """Read the RTCP packets queued on rtcpSocket, keeping the time of the last sender report."""
+        while True:
+            try:
+                data = self.rtcpSocket.recv(2048)
+            except OSError:
+                return  # BlockingIOError: nothing left
+            try:
+                reports = Rtcp.parse(data)
+            except ValueError:
+                continue
+            for report in reports:
+                if isinstance(report, SenderReport):
+                    self.lastSenderReport = (ntpMiddle(report.ntp), time.time())
+
+    def sendReceiverReport(self, now):
+        """Send an RTCP RR about the server's stream: loss, extended highest sequence number, jitter, last SR."""
+        self.nextReceiverReport = now + self.RTCP_INTERVAL
+        if self.serverSsrc is None:
+            return
+        lsr = dlsr = 0
+        if self.lastSenderReport is not None:
+            lsr, arrival = self.lastSenderReport
+            dlsr = int((now - arrival) * 65536)
+        block = self.rtpStats.reportBlock(self.serverSsrc, lsr, dlsr)
+        try:
+            self.rtcpSocket.sendto(ReceiverReport(self.ssrc, [block]).pack(), self.serverRtcpAddr)
+        except OSError:
+            pass
+
+    def sendNacks(self, now):
+        """Send an RTCP NACK for the packets missing for NACK_DELAY."""
+        lost = self.reassembler.nacks(now, self.NACK_DELAY)
+        if not lost or self.serverSsrc is None:
+            return
+        try:
+            self.rtcpSocket.sendto(GenericNack(self.ssrc, self.serverSsrc, lost).pack(), self.serverRtcpAddr)
+        except OSError:
+            return
+        self.nacksSent += len(lost)
+
+    def receiveRtp(self, data):
+        """Feed one RTP packet to the reassembler and buffer the frames it completes."""
+        traceStart = tracer.clock() if tracer.enabled else None
+        arrival = time.time()
+        rtpPacket = RtpPacket.parse(data)
+        if rtpPacket.payloadType == FEC_PT:
+            self.receiveFec(rtpPacket, len(data), arrival)
+            return
+        if rtpPacket.payloadType == RTX_PT:
+            self.receiveRetransmission(rtpPacket, len(data), arrival)
+            return
+        self.serverSsrc = rtpPacket.ssrc
+        extSeq = self.rtpStats.update(rtpPacket.seqNum)
+        if extSeq is None:
+            return  # bogus sequence jump
+        if not self.afterSeek(rtpPacket.seqNum, extSeq):
+            return  # sent before the seek
+        extTs = self.rtpStats.unwrapTimestamp(rtpPacket.timestamp)
+        self.rtpStats.updateJitter(extTs, arrival * RTP_CLOCK_RATE)
+
+        self.calculate_bandwidth(len(data))
+        self.check_network_quality()
+
+        # ghép các gói (có thể đến không đúng thứ tự) thành frame
+        for frameTs, frame in self.reassembler.add(extSeq, extTs, rtpPacket.marker,
+                                                   rtpPacket.payload, arrival):
+            self.frameAssembled(frameTs, frame)
+        if traceStart is not None:
+            tracer.complete("receiveRtp", traceStart, 'client', ssrc=rtpPacket.ssrc,
+                            frame=extTs // self.rtpFrameTicks + 1, seq=rtpPacket.seqNum)
+
+    def receiveFec(self, rtpPacket, size, arrival):
+        """Give a FEC packet to the reassembler, which rebuilds the lost packet of its group if only one is."""
+        try:
+            fec = FecPacket.parse(rtpPacket.payload)
+        except ValueError:
+            return
+        if self.rtpStats.baseSeq is None or not fec.offsets:
+            return
+        base = self.rtpStats.extend(fec.snBase)
+        if not self.afterSeek(fec.snBase, base):
+            return  # protects packets sent before the seek
+        extTs = self.rtpStats.unwrapTimestamp(rtpPacket.timestamp)
+        self.calculate_bandwidth(size)
+        for frameTs, frame in self.reassembler.addFec([base + offset for offset in fec.offsets], extTs, fec,
+                                                      arrival):
+            self.frameAssembled(frameTs, frame)
+
+    def receiveRetransmission(self, rtpPacket, size, arrival):
+        """Give a packet sent again after a NACK to the reassembler under its original sequence number."""
+        payload = rtpPacket.payload
+        if len(payload) < 2 or self.rtpStats.baseSeq is None:
+            return
+        seq = payload[0] << 8 | payload[1]
+        extSeq = self.rtpStats.extend(seq)
+        if not self.afterSeek(seq, extSeq):
+            return
+        extTs = self.rtpStats.unwrapTimestamp(rtpPacket.timestamp)
+        self.calculate_bandwidth(size)
+        self.retransmitted += 1
+        for frameTs, frame in self.reassembler.add(extSeq, extTs, rtpPacket.marker, payload[2:], arrival):
+            self.frameAssembled(frameTs, frame)
+
+    def releaseHeldPackets(self):
+        """Process the packets received while a seek, a rendition switch or a resume was waiting for its reply."""
+        if self.resumeSeq is not None and not self.resuming:
+            # not lost and not worth a NACK: sent to the other viewers while paused
+            seq, self.resumeSeq = self.resumeSeq, None
+            extSeq = self.rtpStats.skipTo(seq)
+            if extSeq is not None:
+                self.reassembler.skipTo(extSeq)
+        if self.seekHeld and not self.seeking and not self.switching and not self.resuming:
+            held, self.seekHeld = self.seekHeld, []
+            for data in held:
+                if data == b"END_OF_VIDEO":
+                    self.videoEnded()
+                    break
+                self.receiveRtp(data)
 
-                    # Thêm frame vào buffer
-                    if len(self.frameBuffer) < self.bufferSize:
-                        self.frameBuffer.append((currFrameNbr, self.rtpBuffer))
-                        self.updateBufferLabel()
+    def frameAssembled(self, frameTs, frame):
+        """Put a reassembled frame in the buffer."""
+        if self.renditionSwitch is not None:
+            switchTs, mode = self.renditionSwitch
+            if (frameTs - switchTs) & 0xFFFFFFFF < 0x80000000:
+                # first frame of the new rendition: its frame rate numbers the frames from here on
+                self.renditionSwitch = None
+                self.rtpFrameTicks = RTP_CLOCK_RATE // self.FRAME_RATES.get(mode, 24)
+                self.prevSeqNum = 0
+                self.displaySwitch = (frameTs // self.rtpFrameTicks + 1, mode)
 
-                        self.total_frames_received += 1
+        # frame number from the 90 kHz media timestamp
+        currFrameNbr = frameTs // self.rtpFrameTicks + 1
+        self.lastFrameReceivedTime = time.time()
 
-                        if self.state == self.READY and len(self.frameBuffer) >= self.MIN_BUFFER_FRAMES:
-                            self.master.after(0, self.updateButtons)
+        self.analyze_frame_loss(currFrameNbr)
 
-                    self.rtpBuffer = b''
+        if (self.bufferedFrames() >= self.MIN_BUFFER_FRAMES
+                and not self.sentStop
+                and self.state == self.READY):
 
-            except socket.timeout:
-                continue
+            try:
+                self.rtspSocket.sendall(b"STOP_STREAMING")
             except:
-                break
+                print("Failed to send STOP_STREAMING")
 
-        if self.state == self.READY and len(self.frameBuffer) > 0:
+            self.sentStop = True
             self.master.after(0, self.updateButtons)
 
+        # Thêm frame vào buffer
+        if self.bufferedFrames() < self.bufferSize:
+            self.frameBuffer.append((currFrameNbr, frame))
+            self.decoder.wake()
+            with self.bufferCond:
+                self.bufferCond.notify_all()
+            self.updateBufferLabel()
+
+            self.total_frames_received += 1
+
+            if self.state == self.READY and self.bufferedFrames() >= self.MIN_BUFFER_FRAMES:
+                self.master.after(0, self.updateButtons)
+
     def exitClient(self):
         """Teardown button handler."""
         if self.state != self.INIT:
@@ -552,7 +994,9 @@ class Client:
             self.stopFrameReceiver()
             self.stopPlayback()
 
-            os.remove(CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT)
+            cachename = CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT
+            if self.dumpFrames and os.path.exists(cachename):
+                os.remove(cachename)
             self.master.destroy()
 
         self.print_statistics()
@@ -575,18 +1019,24 @@ class Client:
             self.sendRtspRequest(self.DESCRIBE)
 
     def writeFrame(self, data):
-        """Write the received frame to a temp image file. Return the image file."""
-        cachename = CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT
-        file = open(cachename, "wb")
-        file.write(data)
-        file.close()
+        """Write the received frame to a temp image file (debug only). Return the image file."""
+        with tracer.span("writeFrame", 'client'):
+            cachename = CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT
+            file = open(cachename, "wb")
+            file.write(data)
+            file.close()
         return cachename
 
-    def updateMovie(self, imageFile):
-        """Update the image file as video frame in the GUI."""
-        photo = ImageTk.PhotoImage(Image.open(imageFile))
-        self.label.configure(image=photo, height=288)
-        self.label.image = photo
+    def onVideoResize(self, event):
+        """Decode the next frames for the new size of the video widget."""
+        self.decoder.setTargetSize((event.width, self.DISPLAY_HEIGHT))
+
+    def updateMovie(self, image):
+        """Show a decoded frame in the GUI."""
+        with tracer.span("updateMovie", 'client'):
+            photo = ImageTk.PhotoImage(image)
+            self.label.configure(image=photo, height=self.DISPLAY_HEIGHT)
+            self.label.image = photo
 
     def connectToServer(self):
         """Connect to the Server. Start a new RTSP/TCP session."""
@@ -595,75 +1045,116 @@ class Client:
             self.rtspSocket.connect((self.serverAddr, self.serverPort))
         except:
             tkMessageBox.showwarning('Connection Failed', 'Connection to \'%s\' failed.' % self.serverAddr)
+            return
+        # replies to DESCRIBE can come before SETUP
+        threading.Thread(target=self.recvRtspReply, daemon=True).start()
 
-    def sendRtspRequest(self, requestCode):
-        """Send RTSP request to the server."""
+    def sendRtspRequest(self, requestCode, position=None, mode=None):
+        """Send RTSP request to the server; a PLAY with position (seconds) seeks, a SET_PARAMETER switches to rendition mode."""
         # Update RTSP sequence number
         self.rtspSeq += 1
 
         # SETUP request
         if requestCode == self.SETUP and self.state == self.INIT:
-            threading.Thread(target=self.recvRtspReply, daemon=True).start()
-            request = f"SETUP {self.fileName} RTSP/1.0\r\nCSeq: {self.rtspSeq}\r\nTransport: RTP/UDP; client_port={self.rtpPort}"
+            request = formatRequest("SETUP", self.fileName, self.rtspSeq,
+                                    f"Transport: RTP/UDP; client_port={self.rtpPort}-{self.rtpPort + 1}")
             self.requestSent = self.SETUP
 
         # PLAY request
-        elif requestCode == self.PLAY and self.state == self.READY:
-            request = f"PLAY {self.fileName} RTSP/1.0\r\nCSeq: {self.rtspSeq}\r\nSession: {self.sessionId}"
+        elif requestCode == self.PLAY and (self.state == self.READY or position is not None):
+            headers = [f"Session: {self.sessionId}"]
+            if position is not None:
+                headers.append(f"Range: npt={position:.3f}-")
+            request = formatRequest("PLAY", self.fileName, self.rtspSeq, *headers)
             self.requestSent = self.PLAY
 
         # PAUSE request
         elif requestCode == self.PAUSE and self.state == self.PLAYING:
-            request = f"PAUSE {self.fileName} RTSP/1.0\r\nCSeq: {self.rtspSeq}\r\nSession: {self.sessionId}"
+            request = formatRequest("PAUSE", self.fileName, self.rtspSeq, f"Session: {self.sessionId}")
             self.requestSent = self.PAUSE
 
         # TEARDOWN request
         elif requestCode == self.TEARDOWN and self.state != self.INIT:
-            request = f"TEARDOWN {self.fileName} RTSP/1.0\r\nCSeq: {self.rtspSeq}\r\nSession: {self.sessionId}"
+            request = formatRequest("TEARDOWN", self.fileName, self.rtspSeq, f"Session: {self.sessionId}")
             self.requestSent = self.TEARDOWN
 
         # DESCRIBE request
         elif requestCode == self.DESCRIBE:
-            request = (f"DESCRIBE {self.fileName} RTSP/1.0\r\nCSeq: {self.rtspSeq}\r\n"
-                       f"Mode: {self.videoMode.get()}")
+            headers = [f"Mode: {self.videoMode.get()}"]
+            if self.fecRatio:
+                headers.append(f"FEC: {self.fecRatio}")
+            request = formatRequest("DESCRIBE", self.fileName, self.rtspSeq, *headers)
             self.requestSent = self.DESCRIBE
+            self.described = True
+
+        # SET_PARAMETER request
+        elif requestCode == self.SET_PARAMETER and self.state != self.INIT:
+            request = formatRequest("SET_PARAMETER", self.fileName, self.rtspSeq,
+                                    f"Session: {self.sessionId}", f"Mode: {mode}")
+            self.requestSent = self.SET_PARAMETER
+
+        # resolved by parseRtspReply with the reply of this CSeq
+        reply = self.rtspReplies[self.rtspSeq] = Future()
 
         # Send the RTSP request
         self.rtspSocket.sendall(request.encode("utf-8"))
         print('\nData sent:\n' + request)
+        return reply
 
     def recvRtspReply(self):
         """Receive RTSP reply from the server."""
         while True:
-            reply = self.rtspSocket.recv(1024)
-            if reply:
-                self.parseRtspReply(reply.decode("utf-8"))
+            try:
+                reply = self.rtspSocket.recv(1024)
+            except OSError:
+                reply = b""
+            if not reply:
+                break  # server closed the connection
+            self.parseRtspReply(reply.decode("utf-8"))
             if self.requestSent == self.TEARDOWN:
                 self.rtspSocket.shutdown(socket.SHUT_RDWR)
                 self.rtspSocket.close()
                 break
+        # no reply will come for the requests still waiting
+        for cseq in list(self.rtspReplies):
+            self.expireReply(cseq)
+
+    def expireReply(self, cseq):
+        """Fail the Future of request cseq if it is still unanswered."""
+        future = self.rtspReplies.pop(cseq, None)
+        if future is not None:
+            future.set_exception(ConnectionError(f"no reply to CSeq {cseq}"))
 
     def parseRtspReply(self, data):
         """Parse the RTSP reply from the server."""
-        lines = data.split('\n')
-        seqNum = int(lines[1].split(' ')[1])
+        reply = parseReply(data)
+        headers = reply.headers  # Range, RTP-Info, ...
 
-        if seqNum == self.rtspSeq:
-            session = int(lines[2].split(' ')[1])
+        if reply.cseq == self.rtspSeq:
+            session = reply.session
             if self.sessionId == 0:
                 self.sessionId = session
 
             if self.sessionId == session:
-                if int(lines[0].split(' ')[1]) == 200:
+                if reply.code == 200:
                     if self.requestSent == self.SETUP:
                         print("RTSP State: READY")
+                        self.setDuration(headers.get('range', ''))
+                        self.setServerRtcp(headers.get('transport', ''))
+                        bitrates = RateAdapter.parseHeader(headers.get('renditions', ''))
+                        if len(bitrates) > 1:
+                            self.rateAdapter = RateAdapter(bitrates, self.videoMode.get())
                         self.state = self.READY
                         self.updateButtons()
                         self.openRtpPort()
                         self.startFrameReceiver()
+                    elif self.requestSent == self.PLAY and self.seeking:
+                        print("RTSP: seek done,", headers.get('range', ''))
+                        self.seekDone(headers)
                     elif self.requestSent == self.PLAY:
                         self.state = self.PLAYING
                         print("RTSP State: PLAYING")
+                        self.resumeDone(headers)
                         self.updateButtons()
                     elif self.requestSent == self.PAUSE:
                         self.state = self.READY
@@ -675,8 +1166,30 @@ class Client:
                         self.updateButtons()
                         self.teardownAcked = 1
 
+        future = self.rtspReplies.pop(reply.cseq, None)
+        if future is not None:
+            future.set_result(reply)
+
+    def setDuration(self, npt):
+        """Size the seek bar from a 'npt=0.000-<end>' range."""
+        try:
+            self.duration = float(npt.split('-', 1)[1])
+        except (IndexError, ValueError):
+            self.duration = 0.0
+        self.master.after(0, self.seekBar.config, {'to': self.duration})
+
+    def setServerRtcp(self, transport):
+        """Send receiver reports to the RTCP port of the Transport header's server_port=rtp-rtcp."""
+        for param in transport.split(';'):
+            name, sep, value = param.strip().partition('=')
+            if name == 'server_port' and sep and '-' in value:
+                try:
+                    self.serverRtcpAddr = (self.serverAddr, int(value.split('-')[1]))
+                except ValueError:
+                    pass
+
     def openRtpPort(self):
-        """Open RTP socket bound to the client rtpPort."""
+        """Open RTP socket bound to the client rtpPort, and the RTCP socket on rtpPort + 1."""
         self.rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.rtpSocket.settimeout(0.5)
         try:
@@ -685,6 +1198,16 @@ class Client:
         except:
             tkMessageBox.showwarning('Unable to Bind', 'Unable to bind RTP PORT=%d' % self.rtpPort)
 
+        self.rtcpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self.rtcpSocket.bind(('', self.rtpPort + 1))
+            self.rtcpSocket.setblocking(False)
+        except OSError:
+            print("Unable to bind RTCP port", self.rtpPort + 1, "- no receiver reports")
+            self.rtcpSocket.close()
+            self.rtcpSocket = None
+            self.serverRtcpAddr = None
+
     def handler(self):
         """Handler on explicitly closing the GUI window."""
         self.stopPlayback()
@@ -693,5 +1216,5 @@ class Client:
         if tkMessageBox.askokcancel("Quit?", "Are you sure you want to quit?"):
             self.exitClient()
         else:  # When the user presses cancel, resume playing
-            if self.state == self.READY and len(self.frameBuffer) > 0:
+            if self.state == self.READY and self.bufferedFrames() > 0:
                 self.startPlayback()
\ No newline at end of file
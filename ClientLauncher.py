@@ -1,6 +1,7 @@
 import sys
 from tkinter import Tk
 from Client import Client
+from Tracing import tracer
 
 if __name__ == "__main__":
     try:
@@ -9,11 +10,25 @@ if __name__ == "__main__":
         rtpPort = sys.argv[3]
         fileName = sys.argv[4]
     except:
-        print("[Usage: ClientLauncher.py Server_name Server_port RTP_port Video_file]\n")
+        print("[Usage: ClientLauncher.py Server_name Server_port RTP_port Video_file [--dump-frames] [--full-decode] [--trace FILE] [--fec RATIO]]\n")
+
+    # debug: keep writing frames to cache-<session>.jpg
+    dumpFrames = '--dump-frames' in sys.argv[5:]
+    # decode every frame at full resolution instead of at the window size
+    fullDecode = '--full-decode' in sys.argv[5:]
+    # record receive/decode/display spans to a Chrome trace file
+    if '--trace' in sys.argv[5:-1]:
+        tracer.start(sys.argv[sys.argv.index('--trace', 5) + 1], "RTP client")
+
+    # ask for FEC packets in DESCRIBE, e.g. 0.25 for one per 4 RTP packets
+    fecRatio = None
+    if '--fec' in sys.argv[5:-1]:
+        fecRatio = sys.argv[sys.argv.index('--fec', 5) + 1]
 
     root = Tk()
 
     # Create a new client
-    app = Client(root, serverAddr, serverPort, rtpPort, fileName)
+    app = Client(root, serverAddr, serverPort, rtpPort, fileName, dumpFrames=dumpFrames, fullDecode=fullDecode,
+                 fecRatio=fecRatio)
     app.master.title("RTPClient")
     root.mainloop()
@@ -0,0 +1,130 @@
+import struct
+from random import randint
+from RtpPacket import RTP_HEADER
+
+# payload type of the FEC packets, sent on the RTP port next to the media packets
+FEC_PT = 127
+# a FEC packet protects at most 16 consecutive media packets (16-bit mask, L = 0)
+MAX_GROUP = 16
+
+# E/L/P/X/CC recovery, M/PT recovery, SN base, TS recovery, length recovery (RFC 5109 section 7.3)
+FEC_HEADER = struct.Struct('!BBHIH')
+# level 0 ULP header: protection length, mask of the packets SN base + 0 .. 15 (section 7.4)
+ULP_HEADER = struct.Struct('!HH')
+
+
+def groupSize(ratio):
+    """Media packets per FEC packet for an overhead ratio such as '0.25' or '1/4'; 0 turns FEC off.
+
+    Raises ValueError for a ratio that is not a number between 0 and 1,
+    including a fraction with a zero or negative denominator.
+    """
+    ratio = ratio.strip()
+    if '/' in ratio:
+        num, den = map(float, ratio.split('/', 1))
+        if den <= 0 or num < 0:
+            raise ValueError(f"FEC ratio {ratio} out of range")
+        ratio = num / den
+    else:
+        ratio = float(ratio)
+    if not 0 <= ratio <= 1:
+        raise ValueError(f"FEC ratio {ratio} out of range")
+    if ratio == 0:
+        return 0
+    return max(1, min(MAX_GROUP, round(1 / ratio)))
+
+
+def xorPayloads(payloads, length):
+    """XOR of payloads, each padded with zeros to length bytes."""
+    acc = 0
+    for payload in payloads:
+        acc ^= int.from_bytes(payload, 'big') << (8 * (length - len(payload)))
+    return acc.to_bytes(length, 'big')
+
+
+class FecEncoder:
+    """Builds the XOR parity packets of the RTP packets of a frame.
+
+    The packets of a frame are split into groups of at most `group` packets
+    (as even as possible, groups never span frames) and each group gets one
+    FEC packet: the XOR of its payloads and of the header fields needed to
+    rebuild any single packet of the group. FEC packets have their own
+    sequence numbers and the media timestamp of the frame.
+    """
+
+    def __init__(self, group, ssrc, pt=FEC_PT):
+        self.group = group
+        self.ssrc = ssrc
+        self.pt = pt
+        self.seq = randint(0, 0xFFFF)
+
+    def protect(self, packets):
+        """Return the (header, payload) FEC packets of a frame's (header, payload) RTP packets."""
+        count = len(packets)
+        if not count:
+            return []
+        groups = (count + self.group - 1) // self.group
+        fec = []
+        start = 0
+        for index in range(groups):
+            end = start + (count - start) // (groups - index)
+            fec.append(self.protectGroup(packets[start:end]))
+            start = end
+        return fec
+
+    def protectGroup(self, packets):
+        byte0 = byte1 = timestamp = length = 0
+        payloads = []
+        for header, payload in packets:
+            byte0 ^= header[0]
+            byte1 ^= header[1]
+            timestamp ^= int.from_bytes(header[4:8], 'big')
+            length ^= len(payload)
+            payloads.append(payload)
+        first = packets[0][0]
+        protection = max(len(payload) for payload in payloads)
+        mask = (0xFFFF << (MAX_GROUP - len(packets))) & 0xFFFF
+        body = (FEC_HEADER.pack(byte0 & 0x3F, byte1, int.from_bytes(first[2:4], 'big'), timestamp, length)
+                + ULP_HEADER.pack(protection, mask) + xorPayloads(payloads, protection))
+        header = RTP_HEADER.pack(0x80, self.pt, self.seq, int.from_bytes(first[4:8], 'big'), self.ssrc)
+        self.seq = (self.seq + 1) & 0xFFFF
+        return header, body
+
+
+class FecPacket:
+    """Payload of a received FEC packet."""
+    __slots__ = ('snBase', 'offsets', 'byte1', 'timestamp', 'length', 'block')
+
+    def __init__(self, snBase, offsets, byte1, timestamp, length, block):
+        self.snBase = snBase    # 16-bit sequence number of the first protected packet
+        self.offsets = offsets  # protected packets, as offsets from snBase
+        self.byte1 = byte1      # XOR of the M/PT bytes
+        self.timestamp = timestamp
+        self.length = length    # XOR of the payload lengths
+        self.block = block      # XOR of the payloads
+
+    @classmethod
+    def parse(cls, payload):
+        """Raises ValueError on a malformed FEC payload."""
+        if len(payload) < FEC_HEADER.size + ULP_HEADER.size:
+            raise ValueError("FEC packet too short")
+        byte0, byte1, snBase, timestamp, length = FEC_HEADER.unpack_from(payload, 0)
+        if byte0 & 0xC0:
+            raise ValueError("FEC packet with E or L set")
+        protection, mask = ULP_HEADER.unpack_from(payload, FEC_HEADER.size)
+        block = payload[FEC_HEADER.size + ULP_HEADER.size:]
+        if len(block) != protection:
+            raise ValueError("FEC protection length does not match the packet")
+        offsets = [i for i in range(MAX_GROUP) if mask & (0x8000 >> i)]
+        return cls(snBase, offsets, byte1, timestamp, length, block)
+
+    def recover(self, others):
+        """(marker, payload) of the one protected packet missing from others, a list of (marker, payload)."""
+        byte1, length = self.byte1, self.length
+        for marker, payload in others:
+            byte1 ^= 0x80 if marker else 0
+            length ^= len(payload)
+        if length > len(self.block):
+            return None
+        payload = xorPayloads([self.block] + [payload for _, payload in others], len(self.block))
+        return bool(byte1 & 0x80), payload[:length]
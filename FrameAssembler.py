@@ -0,0 +1,215 @@
+JPEG_SOI = b'\xff\xd8'
+
+
+class PendingFrame:
+    """Packets received so far for one frame (one RTP timestamp)."""
+    __slots__ = ('parts', 'firstSeq', 'lastSeq', 'startsFrame', 'arrival', 'last', 'fec')
+
+    def __init__(self, arrival):
+        self.parts = {}          # extended sequence number -> payload
+        self.firstSeq = None     # lowest sequence number received
+        self.lastSeq = None      # sequence number of the marker packet
+        self.startsFrame = False  # the packet at firstSeq is the first fragment
+        self.arrival = arrival
+        self.last = arrival      # arrival of the latest packet
+        self.fec = []            # (protected sequence numbers, FecPacket) not used yet
+
+
+class FrameAssembler:
+    """Rebuilds frames from RTP packets that may arrive out of order.
+
+    Packets are grouped by extended timestamp and ordered by extended
+    sequence number. A frame is complete when its marker packet, its first
+    fragment and everything in between have arrived; the first fragment is
+    recognised by following the previous frame's marker packet or by the
+    JPEG start-of-image bytes. A packet lost from a group protected by a FEC
+    packet (Fec.py) is rebuilt as soon as the rest of its group is in. Frames
+    are handed out in timestamp order, and a frame still incomplete `deadline`
+    seconds after its first packet is dropped. Sequence numbers skipped by
+    the packets received are kept until they arrive, to be NACKed, and a
+    complete frame waits for those before it (a lost frame may be resent)
+    until they are `deadline` seconds old.
+    """
+
+    # longest run of skipped sequence numbers worth asking for again
+    MAX_GAP = 256
+
+    def __init__(self, deadline=0.2, maxPending=32):
+        self.deadline = deadline
+        self.maxPending = maxPending
+        self.reset()
+
+        self.completed = 0
+        self.reordered = 0   # packets older than one already received
+        self.late = 0        # packets of a frame already handed out or dropped
+        self.incomplete = 0  # frames dropped at the deadline
+        self.duplicates = 0
+        self.recovered = 0   # packets rebuilt from FEC packets
+        # packet trains: bytes of complete frames after their first packet, and
+        # the time from their first to their last packet (RateAdapter)
+        self.trainBytes = 0
+        self.trainSeconds = 0.0
+
+    def reset(self):
+        """Forget every pending frame (after a seek)."""
+        self.pending = {}        # extended timestamp -> PendingFrame
+        self.lastTimestamp = None  # last frame handed out or dropped
+        self.lastEndSeq = None   # marker sequence number of that frame, when known
+        self.highestSeq = None
+        self.missing = {}        # skipped sequence number -> time it was found missing, oldest first
+        self.nacked = set()      # those already returned by nacks
+
+    def add(self, seq, timestamp, marker, payload, now):
+        """Add one packet; return the [(timestamp, frame bytes)] now ready, oldest first."""
+        if self.lastTimestamp is not None and timestamp <= self.lastTimestamp:
+            self.late += 1
+            if self.missing.pop(seq, None) is not None:
+                self.nacked.discard(seq)
+            return self.poll(now)
+
+        if self.highestSeq is None or seq > self.highestSeq:
+            if self.highestSeq is not None and seq - self.highestSeq - 1 <= self.MAX_GAP:
+                missing = self.missing
+                # oldest first: drop those past the deadline, nobody asked for them
+                while missing:
+                    oldest = next(iter(missing))
+                    if now - missing[oldest] < self.deadline:
+                        break
+                    del missing[oldest]
+                    self.nacked.discard(oldest)
+                for skipped in range(self.highestSeq + 1, seq):
+                    missing[skipped] = now
+            self.highestSeq = seq
+        else:
+            self.reordered += 1
+
+        frame = self.pending.get(timestamp)
+        if frame is None:
+            frame = self.pending[timestamp] = PendingFrame(now)
+        if seq in frame.parts:
+            self.duplicates += 1
+            return self.poll(now)
+
+        self.insert(frame, seq, marker, payload, now)
+        if frame.fec:
+            self.repair(frame, now)
+        return self.poll(now)
+
+    def addFec(self, seqs, timestamp, fec, now):
+        """Add a FecPacket protecting the packets seqs (extended) of frame timestamp; return the frames now ready."""
+        if self.lastTimestamp is not None and timestamp <= self.lastTimestamp:
+            return self.poll(now)  # handed out or dropped already
+        frame = self.pending.get(timestamp)
+        if frame is None:
+            frame = self.pending[timestamp] = PendingFrame(now)
+        frame.fec.append((seqs, fec))
+        self.repair(frame, now)
+        return self.poll(now)
+
+    def insert(self, frame, seq, marker, payload, now):
+        if self.missing.pop(seq, None) is not None:
+            self.nacked.discard(seq)
+        frame.parts[seq] = payload
+        frame.last = now
+        if frame.firstSeq is None or seq < frame.firstSeq:
+            frame.firstSeq = seq
+            frame.startsFrame = bytes(payload[:2]) == JPEG_SOI
+        if marker:
+            frame.lastSeq = seq
+
+    def repair(self, frame, now):
+        """Rebuild the packet of each FEC group of frame that misses exactly one."""
+        waiting = []
+        for seqs, fec in frame.fec:
+            missing = [seq for seq in seqs if seq not in frame.parts]
+            if len(missing) > 1:
+                waiting.append((seqs, fec))
+                continue
+            if not missing:
+                continue
+            others = [(seq == frame.lastSeq, frame.parts[seq]) for seq in seqs if seq != missing[0]]
+            packet = fec.recover(others)
+            if packet is not None:
+                self.insert(frame, missing[0], packet[0], packet[1], now)
+                self.recovered += 1
+        frame.fec = waiting
+
+    def poll(self, now):
+        """Hand out the frames that are complete or past their deadline, in timestamp order."""
+        ready = []
+        while self.pending:
+            timestamp = min(self.pending)
+            frame = self.pending[timestamp]
+            if self.isComplete(frame):
+                if self.waitsForMissing(frame, now):
+                    break
+                data = self.join(frame)
+                ready.append((timestamp, data))
+                self.completed += 1
+                if len(frame.parts) > 1:
+                    self.trainBytes += len(data) - len(frame.parts[frame.firstSeq])
+                    self.trainSeconds += frame.last - frame.arrival
+            elif now - frame.arrival > self.deadline or len(self.pending) > self.maxPending:
+                self.incomplete += 1
+                if frame.parts:
+                    self.forgetMissing(max(frame.parts))
+            else:
+                break
+            del self.pending[timestamp]
+            self.lastTimestamp = timestamp
+            self.lastEndSeq = frame.lastSeq
+        return ready
+
+    def waitsForMissing(self, frame, now):
+        """True while a sequence number before frame, and after the last frame handed out, may still arrive."""
+        for seq, since in self.missing.items():
+            if (seq < frame.firstSeq and now - since < self.deadline
+                    and (self.lastEndSeq is None or seq > self.lastEndSeq)):
+                return True
+        return False
+
+    def skipTo(self, seq):
+        """The sender continues at seq: the sequence numbers skipped before it are not missing."""
+        if self.highestSeq is not None and seq - 1 > self.highestSeq:
+            self.highestSeq = seq - 1
+
+    def forgetMissing(self, upTo):
+        """Stop waiting for the missing sequence numbers up to upTo (their frame is gone)."""
+        for seq in [seq for seq in self.missing if seq <= upTo]:
+            del self.missing[seq]
+            self.nacked.discard(seq)
+
+    def nacks(self, now, delay):
+        """Sequence numbers missing for delay seconds, each returned once; those past the deadline are forgotten."""
+        due = []
+        for seq, since in list(self.missing.items()):
+            if now - since >= self.deadline:
+                del self.missing[seq]
+                self.nacked.discard(seq)
+            elif now - since >= delay and seq not in self.nacked:
+                self.nacked.add(seq)
+                due.append(seq)
+        return due
+
+    def nextNack(self, delay):
+        """Time at which nacks(now, delay) has something to return or forget, None if nothing is missing."""
+        times = [since + (self.deadline if seq in self.nacked else delay) for seq, since in self.missing.items()]
+        return min(times) if times else None
+
+    def nextDeadline(self):
+        """Time (clock of `now`) at which poll drops the oldest pending frame, None if nothing is pending."""
+        if not self.pending:
+            return None
+        return self.pending[min(self.pending)].arrival + self.deadline
+
+    def isComplete(self, frame):
+        if frame.lastSeq is None:
+            return False
+        startKnown = frame.startsFrame or (self.lastEndSeq is not None and frame.firstSeq == self.lastEndSeq + 1)
+        return startKnown and len(frame.parts) == frame.lastSeq - frame.firstSeq + 1
+
+    @staticmethod
+    def join(frame):
+        """Assemble the payloads in sequence order with a single join."""
+        parts = frame.parts
+        return b''.join([parts[seq] for seq in range(frame.firstSeq, frame.lastSeq + 1)])
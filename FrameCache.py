@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class FrameCache:
+    """Size-bounded LRU cache of frames shared by every VideoStream in the process."""
+
+    def __init__(self, maxBytes=DEFAULT_CACHE_BYTES):
+        self.maxBytes = maxBytes
+        self.frames = OrderedDict()  # (filename, mode, frameNum) -> bytes
+        self.currentBytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached frame for key, or None."""
+        with self.lock:
+            data = self.frames.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self.frames.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        """Store a frame, evicting the least recently used ones to stay under maxBytes."""
+        size = len(data)
+        if size > self.maxBytes:
+            return
+        with self.lock:
+            old = self.frames.pop(key, None)
+            if old is not None:
+                self.currentBytes -= len(old)
+            self.frames[key] = data
+            self.currentBytes += size
+            while self.currentBytes > self.maxBytes:
+                _, evicted = self.frames.popitem(last=False)
+                self.currentBytes -= len(evicted)
+                self.evictions += 1
+
+    def resize(self, maxBytes):
+        """Change the size limit; 0 disables the cache."""
+        with self.lock:
+            self.maxBytes = maxBytes
+            while self.frames and self.currentBytes > self.maxBytes:
+                _, evicted = self.frames.popitem(last=False)
+                self.currentBytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.currentBytes = 0
+
+    def stats(self):
+        """Return the cache counters."""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'frames': len(self.frames),
+                'bytes': self.currentBytes,
+                'max_bytes': self.maxBytes,
+            }
+
+
+# Cache shared by all sessions of the server process
+sharedFrameCache = FrameCache()
@@ -0,0 +1,157 @@
+import io, threading, time
+from collections import deque
+from PIL import Image
+from Tracing import tracer
+
+
+class FrameDecoder:
+    """Decodes buffered JPEG frames on a worker thread, ahead of the playhead.
+
+    Raw (frameNbr, jpeg bytes) items are taken from `source` (the client's
+    frameBuffer) and decoded PIL images are kept in a ring of at most
+    `capacity` frames, so the presentation loop only has to display them.
+
+    With a targetSize, JPEG frames are decoded with DCT scaling (Image.draft)
+    straight to the smallest power-of-two reduction (1/2, 1/4, 1/8) that still
+    covers the target, then optionally resized to fit it.
+    """
+
+    def __init__(self, source, capacity, targetSize=None, fastResize=True):
+        self.source = source
+        self.capacity = capacity
+        self.targetSize = targetSize  # (width, height) of the video widget, None = full size
+        self.fastResize = fastResize
+        self.ring = deque()  # (frameNbr, image, jpeg bytes)
+        self.cond = threading.Condition()
+        self.inFlight = 0    # frames taken from source, not yet in the ring
+        self.running = False
+        self.generation = 0  # a restarted decoder makes the old thread exit
+        self.flushes = 0     # frames decoded across a clear are dropped
+        self.wakeups = 0     # wake() calls, they end waitFrame
+        self.thread = None
+
+        # decode latency metric
+        self.decodeTimes = deque(maxlen=100)
+        self.framesDecoded = 0
+        self.decodeErrors = 0
+        self.totalDecodeTime = 0.0
+
+    def __len__(self):
+        """Frames decoded or being decoded."""
+        with self.cond:
+            return len(self.ring) + self.inFlight
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+            self.generation += 1
+        self.thread = threading.Thread(target=self.run, args=(self.generation,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop decoding; frames already in the ring are kept."""
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+    def clear(self):
+        """Drop every decoded frame, including the ones being decoded now."""
+        with self.cond:
+            self.ring.clear()
+            self.flushes += 1
+            self.cond.notify_all()
+
+    def get(self):
+        """Return the next (frameNbr, image, jpeg bytes), or None if nothing is decoded yet."""
+        with self.cond:
+            if not self.ring:
+                return None
+            item = self.ring.popleft()
+            self.cond.notify_all()
+            return item
+
+    def wake(self):
+        """Signal new frames in source (or anything waitFrame callers should re-check)."""
+        with self.cond:
+            self.wakeups += 1
+            self.cond.notify_all()
+
+    def waitFrame(self, wakeups=None, timeout=None):
+        """Block until a decoded frame is ready, decoding stops or wake() is called
+        (after the `wakeups` count the caller read, if given)."""
+        with self.cond:
+            if wakeups is None:
+                wakeups = self.wakeups
+            self.cond.wait_for(lambda: self.ring or not self.running or self.wakeups != wakeups, timeout)
+
+    def setTargetSize(self, size):
+        """Decode the next frames for a widget of this (width, height); None for full size."""
+        if size is not None and (size[0] < 2 or size[1] < 2):
+            return
+        self.targetSize = size
+
+    def decode(self, data):
+        """Decode one JPEG frame."""
+        image = Image.open(io.BytesIO(data))
+        target = self.targetSize
+        if target is not None and image.format == 'JPEG':
+            image.draft('RGB', target)
+        image.load()
+
+        if target is not None and self.fastResize:
+            scale = min(target[0] / image.width, target[1] / image.height)
+            if scale < 1:
+                size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+                image = image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+        return image
+
+    def run(self, generation):
+        while True:
+            with self.cond:
+                # ring full, or source empty until the client's wake()
+                while (self.running and generation == self.generation
+                       and (len(self.ring) >= self.capacity or not self.source)):
+                    self.cond.wait()
+                if not self.running or generation != self.generation:
+                    return
+                try:
+                    frameNbr, data = self.source.popleft()
+                except IndexError:
+                    continue  # cleared by a seek since the check
+                self.inFlight += 1
+                flushes = self.flushes
+
+            traceStart = tracer.clock() if tracer.enabled else None
+            start = time.perf_counter()
+            try:
+                image = self.decode(data)
+            except Exception as e:
+                print("Failed to decode frame:", e)
+                image = None
+            elapsed = time.perf_counter() - start
+            if traceStart is not None:
+                tracer.complete("decode", traceStart, 'client', frame=frameNbr, ok=image is not None)
+
+            with self.cond:
+                self.inFlight -= 1
+                if image is None:
+                    self.decodeErrors += 1
+                    continue
+                if flushes != self.flushes:
+                    continue  # cleared (seek) while decoding
+                self.decodeTimes.append(elapsed)
+                self.framesDecoded += 1
+                self.totalDecodeTime += elapsed
+                self.ring.append((frameNbr, image, data))
+                self.cond.notify_all()
+
+    def latencyStats(self):
+        """Return decode latency per frame in ms: (last, average, max of the last 100)."""
+        with self.cond:
+            if not self.decodeTimes:
+                return 0.0, 0.0, 0.0
+            return (self.decodeTimes[-1] * 1000,
+                    self.totalDecodeTime / self.framesDecoded * 1000,
+                    max(self.decodeTimes) * 1000)
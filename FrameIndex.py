@@ -0,0 +1,201 @@
+import os, sys, struct, threading
+from array import array
+from collections import OrderedDict
+
+INDEX_EXT = ".idx"
+INDEX_MAGIC = b"VSIX"
+INDEX_VERSION = 1
+
+# magic, version, mode, frame count, source size, source mtime (ns)
+INDEX_HEADER = struct.Struct('!4sBBIQQ')
+
+MODES = {'normal': 0, 'hd': 1}
+
+SOI = b'\xff\xd8'
+EOI = b'\xff\xd9'
+SCAN_BLOCK = 1 << 20
+
+
+class FrameIndex:
+    """Byte offset and length of every frame in a video file."""
+
+    # indexes already loaded by this process, keyed by (path, mode, size, mtime),
+    # least recently used first and bounded by their total frame count
+    loaded = OrderedDict()
+    loadedFrames = 0
+    maxLoadedFrames = 1 << 20
+    loadedLock = threading.Lock()
+    # key -> lock held while that index is loaded or built, outside loadedLock
+    building = {}
+
+    def __init__(self, offsets, lengths):
+        self.offsets = offsets
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def frame(self, frameIdx):
+        """Return (offset, length) of frame frameIdx (0-based)."""
+        return self.offsets[frameIdx], self.lengths[frameIdx]
+
+    @staticmethod
+    def sidecarName(filename, mode):
+        """Return the sidecar file name of the index for filename/mode."""
+        return f"{filename}.{mode}{INDEX_EXT}"
+
+    @classmethod
+    def forFile(cls, filename, mode='normal'):
+        """Load the sidecar index if it is still valid, otherwise build and save it."""
+        if mode not in MODES:
+            raise ValueError
+        st = os.stat(filename)
+        key = (os.path.abspath(filename), mode, st.st_size, st.st_mtime_ns)
+        index = cls.cached(key)
+        if index is not None:
+            return index
+        with cls.loadedLock:
+            lock = cls.building.setdefault(key, threading.Lock())
+        # one thread scans a given file, SETUPs of other files do not wait for it
+        with lock:
+            index = cls.cached(key)
+            if index is not None:
+                return index
+            try:
+                sidecar = cls.sidecarName(filename, mode)
+                index = cls.load(sidecar, mode, st)
+                if index is None:
+                    index = cls.build(filename, mode)
+                    try:
+                        index.save(sidecar, mode, st)
+                    except OSError:
+                        # read-only directory: keep the index in memory only
+                        pass
+            finally:
+                with cls.loadedLock:
+                    cls.building.pop(key, None)
+            cls.remember(key, index)
+        return index
+
+    @classmethod
+    def cached(cls, key):
+        """The loaded index of key, now the most recently used, or None."""
+        with cls.loadedLock:
+            index = cls.loaded.get(key)
+            if index is not None:
+                cls.loaded.move_to_end(key)
+            return index
+
+    @classmethod
+    def remember(cls, key, index):
+        """Keep index under key, forgetting the least recently used ones beyond maxLoadedFrames."""
+        with cls.loadedLock:
+            old = cls.loaded.pop(key, None)
+            if old is not None:
+                cls.loadedFrames -= len(old)
+            cls.loaded[key] = index
+            cls.loadedFrames += len(index)
+            while cls.loadedFrames > cls.maxLoadedFrames and len(cls.loaded) > 1:
+                _, evicted = cls.loaded.popitem(last=False)
+                cls.loadedFrames -= len(evicted)
+
+    @classmethod
+    def build(cls, filename, mode='normal'):
+        """Scan filename once and record every frame."""
+        with open(filename, 'rb') as f:
+            if mode == 'normal':
+                return cls._scanNormal(f)
+            elif mode == 'hd':
+                return cls._scanHd(f)
+        raise ValueError
+
+    @classmethod
+    def _scanNormal(cls, f):
+        """Follow the 5-byte length headers without reading frame payloads."""
+        offsets, lengths = array('Q'), array('I')
+        end = f.seek(0, os.SEEK_END)
+        pos = 0
+        while True:
+            f.seek(pos)
+            header = f.read(5)
+            if len(header) < 5:
+                break
+            try:
+                framelength = int(header)
+            except ValueError:
+                break
+            if pos + 5 + framelength > end:
+                # truncated last frame
+                break
+            offsets.append(pos + 5)
+            lengths.append(framelength)
+            pos += 5 + framelength
+        return cls(offsets, lengths)
+
+    @classmethod
+    def _scanHd(cls, f):
+        """Find every SOI..EOI pair reading the file in large blocks."""
+        offsets, lengths = array('Q'), array('I')
+        base = 0        # file offset of buf[0]
+        buf = b''
+        start = -1      # file offset of the current SOI, -1 while searching for one
+        while True:
+            block = f.read(SCAN_BLOCK)
+            if not block:
+                break
+            # keep one byte of the previous block so markers across blocks are found
+            buf = buf[-1:] + block
+            base = f.tell() - len(buf)
+            pos = 0
+            while True:
+                if start < 0:
+                    i = buf.find(SOI, pos)
+                    if i < 0:
+                        break
+                    start = base + i
+                    pos = i + 2
+                else:
+                    i = buf.find(EOI, max(pos, start + 2 - base))
+                    if i < 0:
+                        break
+                    end = base + i + 2
+                    offsets.append(start)
+                    lengths.append(end - start)
+                    start = -1
+                    pos = i + 2
+        return cls(offsets, lengths)
+
+    @classmethod
+    def load(cls, sidecar, mode, st):
+        """Read a sidecar index, or return None if it is missing or stale."""
+        try:
+            with open(sidecar, 'rb') as f:
+                header = f.read(INDEX_HEADER.size)
+                if len(header) < INDEX_HEADER.size:
+                    return None
+                magic, version, modeId, count, size, mtime = INDEX_HEADER.unpack(header)
+                if (magic != INDEX_MAGIC or version != INDEX_VERSION or modeId != MODES[mode]
+                        or size != st.st_size or mtime != st.st_mtime_ns):
+                    return None
+                offsets, lengths = array('Q'), array('I')
+                offsets.fromfile(f, count)
+                lengths.fromfile(f, count)
+        except (OSError, EOFError):
+            return None
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+            lengths.byteswap()
+        return cls(offsets, lengths)
+
+    def save(self, sidecar, mode, st):
+        """Write the index next to the video (arrays are stored little-endian)."""
+        tmp = sidecar + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, MODES[mode],
+                                      len(self.offsets), st.st_size, st.st_mtime_ns))
+            for values in (self.offsets, self.lengths):
+                if sys.byteorder != 'little':
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                values.tofile(f)
+        os.replace(tmp, sidecar)
@@ -0,0 +1,323 @@
+"""Headless load generator: opens N concurrent RTSP sessions against Server.py
+and reports aggregate packets/s, Mbit/s, per-session frame-delivery jitter,
+packet loss and server CPU as JSON, so runs can be compared for regressions.
+
+Every session does DESCRIBE, SETUP and PLAY, receives RTP until END_OF_VIDEO
+(or --duration) and tears down. All RTP sockets are read by one selector
+thread. With --spawn a server is started here for each run (with
+--server-args) and its CPU time, with that of its worker processes, is read
+from /proc; --server-pid measures an already running server. Without --file, synthetic videos are written to a
+temporary directory, which needs --spawn.
+
+Usage: LoadGenerator.py [--port N] [--sessions N] [--mode normal|hd|both] [--file F]
+                        [--frames N] [--duration S] [--spawn] [--server-args ARGS]
+                        [--server-pid PID] [--output FILE] [--trace FILE]
+"""
+import argparse, json, os, selectors, shlex, socket, statistics, subprocess, sys, tempfile, time
+from RtpPacket import RtpPacket, RTP_CLOCK_RATE
+from RtpStats import RtpReceiverStats
+from RtspMessage import formatRequest, parseReply
+from Tracing import tracer
+import SyntheticVideo
+
+END_OF_VIDEO = b"END_OF_VIDEO"
+# frame rate per mode, for frame numbers from RTP timestamps
+FRAME_RATES = {'normal': 24, 'hd': 30}
+RTSP_TIMEOUT = 5.0
+# a run ends when no session received anything for this long (lost END_OF_VIDEO)
+IDLE_TIMEOUT = 5.0
+# seconds a spawned server gets to drain after SIGTERM before it is killed
+SERVER_STOP_TIMEOUT = 10.0
+
+
+class LoadSession:
+    """One RTSP session without GUI: requests on a blocking TCP socket, RTP read by LoadGenerator."""
+
+    def __init__(self, host, port, filename, mode, connectWait=0):
+        self.filename = filename
+        self.mode = mode
+        self.cseq = 0
+        self.sessionId = 0
+
+        self.rtsp = connectRtsp(host, port, connectWait)
+        self.rtp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rtp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+        self.rtp.bind(('', 0))
+        self.rtp.setblocking(False)
+
+        self.stats = RtpReceiverStats()
+        self.frameTicks = RTP_CLOCK_RATE // FRAME_RATES[mode]
+        self.packets = 0
+        self.bytes = 0
+        self.frames = 0
+        self.ended = False
+        self.firstArrival = None
+        self.lastArrival = None
+        # RFC 3550 interarrival jitter of frames (marker packets), in RTP ticks
+        self.jitter = 0.0
+        self.lastTransit = None
+        self.frameGaps = []
+
+    def request(self, method, *headers):
+        """Send a request and wait for its reply; raise OSError unless it is 200 OK."""
+        self.cseq += 1
+        if self.sessionId:
+            headers = (f"Session: {self.sessionId}",) + headers
+        self.rtsp.sendall(formatRequest(method, self.filename, self.cseq, *headers).encode("utf-8"))
+        data = self.rtsp.recv(1024)
+        if not data:
+            raise OSError(f"{method}: connection closed")
+        reply = parseReply(data.decode("utf-8"))
+        if reply.code != 200 or reply.cseq != self.cseq:
+            raise OSError(f"{method}: unexpected reply {data!r}")
+        if reply.session:
+            self.sessionId = reply.session
+        return reply
+
+    def start(self):
+        self.request("DESCRIBE", f"Mode: {self.mode}")
+        self.request("SETUP", f"Transport: RTP/UDP; client_port={self.rtp.getsockname()[1]}")
+        self.request("PLAY")
+
+    def stop(self):
+        try:
+            self.request("TEARDOWN")
+        except OSError:
+            pass
+        self.rtsp.close()
+        self.rtp.close()
+
+    def receive(self, data, now):
+        """Account one datagram; return False once the stream is over."""
+        if data == END_OF_VIDEO:
+            self.ended = True
+            return False
+        traceStart = tracer.clock() if tracer.enabled else None
+        packet = RtpPacket.parse(data)
+        self.stats.update(packet.seqNum)
+        self.packets += 1
+        self.bytes += len(data)
+        if self.firstArrival is None:
+            self.firstArrival = now
+        self.lastArrival = now
+
+        if packet.marker:
+            self.frames += 1
+            transit = now * RTP_CLOCK_RATE - self.stats.unwrapTimestamp(packet.timestamp)
+            if self.lastTransit is not None:
+                self.jitter += (abs(transit - self.lastTransit) - self.jitter) / 16
+                self.frameGaps.append(now - self.lastFrame)
+            self.lastTransit = transit
+            self.lastFrame = now
+        if traceStart is not None:
+            tracer.complete("receiveRtp", traceStart, 'client', ssrc=packet.ssrc,
+                            frame=self.stats.unwrapTimestamp(packet.timestamp) // self.frameTicks + 1,
+                            seq=packet.seqNum)
+        return True
+
+    def report(self):
+        expected = self.stats.expected()
+        gaps = self.frameGaps
+        return {
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'frames': self.frames,
+            'ended': self.ended,
+            'lostPackets': self.stats.lost(),
+            'lossRate': self.stats.lost() / expected if expected else 0.0,
+            'jitterMs': self.jitter * 1000 / RTP_CLOCK_RATE,
+            'frameGapMeanMs': statistics.mean(gaps) * 1000 if gaps else 0.0,
+            'frameGapStdevMs': statistics.pstdev(gaps) * 1000 if gaps else 0.0,
+            'frameGapMaxMs': max(gaps) * 1000 if gaps else 0.0,
+        }
+
+
+def connectRtsp(host, port, wait=0):
+    """Connect to the server, retrying for wait seconds while it starts up."""
+    deadline = time.monotonic() + wait
+    while True:
+        try:
+            return socket.create_connection((host, port), timeout=RTSP_TIMEOUT)
+        except ConnectionRefusedError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(0.1)
+
+
+def processStat(pid):
+    """Fields of /proc/<pid>/stat after the command name (None without it)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()
+    except (OSError, TypeError):
+        return None
+
+
+def processCpuSeconds(pid):
+    """User + system CPU seconds of process pid and its descendants (--workers), from /proc (None without it)."""
+    fields = processStat(pid)
+    if fields is None:
+        return None
+    # parent pid -> children, from every process of /proc
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            stat = processStat(entry)
+            if stat is not None:
+                children.setdefault(int(stat[1]), []).append(int(entry))
+    ticks = int(fields[11]) + int(fields[12])
+    pids = list(children.get(int(pid), []))
+    while pids:
+        child = pids.pop()
+        fields = processStat(child)
+        if fields is not None:
+            ticks += int(fields[11]) + int(fields[12])
+            pids += children.get(child, [])
+    return ticks / os.sysconf('SC_CLK_TCK')
+
+
+def receiveAll(sessions, duration):
+    """Read every session's RTP socket until all streams ended or duration passed."""
+    selector = selectors.DefaultSelector()
+    for session in sessions:
+        selector.register(session.rtp, selectors.EVENT_READ, session)
+    active = len(sessions)
+    deadline = time.monotonic() + duration if duration else None
+    lastData = time.monotonic()
+    while active and (deadline is None or time.monotonic() < deadline):
+        events = selector.select(timeout=0.5)
+        if events:
+            lastData = time.monotonic()
+        elif lastData + IDLE_TIMEOUT < time.monotonic():
+            break
+        for key, _ in events:
+            session = key.data
+            now = time.monotonic()
+            while True:
+                try:
+                    data = session.rtp.recv(65536)
+                except BlockingIOError:
+                    break
+                if not session.receive(data, now):
+                    selector.unregister(session.rtp)
+                    active -= 1
+                    break
+    selector.close()
+
+
+def runLoad(host, port, filename, mode, sessionCount, duration, serverPid, connectWait=0):
+    """Run sessionCount sessions of filename and return the JSON-ready results."""
+    # the first connection also waits for a server that is still starting
+    sessions = [LoadSession(host, port, filename, mode, connectWait)]
+    cpuStart = processCpuSeconds(serverPid)
+    start = time.monotonic()
+    try:
+        sessions[0].start()
+        for _ in range(sessionCount - 1):
+            session = LoadSession(host, port, filename, mode)
+            sessions.append(session)
+            session.start()
+        receiveAll(sessions, duration)
+    finally:
+        elapsed = time.monotonic() - start
+        cpuEnd = processCpuSeconds(serverPid)
+        for session in sessions:
+            session.stop()
+
+    perSession = [session.report() for session in sessions]
+    packets = sum(r['packets'] for r in perSession)
+    payloadBytes = sum(r['bytes'] for r in perSession)
+    lost = sum(r['lostPackets'] for r in perSession)
+    jitters = [r['jitterMs'] for r in perSession]
+    result = {
+        'file': filename,
+        'mode': mode,
+        'sessions': sessionCount,
+        'elapsedSec': elapsed,
+        'packets': packets,
+        'frames': sum(r['frames'] for r in perSession),
+        'packetsPerSec': packets / elapsed,
+        'mbitPerSec': payloadBytes * 8 / elapsed / 1e6,
+        'lossRate': lost / (packets + lost) if packets + lost > 0 else 0.0,
+        'jitterMsMean': statistics.mean(jitters) if jitters else 0.0,
+        'jitterMsMax': max(jitters) if jitters else 0.0,
+        'serverCpuSec': None,
+        'serverCpuPercent': None,
+        'perSession': perSession,
+    }
+    if cpuStart is not None and cpuEnd is not None:
+        result['serverCpuSec'] = cpuEnd - cpuStart
+        result['serverCpuPercent'] = (cpuEnd - cpuStart) / elapsed * 100
+    return result
+
+
+def spawnServer(port, serverArgs, cwd):
+    """Start Server.py on port; the first session waits for it to accept connections."""
+    server = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Server.py")
+    return subprocess.Popen([sys.executable, server, str(port)] + shlex.split(serverArgs),
+                            cwd=cwd, stdout=subprocess.DEVNULL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="multi-session RTSP/RTP load generator")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8554)
+    parser.add_argument('--sessions', type=int, default=8)
+    parser.add_argument('--mode', choices=['normal', 'hd', 'both'], default='both')
+    parser.add_argument('--file', default=None, help="video file, as the server opens it (one mode only)")
+    parser.add_argument('--frames', type=int, default=240, help="frames of the synthetic videos")
+    parser.add_argument('--duration', type=float, default=0, help="stop after S seconds (0: at the end of the video)")
+    parser.add_argument('--spawn', action='store_true', help="start Server.py for the run")
+    parser.add_argument('--server-args', default='', help="extra Server.py options with --spawn, e.g. --server-args='--pace --async'")
+    parser.add_argument('--server-pid', type=int, default=None, help="measure the CPU of this server process")
+    parser.add_argument('--output', default=None, help="write the JSON results here instead of stdout")
+    parser.add_argument('--trace', default=None, help="record the RTP receive spans to this Chrome trace file")
+    args = parser.parse_args()
+
+    if args.trace:
+        tracer.start(args.trace, "load generator")
+    modes = ['normal', 'hd'] if args.mode == 'both' else [args.mode]
+    if args.file is not None and len(modes) > 1:
+        parser.error("--file needs --mode normal or --mode hd")
+    if args.file is None and not args.spawn:
+        parser.error("synthetic videos need --spawn (the server must see the files)")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        files = {}
+        for mode in modes:
+            files[mode] = args.file or SyntheticVideo.writeVideo(
+                os.path.join(workdir, f"synthetic-{mode}.mjpeg"), mode, args.frames)
+
+        results = []
+        for mode in modes:
+            # a fresh server per run, so its CPU time covers this run only
+            server = spawnServer(args.port, args.server_args, workdir if args.file is None else None) if args.spawn else None
+            serverPid = server.pid if server else args.server_pid
+            try:
+                results.append(runLoad(args.host, args.port, files[mode], mode, args.sessions, args.duration,
+                                       serverPid, connectWait=10 if server else 0))
+            finally:
+                if server:
+                    # SIGTERM: the server drains (and stops its workers); SIGKILL only if it hangs
+                    server.terminate()
+                    try:
+                        server.wait(SERVER_STOP_TIMEOUT)
+                    except subprocess.TimeoutExpired:
+                        server.kill()
+                        server.wait()
+
+    report = {
+        'serverArgs': args.server_args if args.spawn else None,
+        'sessionsPerRun': args.sessions,
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import json, os, signal, socket, sys, threading, traceback
+from ServerMetrics import serverMetrics, renderMetrics, startMetricsServer
+from Tracing import tracer
+
+
+class MultiProcessServer:
+    """Runs a Server in several forked worker processes, each with its own GIL.
+
+    Every worker opens its own listening socket on the server port with
+    SO_REUSEPORT, so the kernel spreads new RTSP connections over them
+    (without SO_REUSEPORT they share one socket opened before the fork), and
+    serves its sessions as the single-process server does. The parent only
+    supervises: SIGTERM or Ctrl+C makes every worker drain (stop accepting
+    and wait up to drainTimeout for its sessions to end), a second one kills
+    them. Workers send their metrics to the parent every STATS_INTERVAL
+    seconds over a socketpair; the parent serves the sum on the metrics port
+    and prints the totals when the last worker is gone. A worker whose parent
+    dies sees the end of that socketpair and drains as on SIGTERM, so no
+    orphan keeps the port.
+    """
+
+    STATS_INTERVAL = 1.0
+
+    def __init__(self, server, workers, drainTimeout):
+        self.server = server
+        self.workers = workers
+        self.drainTimeout = drainTimeout
+        self.children = {}  # pid -> worker index
+        self.stats = {}     # worker index -> last metrics snapshot
+        self.stopping = 0   # stop signals received
+
+    def run(self, metricsPort=None, traceFile=None):
+        shared = None if hasattr(socket, 'SO_REUSEPORT') else self.server.listen()
+
+        # fork every worker before the parent starts any thread
+        conns = []
+        for index in range(self.workers):
+            parentConn, childConn = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                parentConn.close()
+                for _, conn in conns:
+                    conn.close()
+                self.runWorker(index, childConn, shared, traceFile)  # does not return
+            childConn.close()
+            self.children[pid] = index
+            conns.append((index, parentConn))
+        if shared is not None:
+            shared.close()
+        print(f"Started {self.workers} workers on port {self.server.port}")
+
+        readers = [threading.Thread(target=self.readStats, args=(index, conn), daemon=True)
+                   for index, conn in conns]
+        for reader in readers:
+            reader.start()
+        if metricsPort is not None:
+            startMetricsServer(metricsPort, self)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, 0)
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            if status and not self.stopping:
+                print(f"Worker {index} exited with status {status}")
+        for reader in readers:
+            reader.join(1.0)  # the final snapshots
+        self.printTotals()
+
+    def stop(self, signum=None, frame=None):
+        """Drain the workers; kill them if asked again."""
+        self.stopping += 1
+        if self.stopping == 1:
+            print("Draining workers")
+        sig = signal.SIGTERM if self.stopping == 1 else signal.SIGKILL
+        for pid in list(self.children):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+
+    def runWorker(self, index, conn, shared, traceFile):
+        """Body of worker process index: serve, drain, report, exit."""
+        # Ctrl+C reaches the whole process group, the parent turns it into a drain
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        sendLock = threading.Lock()
+        status = 0
+        try:
+            if traceFile:
+                tracer.start(f"{traceFile}.{index}", f"RTSP server worker {index}")
+            threading.Thread(target=self.reportStats, args=(index, conn, sendLock), daemon=True).start()
+            threading.Thread(target=self.watchParent, args=(conn,), daemon=True).start()
+            rtspSocket = shared if shared is not None else self.server.listen(reusePort=True)
+            self.server.serve(rtspSocket, self.drainTimeout)
+        except BaseException:
+            traceback.print_exc()
+            status = 1
+        finally:
+            try:
+                self.sendStats(index, conn, sendLock)
+            except OSError:
+                pass
+            tracer.save()
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(status)
+
+    def sendStats(self, index, conn, sendLock):
+        snapshot = serverMetrics.snapshot()
+        snapshot['labels'] = {'worker': str(index)}
+        with sendLock:
+            conn.sendall(json.dumps(snapshot).encode() + b"\n")
+
+    def reportStats(self, index, conn, sendLock):
+        """Worker thread: send the metrics to the parent every STATS_INTERVAL seconds."""
+        ticker = threading.Event()
+        while not ticker.wait(self.STATS_INTERVAL):
+            try:
+                self.sendStats(index, conn, sendLock)
+            except OSError:
+                return
+
+    def watchParent(self, conn):
+        """Worker thread: drain when the parent is gone (it never writes, so recv returns at its exit)."""
+        try:
+            while conn.recv(64):
+                pass
+        except OSError:
+            pass
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def readStats(self, index, conn):
+        """Parent thread: keep the last metrics snapshot of worker index."""
+        with conn.makefile('r') as lines:
+            for line in lines:
+                self.stats[index] = json.loads(line)
+
+    def render(self):
+        """Metrics of all workers, for startMetricsServer."""
+        lines = ["# HELP rtp_workers_alive Worker processes still running.",
+                 "# TYPE rtp_workers_alive gauge",
+                 f"rtp_workers_alive {len(self.children)}"]
+        return "\n".join(lines) + "\n" + renderMetrics(list(self.stats.values()))
+
+    def printTotals(self):
+        totals = {}
+        for snapshot in list(self.stats.values()):
+            for attr, value in snapshot['totals'].items():
+                totals[attr] = totals.get(attr, 0) + value
+        print(f"{len(self.stats)} workers: {totals.get('framesRead', 0)} frames, "
+              f"{totals.get('packetsSent', 0)} packets, {totals.get('bytesSent', 0)} bytes sent, "
+              f"{totals.get('sendErrors', 0)} send errors")
@@ -0,0 +1,57 @@
+import threading
+from collections import deque
+from RtpPacket import HEADER_SIZE
+
+# payload type of packets sent again after a NACK; the payload starts with the
+# original sequence number (RFC 4588 retransmission format)
+RTX_PT = 96
+
+
+class PacketHistory:
+    """The RTP packets of the last `frames` frames of a session, to send again on NACK.
+
+    One entry per frame: its first sequence number, a copy of its headers
+    (the packetizer reuses its header buffer; PacketTable blocks are kept as
+    they are) and the frame, whose slices are the payloads. Written by the
+    sending thread, read by the RTCP one.
+    """
+
+    def __init__(self, chunkSize, frames=64):
+        self.chunkSize = chunkSize
+        self.frames = deque(maxlen=frames)
+        self.lock = threading.Lock()
+
+    def record(self, packets, frame, headers=None):
+        """Remember the (header, payload) packets of frame; headers is their header block if already joined."""
+        if not len(packets):
+            return
+        if headers is None:
+            headers = b''.join([header for header, _ in packets])
+        first = headers[2] << 8 | headers[3]
+        with self.lock:
+            self.frames.append((first, len(packets), headers, memoryview(frame)))
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+
+    def lookup(self, seq):
+        """(header, payload) of the packet with 16-bit sequence number seq, None if it is no longer kept."""
+        with self.lock:
+            for first, count, headers, frame in reversed(self.frames):
+                index = (seq - first) & 0xFFFF
+                if index < count:
+                    pos = index * HEADER_SIZE
+                    start = index * self.chunkSize
+                    return headers[pos:pos + HEADER_SIZE], frame[start:start + self.chunkSize]
+        return None
+
+    @staticmethod
+    def retransmission(packet, rtxSeq):
+        """(header, payload) resending packet with sequence number rtxSeq, payload type RTX_PT and its marker and timestamp."""
+        header, payload = packet
+        rtxHeader = bytearray(header)
+        rtxHeader[1] = (header[1] & 0x80) | RTX_PT
+        rtxHeader[2:4] = (rtxSeq & 0xFFFF).to_bytes(2, 'big')
+        rtxHeader += header[2:4]  # original sequence number, first in the payload
+        return rtxHeader, payload
@@ -0,0 +1,111 @@
+import threading, weakref
+from array import array
+from RtpPacket import RTP_HEADER, HEADER_SIZE
+
+# high and low byte of sequence numbers seq, seq + 1, ... (wrapping at 65536)
+# for frames of up to 65536 packets, sliced straight into a header block
+SEQ_SPAN = 1 << 16
+SEQ_HIGH = bytes(((seq >> 8) & 0xFF) for seq in range(2 * SEQ_SPAN))
+SEQ_LOW = bytes((seq & 0xFF) for seq in range(2 * SEQ_SPAN))
+
+
+class FramePackets:
+    """RTP packets of one frame: a block of packed headers plus the frame.
+
+    Behaves like the (header, payload) list of RtpPacketizer.packetize for
+    len(), slicing and iteration, and lets the sender hand the header block
+    to UdpBatch.sendFrameHeaders without cutting it into packets.
+    """
+    __slots__ = ('headers', 'frame', 'chunkSize', 'first', 'count')
+
+    def __init__(self, headers, frame, chunkSize, first, count):
+        self.headers = headers  # memoryview, HEADER_SIZE bytes per packet of the frame
+        self.frame = frame      # memoryview of the frame
+        self.chunkSize = chunkSize
+        self.first = first
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(self.count)
+            return FramePackets(self.headers, self.frame, self.chunkSize, self.first + start, max(0, stop - start))
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        i = self.first + index
+        return (self.headers[i * HEADER_SIZE:(i + 1) * HEADER_SIZE],
+                self.frame[i * self.chunkSize:(i + 1) * self.chunkSize])
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def headerBlock(self):
+        """Headers of these packets, back to back."""
+        return self.headers[self.first * HEADER_SIZE:(self.first + self.count) * HEADER_SIZE]
+
+    def nbytes(self):
+        """Size of these packets on the wire (RTP headers and payloads)."""
+        start = self.first * self.chunkSize
+        end = min(len(self.frame), (self.first + self.count) * self.chunkSize)
+        return self.count * HEADER_SIZE + max(0, end - start)
+
+
+class PacketTable:
+    """Every RTP packet of a video, cut once and shared by all its sessions.
+
+    Built from the frame index without reading the file: the first packet of
+    every frame, and one header template per packet with version, payload
+    type, marker bit and the frame's timestamp already in place. Sending a
+    frame copies its templates and patches the session's sequence numbers
+    and SSRC with a few strided slice assignments; payloads stay in the
+    frame (mmap slice or frame cache entry) and are never copied.
+    """
+
+    # tables already built by this process, per frame index
+    loaded = weakref.WeakKeyDictionary()
+    loadedLock = threading.Lock()
+
+    def __init__(self, index, chunkSize, frameTicks, pt=26, version=2):
+        self.chunkSize = chunkSize
+        counts = [(length + chunkSize - 1) // chunkSize for length in index.lengths]
+        # frame i is packets firstPacket[i] .. firstPacket[i + 1] - 1
+        self.firstPacket = array('I', [0])
+        for count in counts:
+            self.firstPacket.append(self.firstPacket[-1] + count)
+
+        self.templates = bytearray(self.firstPacket[-1] * HEADER_SIZE)
+        for frameIdx, count in enumerate(counts):
+            if not count:
+                continue
+            pos = self.firstPacket[frameIdx] * HEADER_SIZE
+            template = RTP_HEADER.pack(version << 6, pt & 0x7F, 0, (frameIdx * frameTicks) & 0xFFFFFFFF, 0)
+            self.templates[pos:pos + count * HEADER_SIZE] = template * count
+            self.templates[pos + (count - 1) * HEADER_SIZE + 1] |= 0x80  # marker on the last packet
+
+    @classmethod
+    def forIndex(cls, index, chunkSize, frameTicks):
+        """Return the shared table of the video with this FrameIndex, building it on first use."""
+        key = (chunkSize, frameTicks)
+        with cls.loadedLock:
+            tables = cls.loaded.setdefault(index, {})
+            table = tables.get(key)
+            if table is None:
+                table = tables[key] = cls(index, chunkSize, frameTicks)
+            return table
+
+    def framePackets(self, frameIdx, frame, seqnum, ssrc):
+        """Return the FramePackets of frame frameIdx (0-based), numbered from seqnum for SSRC ssrc."""
+        first, end = self.firstPacket[frameIdx], self.firstPacket[frameIdx + 1]
+        count = end - first
+        headers = self.templates[first * HEADER_SIZE:end * HEADER_SIZE]
+        seqnum &= 0xFFFF
+        headers[2::HEADER_SIZE] = SEQ_HIGH[seqnum:seqnum + count]
+        headers[3::HEADER_SIZE] = SEQ_LOW[seqnum:seqnum + count]
+        for i, byte in enumerate((ssrc & 0xFFFFFFFF).to_bytes(4, 'big')):
+            headers[8 + i::HEADER_SIZE] = bytes((byte,)) * count
+        return FramePackets(memoryview(headers), memoryview(frame), self.chunkSize, 0, count)
@@ -0,0 +1,75 @@
+class RateAdapter:
+    """Picks the rendition a client should stream from its throughput and buffer level.
+
+    Throughput comes from the frames themselves: the server sends the packets
+    of a frame (or of a paced burst) back to back, so the bytes after a
+    frame's first packet over the time to its last packet estimate what the
+    link can carry, not just the bitrate of the rendition being streamed.
+    Samples are smoothed with an EWMA. Switches go one rendition at a time,
+    no sooner than HOLD seconds after the previous one:
+
+      down  the estimate is below DOWN_MARGIN times the current bitrate, or
+            the buffer is under LOW_BUFFER of the playback minimum while playing
+      up    the estimate is above UP_MARGIN times the next bitrate and the
+            buffer holds at least the playback minimum
+    """
+
+    UP_MARGIN = 1.5
+    DOWN_MARGIN = 1.1
+    LOW_BUFFER = 0.5
+    HOLD = 5.0
+    SMOOTHING = 0.3
+
+    def __init__(self, bitrates, mode):
+        self.bitrates = bitrates  # mode -> bits per second, lowest first
+        self.modes = list(bitrates)
+        self.mode = mode
+        self.estimate = None      # smoothed throughput in bits per second
+        self.lastSwitch = None
+        self.switches = 0
+
+    @staticmethod
+    def parseHeader(value):
+        """{mode: bits per second} of a 'normal=812000,hd=2400000' Renditions header, lowest first."""
+        bitrates = {}
+        for item in value.split(','):
+            mode, sep, rate = item.partition('=')
+            try:
+                bitrates[mode.strip()] = int(rate)
+            except ValueError:
+                continue
+        return dict(sorted(bitrates.items(), key=lambda item: item[1]))
+
+    def sample(self, size, seconds):
+        """Add a throughput sample: size bytes received in seconds."""
+        if size <= 0 or seconds <= 0:
+            return
+        rate = size * 8 / seconds
+        if self.estimate is None:
+            self.estimate = rate
+        else:
+            self.estimate += self.SMOOTHING * (rate - self.estimate)
+
+    def choose(self, buffered, minBuffer, playing, now):
+        """Return the mode to switch to, or None to stay on the current one."""
+        if self.mode not in self.bitrates:
+            return None
+        if self.lastSwitch is not None and now - self.lastSwitch < self.HOLD:
+            return None
+        level = self.modes.index(self.mode)
+
+        starving = playing and buffered < self.LOW_BUFFER * minBuffer
+        slow = self.estimate is not None and self.estimate < self.DOWN_MARGIN * self.bitrates[self.mode]
+        if level > 0 and (starving or slow):
+            return self.modes[level - 1]
+
+        if (level + 1 < len(self.modes) and buffered >= minBuffer and self.estimate is not None
+                and self.estimate > self.UP_MARGIN * self.bitrates[self.modes[level + 1]]):
+            return self.modes[level + 1]
+        return None
+
+    def switched(self, mode, now):
+        """The server acknowledged the switch to mode."""
+        self.mode = mode
+        self.lastSwitch = now
+        self.switches += 1
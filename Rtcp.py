@@ -0,0 +1,168 @@
+import struct, time
+
+# packet types (RFC 3550 section 6.4)
+RTCP_SR = 200
+RTCP_RR = 201
+# transport layer feedback, and its generic NACK format (RFC 4585 section 6.2.1)
+RTCP_RTPFB = 205
+NACK_FMT = 1
+
+# seconds from the NTP epoch (1900) to the Unix epoch
+NTP_EPOCH_OFFSET = 2208988800
+
+# V/P/RC, PT, length in 32-bit words minus one, SSRC of the sender of the report
+RTCP_HEADER = struct.Struct('!BBHI')
+# NTP timestamp (64 bits), RTP timestamp, sender's packet count, sender's octet count
+SENDER_INFO = struct.Struct('!QIII')
+# SSRC, fraction lost (8 bits) and cumulative lost (24 bits), extended highest
+# sequence number, interarrival jitter, last SR (LSR), delay since last SR (DLSR)
+REPORT_BLOCK = struct.Struct('!IIIIII')
+# NACK feedback control information: packet ID and bitmask of the 16 packets after it
+NACK_FCI = struct.Struct('!HH')
+
+
+def ntpTime(now=None):
+    """64-bit NTP timestamp (32.32 fixed point seconds since 1900) of a time.time() value."""
+    if now is None:
+        now = time.time()
+    return int((now + NTP_EPOCH_OFFSET) * (1 << 32)) & 0xFFFFFFFFFFFFFFFF
+
+
+def ntpMiddle(ntp):
+    """Middle 32 bits of an NTP timestamp (16.16 seconds), as carried in LSR."""
+    return (ntp >> 16) & 0xFFFFFFFF
+
+
+class ReportBlock:
+    """Reception statistics of one source, as sent in SR and RR packets."""
+    __slots__ = ('ssrc', 'fractionLost', 'cumulativeLost', 'highestSeq', 'jitter', 'lsr', 'dlsr')
+
+    def __init__(self, ssrc, fractionLost, cumulativeLost, highestSeq, jitter, lsr=0, dlsr=0):
+        self.ssrc = ssrc
+        self.fractionLost = fractionLost      # lost since the previous report, in 1/256
+        self.cumulativeLost = cumulativeLost  # signed, 24 bits on the wire
+        self.highestSeq = highestSeq          # extended highest sequence number received
+        self.jitter = jitter                  # interarrival jitter, in RTP timestamp units
+        self.lsr = lsr                        # ntpMiddle of the last SR received, 0 if none
+        self.dlsr = dlsr                      # delay since that SR, in 1/65536 s
+
+    def pack(self):
+        lost = max(-0x800000, min(self.cumulativeLost, 0x7FFFFF)) & 0xFFFFFF
+        return REPORT_BLOCK.pack(self.ssrc & 0xFFFFFFFF, (self.fractionLost & 0xFF) << 24 | lost,
+                                 self.highestSeq & 0xFFFFFFFF, int(self.jitter) & 0xFFFFFFFF,
+                                 self.lsr & 0xFFFFFFFF, self.dlsr & 0xFFFFFFFF)
+
+    @classmethod
+    def unpack(cls, data, offset):
+        ssrc, lost, highestSeq, jitter, lsr, dlsr = REPORT_BLOCK.unpack_from(data, offset)
+        cumulative = lost & 0xFFFFFF
+        if cumulative & 0x800000:
+            cumulative -= 0x1000000
+        return cls(ssrc, lost >> 24, cumulative, highestSeq, jitter, lsr, dlsr)
+
+
+class SenderReport:
+    __slots__ = ('ssrc', 'ntp', 'rtpTime', 'packets', 'octets', 'blocks')
+
+    def __init__(self, ssrc, ntp, rtpTime, packets, octets, blocks=()):
+        self.ssrc = ssrc
+        self.ntp = ntp
+        self.rtpTime = rtpTime
+        self.packets = packets
+        self.octets = octets
+        self.blocks = list(blocks)
+
+    def pack(self):
+        body = SENDER_INFO.pack(self.ntp, self.rtpTime & 0xFFFFFFFF, self.packets & 0xFFFFFFFF,
+                                self.octets & 0xFFFFFFFF)
+        return packRtcp(RTCP_SR, self.ssrc, body, self.blocks)
+
+
+class ReceiverReport:
+    __slots__ = ('ssrc', 'blocks')
+
+    def __init__(self, ssrc, blocks=()):
+        self.ssrc = ssrc
+        self.blocks = list(blocks)
+
+    def pack(self):
+        return packRtcp(RTCP_RR, self.ssrc, b'', self.blocks)
+
+
+class GenericNack:
+    """Sequence numbers of packets of source mediaSsrc that ssrc asks to be sent again."""
+    __slots__ = ('ssrc', 'mediaSsrc', 'lost')
+
+    def __init__(self, ssrc, mediaSsrc, lost=()):
+        self.ssrc = ssrc
+        self.mediaSsrc = mediaSsrc
+        self.lost = list(lost)  # extended or 16-bit sequence numbers; 16-bit once parsed
+
+    def pack(self):
+        entries = []  # [packet ID, bitmask]
+        for seq in sorted(self.lost):
+            if entries and 0 < seq - entries[-1][0] <= 16:
+                entries[-1][1] |= 1 << (seq - entries[-1][0] - 1)
+            elif not entries or seq != entries[-1][0]:
+                entries.append([seq, 0])
+        body = struct.pack('!I', self.mediaSsrc & 0xFFFFFFFF) + b''.join(
+            [NACK_FCI.pack(pid & 0xFFFF, blp) for pid, blp in entries])
+        return packRtcp(RTCP_RTPFB, self.ssrc, body, [], NACK_FMT)
+
+
+def packRtcp(packetType, ssrc, body, blocks, count=None):
+    """One RTCP packet: header, type-specific body, then up to 31 report blocks.
+
+    count replaces the report count of the header (the FMT field of feedback packets).
+    """
+    blocks = blocks[:31]
+    payload = body + b''.join([block.pack() for block in blocks])
+    length = (RTCP_HEADER.size + len(payload)) // 4 - 1
+    if count is None:
+        count = len(blocks)
+    return RTCP_HEADER.pack(0x80 | count, packetType, length, ssrc & 0xFFFFFFFF) + payload
+
+
+def parse(data):
+    """SenderReport, ReceiverReport and GenericNack objects of a (compound) RTCP packet; other types are skipped.
+
+    Raises ValueError on a malformed packet.
+    """
+    reports = []
+    offset = 0
+    while offset + RTCP_HEADER.size <= len(data):
+        first, packetType, length, ssrc = RTCP_HEADER.unpack_from(data, offset)
+        end = offset + (length + 1) * 4
+        if first >> 6 != 2 or end > len(data):
+            raise ValueError("malformed RTCP packet")
+        count = first & 0x1F
+        pos = offset + RTCP_HEADER.size
+        if packetType == RTCP_SR:
+            if pos + SENDER_INFO.size > end:
+                raise ValueError("RTCP sender info past the packet")
+            ntp, rtpTime, packets, octets = SENDER_INFO.unpack_from(data, pos)
+            report = SenderReport(ssrc, ntp, rtpTime, packets, octets)
+            pos += SENDER_INFO.size
+        elif packetType == RTCP_RR:
+            report = ReceiverReport(ssrc)
+        elif packetType == RTCP_RTPFB and count == NACK_FMT:
+            if pos + 4 > end:
+                raise ValueError("RTCP NACK without media source")
+            report = GenericNack(ssrc, struct.unpack_from('!I', data, pos)[0])
+            for fci in range(pos + 4, end - NACK_FCI.size + 1, NACK_FCI.size):
+                pid, blp = NACK_FCI.unpack_from(data, fci)
+                report.lost.append(pid)
+                report.lost += [(pid + bit + 1) & 0xFFFF for bit in range(16) if blp >> bit & 1]
+            reports.append(report)
+            offset = end
+            continue
+        else:
+            offset = end
+            continue
+        if pos + count * REPORT_BLOCK.size > end:
+            raise ValueError("RTCP report blocks past the packet")
+        for i in range(count):
+            report.blocks.append(ReportBlock.unpack(data, pos + i * REPORT_BLOCK.size))
+        reports.append(report)
+        offset = end
+    return reports
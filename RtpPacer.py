@@ -0,0 +1,92 @@
+import heapq, itertools, threading, traceback
+from time import monotonic
+
+
+class RtpPacer:
+    """One thread that releases every session's RTP packets on time.
+
+    Sessions are kept in a heap ordered by the time their next burst is due.
+    A session implements sendPacedBurst(now), which sends one burst and
+    returns when the next one is due (None when the session is finished).
+    """
+
+    def __init__(self):
+        self.heap = []  # (due, order, token, session)
+        self.tokens = {}  # session -> token of its live heap entry
+        self.order = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def add(self, session, due=None):
+        """Schedule session (now by default). A session is in the heap at most once."""
+        with self.cond:
+            token = next(self.order)
+            self.tokens[session] = token
+            heapq.heappush(self.heap, (monotonic() if due is None else due, token, token, session))
+            self.cond.notify()
+
+    def remove(self, session):
+        """Unschedule session; its heap entry is dropped lazily."""
+        with self.cond:
+            self.tokens.pop(session, None)
+
+    def sessionCount(self):
+        with self.cond:
+            return len(self.tokens)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    if not self.heap:
+                        self.cond.wait()
+                        continue
+                    due, _, token, session = self.heap[0]
+                    if self.tokens.get(session) != token:
+                        heapq.heappop(self.heap)  # removed or rescheduled
+                        continue
+                    now = monotonic()
+                    if due > now:
+                        self.cond.wait(due - now)
+                        continue
+                    heapq.heappop(self.heap)
+                    break
+
+            try:
+                nextDue = session.sendPacedBurst(now)
+            except Exception:
+                print("Pacer: session failed, unscheduling it")
+                traceback.print_exc()
+                nextDue = None
+
+            with self.cond:
+                if self.tokens.get(session) != token:
+                    continue  # paused while sending
+                if nextDue is None:
+                    del self.tokens[session]
+                else:
+                    heapq.heappush(self.heap, (nextDue, next(self.order), token, session))
+
+
+_sharedPacer = None
+_sharedPacerLock = threading.Lock()
+
+
+def sharedPacer():
+    """Return the process-wide pacer, starting it on first use."""
+    global _sharedPacer
+    with _sharedPacerLock:
+        if _sharedPacer is None:
+            _sharedPacer = RtpPacer()
+            _sharedPacer.start()
+        return _sharedPacer
+
+
+def runningPacer():
+    """Return the process-wide pacer if it was started, else None."""
+    return _sharedPacer
@@ -1,6 +1,11 @@
-import sys
+import sys, struct
 from time import time
 HEADER_SIZE = 12
+RTP_CLOCK_RATE = 90000  # Hz, the RTP clock of video payloads
+
+# V/P/X/CC, M/PT, sequence number, timestamp, SSRC
+RTP_HEADER = struct.Struct('!BBHII')
+
 
 class RtpPacket:
     header = bytearray(HEADER_SIZE)
@@ -8,35 +13,29 @@ class RtpPacket:
     def __init__(self):
         pass
 
-    def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload):
+    def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload, timestamp=None):
         """Encode the RTP packet with header fields and payload."""
-        timestamp = int(time())
+        if timestamp is None:
+            timestamp = int(time())
         header = bytearray(HEADER_SIZE)
-
-        header[0] = (version << 6) | (padding << 5) | (extension << 4) | (cc & 0x0F)
-        header[1] = ((marker & 0x01) << 7) | (pt & 0x7F)
-
-        header[2] = (seqnum >> 8) & 0xFF
-        header[3] = seqnum & 0xFF
-
-        header[4] = (timestamp >> 24) & 0xFF
-        header[5] = (timestamp >> 16) & 0xFF
-        header[6] = (timestamp >> 8) & 0xFF
-        header[7] = timestamp & 0xFF
-
-        header[8]  = (ssrc >> 24) & 0xFF
-        header[9]  = (ssrc >> 16) & 0xFF
-        header[10] = (ssrc >> 8) & 0xFF
-        header[11] = ssrc & 0xFF
+        RTP_HEADER.pack_into(header, 0,
+                             (version << 6) | (padding << 5) | (extension << 4) | (cc & 0x0F),
+                             ((marker & 0x01) << 7) | (pt & 0x7F),
+                             seqnum & 0xFFFF, timestamp & 0xFFFFFFFF, ssrc & 0xFFFFFFFF)
 
         self.header = header
-        self.payload = payload if isinstance(payload, (bytes, bytearray)) else bytes(payload)
+        self.payload = payload if isinstance(payload, (bytes, bytearray, memoryview)) else bytes(payload)
 
     def decode(self, byteStream):
         """Decode the RTP packet."""
-        self.header = bytearray(byteStream[:HEADER_SIZE])
+        self.header = bytes(byteStream[:HEADER_SIZE])
         self.payload = byteStream[HEADER_SIZE:]
 
+    @staticmethod
+    def parse(byteStream):
+        """Fast path decode: return an RtpHeader whose payload is a memoryview of byteStream (no copy)."""
+        return RtpHeader(byteStream)
+
     def version(self):
         """Return RTP version."""
         return int(self.header[0] >> 6)
@@ -62,9 +61,69 @@ class RtpPacket:
 
     def getPacket(self):
         """Return RTP packet."""
-        return self.header + self.payload
+        return b''.join((self.header, self.payload))
+
+    def getBuffers(self):
+        """Return [header, payload] for a scatter/gather send, without joining them."""
+        return [self.header, self.payload]
 
     def marker(self):
         """Return the Marker bit (M bit) as 0 or 1."""
         return self.header[1] >> 7
 
+
+class RtpHeader:
+    """Fields of a received RTP packet, unpacked in one struct call."""
+    __slots__ = ('version', 'marker', 'payloadType', 'seqNum', 'timestamp', 'ssrc', 'payload')
+
+    def __init__(self, byteStream):
+        b0, b1, self.seqNum, self.timestamp, self.ssrc = RTP_HEADER.unpack_from(byteStream)
+        self.version = b0 >> 6
+        self.marker = b1 >> 7
+        self.payloadType = b1 & 0x7F
+        self.payload = memoryview(byteStream)[HEADER_SIZE:]
+
+
+class RtpPacketizer:
+    """Fast path encoder: cuts a frame into (header, payload) pairs.
+
+    The headers of a frame are packed with RTP_HEADER into one buffer that is
+    reused for the next frame, and payloads are memoryview slices of the frame,
+    so nothing is concatenated or copied. The headers returned by a call are
+    overwritten by the next one: send or copy the pairs before packetizing
+    another frame.
+    """
+
+    def __init__(self, pt=26, ssrc=0, version=2):
+        self.byte0 = version << 6
+        self.pt = pt & 0x7F
+        self.ssrc = ssrc & 0xFFFFFFFF
+        self.buffer = bytearray(0)
+        self.view = memoryview(self.buffer)
+
+    def packetize(self, frame, chunkSize, seqnum, timestamp):
+        """Return the (header, payload) pairs of frame; the last one has the marker bit set.
+
+        Packets are numbered seqnum, seqnum + 1, ... and all carry timestamp.
+        The pairs are valid only until the next call.
+        """
+        frame = memoryview(frame)
+        frameSize = len(frame)
+        count = (frameSize + chunkSize - 1) // chunkSize
+        if len(self.buffer) < count * HEADER_SIZE:
+            # a new buffer: resizing a bytearray with views exported is an error
+            self.buffer = bytearray(count * HEADER_SIZE * 2)
+            self.view = memoryview(self.buffer)
+
+        pack_into = RTP_HEADER.pack_into
+        buffer, view = self.buffer, self.view
+        byte0, pt, ssrc = self.byte0, self.pt, self.ssrc
+        timestamp &= 0xFFFFFFFF
+        pairs = []
+        for i in range(count):
+            pos = i * HEADER_SIZE
+            marker = 0x80 if i == count - 1 else 0
+            pack_into(buffer, pos, byte0, marker | pt, (seqnum + i) & 0xFFFF, timestamp, ssrc)
+            start = i * chunkSize
+            pairs.append((view[pos:pos + HEADER_SIZE], frame[start:start + chunkSize]))
+        return pairs
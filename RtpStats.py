@@ -0,0 +1,139 @@
+from Rtcp import ReportBlock
+
+SEQ_MOD = 1 << 16
+TS_MOD = 1 << 32
+
+# RFC 3550 appendix A.1 thresholds
+MAX_DROPOUT = 3000
+MAX_MISORDER = 100
+
+
+class RtpReceiverStats:
+    """Extends 16-bit RTP sequence numbers and 32-bit timestamps and counts packet loss.
+
+    Follows RFC 3550 appendix A.1, so loss and reordering stay correct after
+    the sequence number wraps (every 65,536 packets) on long streams.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.baseSeq = None     # first extended sequence number
+        self.maxSeq = 0         # highest 16-bit sequence number seen
+        self.cycles = 0         # wraps of the sequence number, times SEQ_MOD
+        self.badSeq = None      # sequence number after a large jump, see update
+        self.received = 0
+        self.reordered = 0
+        self.skipped = 0        # sequence numbers jumped over by skipTo, not expected
+        self.lastTimestamp = None  # extended timestamp of the last packet
+        self.jitter = 0.0          # interarrival jitter (appendix A.8), in timestamp units
+        self.lastTransit = None
+        self.expectedPrior = 0     # expected() and received at the last report block
+        self.receivedPrior = 0
+
+    def update(self, seq):
+        """Record packet seq and return its extended sequence number.
+
+        Returns None for a packet after a very large jump, until the next
+        packet confirms the jump (the sender restarted its numbering).
+        """
+        if self.baseSeq is None:
+            self._restart(seq)
+            return seq
+
+        delta = (seq - self.maxSeq) % SEQ_MOD
+        if delta < MAX_DROPOUT:
+            # in order, possibly with a gap
+            if seq < self.maxSeq:
+                self.cycles += SEQ_MOD
+            self.maxSeq = seq
+            extended = self.cycles + seq
+        elif delta <= SEQ_MOD - MAX_MISORDER:
+            # very large jump: trust it only if the next packet follows it
+            if seq == self.badSeq:
+                self._restart(seq)
+                return self.baseSeq
+            self.badSeq = (seq + 1) % SEQ_MOD
+            return None
+        else:
+            # late (reordered or duplicated) packet, maybe from before the last wrap
+            extended = self.cycles + seq
+            if seq > self.maxSeq:
+                extended -= SEQ_MOD
+            self.reordered += 1
+        self.received += 1
+        return extended
+
+    def _restart(self, seq):
+        self.baseSeq = seq
+        self.maxSeq = seq
+        self.cycles = 0
+        self.badSeq = None
+        self.received = 1
+        self.reordered = 0
+        self.skipped = 0
+
+    def unwrapTimestamp(self, timestamp):
+        """Return the extended timestamp of a 32-bit RTP timestamp."""
+        if self.lastTimestamp is None:
+            self.lastTimestamp = timestamp
+            return timestamp
+        delta = (timestamp - self.lastTimestamp) % TS_MOD
+        if delta >= TS_MOD // 2:
+            delta -= TS_MOD  # older than the last packet
+        extended = self.lastTimestamp + delta
+        if delta > 0:
+            self.lastTimestamp = extended
+        return extended
+
+    def updateJitter(self, timestamp, arrival):
+        """Account a packet with this (extended) timestamp that arrived at arrival, in timestamp units."""
+        transit = arrival - timestamp
+        if self.lastTransit is not None:
+            self.jitter += (abs(transit - self.lastTransit) - self.jitter) / 16
+        self.lastTransit = transit
+
+    def reportBlock(self, ssrc, lsr=0, dlsr=0):
+        """RTCP report block of source ssrc; the fraction lost covers the packets since the previous block."""
+        expected = self.expected()
+        expectedInterval = expected - self.expectedPrior
+        receivedInterval = self.received - self.receivedPrior
+        self.expectedPrior = expected
+        self.receivedPrior = self.received
+        lostInterval = expectedInterval - receivedInterval
+        fraction = (lostInterval << 8) // expectedInterval if expectedInterval > 0 and lostInterval > 0 else 0
+        return ReportBlock(ssrc, min(fraction, 255), self.lost(), self.highestSeq(), self.jitter, lsr, dlsr)
+
+    def skipTo(self, seq):
+        """The sender continues at seq (a live stream resumed): the numbers before it are not expected.
+
+        Returns the extended sequence number of seq, taken after the highest
+        received since the stream only moves forward; None before any packet.
+        """
+        if self.baseSeq is None:
+            return None
+        highest = self.highestSeq()
+        extended = highest + 1 + (seq - highest - 1) % SEQ_MOD
+        self.skipped += extended - highest - 1
+        self.cycles = (extended - 1) - (extended - 1) % SEQ_MOD
+        self.maxSeq = (extended - 1) % SEQ_MOD
+        return extended
+
+    def extend(self, seq):
+        """Extended sequence number of seq, taken as the closest to the highest received; nothing is recorded."""
+        highest = self.highestSeq()
+        return highest + ((seq - highest + SEQ_MOD // 2) % SEQ_MOD) - SEQ_MOD // 2
+
+    def highestSeq(self):
+        """Extended highest sequence number received."""
+        return self.cycles + self.maxSeq
+
+    def expected(self):
+        if self.baseSeq is None:
+            return 0
+        return self.highestSeq() - self.baseSeq + 1 - self.skipped
+
+    def lost(self):
+        """Packets expected but not received (negative with duplicates)."""
+        return self.expected() - self.received
@@ -0,0 +1,42 @@
+RTSP_VERSION = "RTSP/1.0"
+
+
+def formatRequest(method, url, cseq, *headers):
+    """Return the text of an RTSP request; headers are 'Name: value' lines after CSeq.
+
+    Like the server's replies, requests have no terminating blank line.
+    """
+    return "\r\n".join([f"{method} {url} {RTSP_VERSION}", f"CSeq: {cseq}", *headers])
+
+
+class RtspReply:
+    """Status code, CSeq, session id and headers (lower-case names) of an RTSP reply."""
+    __slots__ = ('code', 'cseq', 'session', 'headers')
+
+    def __init__(self, code, cseq, session, headers):
+        self.code = code
+        self.cseq = cseq
+        self.session = session
+        self.headers = headers
+
+
+def parseReply(data):
+    """Parse the text of an RTSP reply, e.g. 'RTSP/1.0 200 OK\\nCSeq: 2\\nSession: 123456'."""
+    lines = data.split('\n')
+    code = int(lines[0].split(' ')[1])
+    headers = {}
+    for line in lines[1:]:
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    return RtspReply(code, int(headers.get('cseq', -1)), int(headers.get('session', 0)), headers)
+
+
+def parseRtpInfo(value):
+    """Parameters of an RTP-Info header value, e.g. {'url': 'movie.Mjpeg', 'seq': '1234', 'rtptime': '0'}."""
+    info = {}
+    for param in value.split(';'):
+        name, sep, value = param.partition('=')
+        if sep:
+            info[name.strip()] = value.strip()
+    return info
@@ -1,26 +1,108 @@
-import sys, socket
+import sys, socket, argparse, signal
 
 from ServerWorker import ServerWorker
+from AsyncServer import AsyncServer
+from FrameCache import sharedFrameCache, DEFAULT_CACHE_BYTES
+from ServerMetrics import startMetricsServer, serverMetrics
+from MultiProcessServer import MultiProcessServer
+from Tracing import tracer
 
 
 class Server:
 
     def main(self):
-        try:
-            SERVER_PORT = int(sys.argv[1])
-        except:
-            print("[Usage: Server.py Server_port]\n")
+        parser = argparse.ArgumentParser(usage="Server.py Server_port [--async] [--pace] [--mmap] [--no-sendmmsg] [--frame-cache-mb N] [--prepacketize] [--metrics-port N] [--trace FILE] [--workers N] [--drain-timeout S] [--rendition TITLE MODE FILE ...] [--broadcast]")
+        parser.add_argument('port', type=int)
+        parser.add_argument('--async', dest='asyncMode', action='store_true',
+                            help="run all sessions on one asyncio event loop instead of a thread per client")
+        parser.add_argument('--pace', action='store_true',
+                            help="send frames at the target fps (24 normal, 30 HD) with packets spread over each frame")
+        parser.add_argument('--mmap', action='store_true',
+                            help="serve frames zero-copy from a memory-mapped video file")
+        parser.add_argument('--no-sendmmsg', action='store_true',
+                            help="send RTP packets one syscall at a time")
+        parser.add_argument('--frame-cache-mb', type=int, default=DEFAULT_CACHE_BYTES // (1024 * 1024),
+                            help="size of the frame cache shared by all sessions (0 disables it)")
+        parser.add_argument('--prepacketize', action='store_true',
+                            help="cut each video into RTP packets once, shared by its sessions")
+        parser.add_argument('--metrics-port', type=int, default=None,
+                            help="serve Prometheus metrics on http://127.0.0.1:N/metrics")
+        parser.add_argument('--trace', default=None,
+                            help="record RTSP and per-frame read/packetize/send spans to this Chrome trace file (FILE.N per worker)")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="serve from N processes accepting on the same port (SO_REUSEPORT)")
+        parser.add_argument('--drain-timeout', type=float, default=30.0,
+                            help="on SIGTERM, stop accepting and wait up to S seconds for the sessions to end")
+        parser.add_argument('--rendition', nargs=3, action='append', default=[], metavar=('TITLE', 'MODE', 'FILE'),
+                            help="serve FILE as the MODE (normal/hd) rendition of TITLE; clients switch between them mid-stream")
+        parser.add_argument('--broadcast', action='store_true',
+                            help="live mode: sessions of the same video share one stream, read and packetized once; PLAY joins at the next frame")
+        args = parser.parse_args()
+        self.port = args.port
+        self.asyncMode = args.asyncMode
+        self.draining = False
+        ServerWorker.useMmap = args.mmap
+        ServerWorker.paced = args.pace
+        ServerWorker.prepacketize = args.prepacketize
+        ServerWorker.broadcast = args.broadcast
+        for title, mode, filename in args.rendition:
+            try:
+                ServerWorker.addRendition(title, mode, filename)
+            except ValueError as e:
+                parser.error(str(e))
+        if args.no_sendmmsg:
+            ServerWorker.batchSend = False
+        sharedFrameCache.resize(args.frame_cache_mb * 1024 * 1024)
+
+        if args.workers > 1:
+            MultiProcessServer(self, args.workers, args.drain_timeout).run(args.metrics_port, args.trace)
+            return
+
+        if args.metrics_port is not None:
+            startMetricsServer(args.metrics_port)
+        if args.trace:
+            tracer.start(args.trace, "RTSP server")
+        self.serve(self.listen(), args.drain_timeout)
+
+    def listen(self, reusePort=False):
+        """Open the RTSP listening socket; with reusePort, other processes can listen on the same port."""
         rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        rtspSocket.bind(('', SERVER_PORT))
+        if reusePort:
+            rtspSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        rtspSocket.bind(('', self.port))
         rtspSocket.listen(5)
+        return rtspSocket
 
+    def serve(self, rtspSocket, drainTimeout):
+        """Serve clients until SIGTERM, then wait up to drainTimeout seconds for their sessions to end."""
+        if self.asyncMode:
+            AsyncServer(self.port, rtspSocket).run(drainTimeout)
+            return
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stopAccepting(rtspSocket))
         # Receive client info (address,port) through RTSP/TCP session
-        while True:
+        while not self.draining:
             clientInfo = {}
-            clientInfo['rtspSocket'] = rtspSocket.accept()
+            try:
+                clientInfo['rtspSocket'] = rtspSocket.accept()
+            except OSError:
+                if self.draining:
+                    break
+                raise
             ServerWorker(clientInfo).run()
+        rtspSocket.close()
+        serverMetrics.waitIdle(drainTimeout)
+
+    def stopAccepting(self, rtspSocket):
+        """Start draining: refuse new connections, sessions already set up keep streaming.
 
+        A second SIGTERM stops the server without waiting.
+        """
+        if self.draining:
+            sys.exit(1)
+        print("Draining: no new connections")
+        self.draining = True
+        rtspSocket.shutdown(socket.SHUT_RD)  # wakes up accept()
 
 if __name__ == "__main__":
     (Server()).main()
-
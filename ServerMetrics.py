@@ -0,0 +1,223 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from FrameCache import sharedFrameCache
+from Broadcast import BroadcastChannel
+import RtpPacer
+
+# (attribute, metric name, type, help) of the counters kept per session
+SESSION_COUNTERS = [
+    ('framesRead', 'frames_read_total', 'counter', "Frames read from the video file."),
+    ('packetsSent', 'packets_sent_total', 'counter', "RTP packets sent."),
+    ('bytesSent', 'bytes_sent_total', 'counter', "RTP bytes sent, headers included."),
+    ('sendErrors', 'send_errors_total', 'counter', "Failed RTP sends."),
+    ('fecPacketsSent', 'fec_packets_sent_total', 'counter', "FEC packets sent."),
+    ('fecBytesSent', 'fec_bytes_sent_total', 'counter', "FEC bytes sent, headers included."),
+    ('nextFrameSeconds', 'next_frame_seconds_total', 'counter', "Time spent in VideoStream.nextFrame."),
+    ('sendSeconds', 'send_seconds_total', 'counter', "Time spent sending RTP packets (sendto/sendmsg/sendmmsg)."),
+    ('lagSeconds', 'send_lag_seconds_sum', 'summary', "Lateness of each frame against the target fps."),
+    ('lagCount', 'send_lag_seconds_count', None, None),
+    ('rtcpReports', 'rtcp_reports_total', 'counter', "RTCP receiver reports received."),
+    ('nackPackets', 'nack_packets_total', 'counter', "Packets asked for again in RTCP NACKs."),
+    ('retransmitHits', 'retransmit_hits_total', 'counter', "NACKed packets found in the history and sent again."),
+    ('retransmitMisses', 'retransmit_misses_total', 'counter', "NACKed packets no longer in the history."),
+]
+
+# (attribute, metric name, help) of the gauges kept per session
+SESSION_GAUGES = [
+    ('lagMax', 'send_lag_max_seconds', "Largest frame lateness of the session."),
+    ('pendingPackets', 'pending_packets', "Packets of the frame being paced not sent yet."),
+    ('fractionLost', 'rtcp_fraction_lost', "Fraction of packets lost, from the last RTCP receiver report."),
+    ('jitterSeconds', 'rtcp_jitter_seconds', "Interarrival jitter, from the last RTCP receiver report."),
+    ('rttSeconds', 'rtcp_rtt_seconds', "Round-trip time, from the last RTCP receiver report."),
+    ('rateScale', 'send_rate_scale', "Send rate of the session against its nominal frame rate (congestion control)."),
+]
+
+
+class SessionMetrics:
+    """Counters of one streaming session, updated by the thread that sends it."""
+
+    def __init__(self):
+        self.session = None  # RTSP session id once SETUP is done
+        self.framesRead = 0
+        self.packetsSent = 0
+        self.bytesSent = 0
+        self.sendErrors = 0
+        self.fecPacketsSent = 0
+        self.fecBytesSent = 0
+        self.nextFrameSeconds = 0.0
+        self.sendSeconds = 0.0
+        self.lagSeconds = 0.0
+        self.lagCount = 0
+        self.lagMax = 0.0
+        self.pendingPackets = 0  # packets of the current paced frame not sent yet
+        # from RTCP receiver reports
+        self.rtcpReports = 0
+        self.nackPackets = 0
+        self.retransmitHits = 0
+        self.retransmitMisses = 0
+        self.fractionLost = 0.0
+        self.jitterSeconds = 0.0
+        self.rttSeconds = 0.0
+        self.rateScale = 1.0
+
+    def frameRead(self, elapsed):
+        self.framesRead += 1
+        self.nextFrameSeconds += elapsed
+
+    def sent(self, packets, size, elapsed):
+        self.packetsSent += packets
+        self.bytesSent += size
+        self.sendSeconds += elapsed
+
+    def fecSent(self, packets, size):
+        self.fecPacketsSent += packets
+        self.fecBytesSent += size
+
+    def lag(self, seconds):
+        """Record how late (negative: early) a frame started against its target time."""
+        self.lagSeconds += seconds
+        self.lagCount += 1
+        if seconds > self.lagMax:
+            self.lagMax = seconds
+
+
+class MetricsRegistry:
+    """Sessions of the server process, rendered in the Prometheus text format.
+
+    Global counters are the sum of the live sessions and of every session
+    already torn down, so they never go backwards.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)  # notified when a session is removed
+        self.sessions = set()
+        self.retired = SessionMetrics()
+
+    def add(self, metrics):
+        with self.lock:
+            self.sessions.add(metrics)
+
+    def remove(self, metrics):
+        with self.lock:
+            if metrics not in self.sessions:
+                return
+            self.sessions.discard(metrics)
+            for attr, *_ in SESSION_COUNTERS:
+                setattr(self.retired, attr, getattr(self.retired, attr) + getattr(metrics, attr))
+            self.idle.notify_all()
+
+    def waitIdle(self, timeout=None):
+        """Wait until no session is left (at most timeout seconds); return True if none is."""
+        with self.lock:
+            return self.idle.wait_for(lambda: not self.sessions, timeout)
+
+    def snapshot(self):
+        """Every metric as plain data (JSON-ready), as multi-process workers send it to their parent."""
+        with self.lock:
+            sessions = sorted(self.sessions, key=lambda m: m.session or 0)
+            retired = self.retired
+        pacer = RtpPacer.runningPacer()
+        channels, subscribers = BroadcastChannel.stats()
+        return {
+            'totals': {attr: getattr(retired, attr) + sum(getattr(m, attr) for m in sessions)
+                       for attr, *_ in SESSION_COUNTERS},
+            'sessions': [dict({attr: getattr(m, attr) for attr, *_ in SESSION_COUNTERS + SESSION_GAUGES},
+                              session=m.session)
+                         for m in sessions],
+            'pacerSessions': pacer.sessionCount() if pacer else 0,
+            'broadcastChannels': channels,
+            'broadcastSubscribers': subscribers,
+            'frameCache': sharedFrameCache.stats(),
+        }
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format (version 0.0.4)."""
+        return renderMetrics([self.snapshot()])
+
+
+def renderMetrics(snapshots):
+    """Prometheus text of one or more snapshots (one per worker process), totals summed.
+
+    A snapshot's optional 'labels' dict, e.g. {'worker': '2'}, is added to its per-session series.
+    """
+    lines = []
+
+    def header(name, kind, text):
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    sessions = []
+    for snapshot in snapshots:
+        extra = "".join(f',{key}="{value}"' for key, value in snapshot.get('labels', {}).items())
+        sessions += [(f'session="{m["session"]}"' + extra, m) for m in snapshot['sessions']]
+
+    header("rtp_sessions_active", "gauge", "Sessions set up and not torn down.")
+    lines.append(f"rtp_sessions_active {len(sessions)}")
+
+    # process totals
+    for attr, name, kind, text in SESSION_COUNTERS:
+        if kind is not None:
+            header("rtp_" + name.replace('_sum', ''), kind, text)
+        lines.append(f"rtp_{name} {sum(snapshot['totals'][attr] for snapshot in snapshots)}")
+
+    # per session
+    for attr, name, kind, text in SESSION_COUNTERS:
+        if kind is not None:
+            header("rtp_session_" + name.replace('_sum', ''), kind, text)
+        for labels, m in sessions:
+            lines.append(f'rtp_session_{name}{{{labels}}} {m[attr]}')
+    for attr, name, text in SESSION_GAUGES:
+        header(f"rtp_session_{name}", "gauge", text)
+        for labels, m in sessions:
+            lines.append(f'rtp_session_{name}{{{labels}}} {m[attr]}')
+
+    # send queue and frame cache
+    header("rtp_pacer_sessions", "gauge", "Sessions scheduled on the shared pacer.")
+    lines.append(f"rtp_pacer_sessions {sum(snapshot['pacerSessions'] for snapshot in snapshots)}")
+    header("rtp_broadcast_channels", "gauge", "Broadcast channels running.")
+    lines.append(f"rtp_broadcast_channels {sum(snapshot['broadcastChannels'] for snapshot in snapshots)}")
+    header("rtp_broadcast_subscribers", "gauge", "Sessions subscribed to a broadcast channel.")
+    lines.append(f"rtp_broadcast_subscribers {sum(snapshot['broadcastSubscribers'] for snapshot in snapshots)}")
+    for key, kind, text in (('hits', 'counter', "Frame cache hits."),
+                            ('misses', 'counter', "Frame cache misses."),
+                            ('evictions', 'counter', "Frames evicted from the frame cache."),
+                            ('frames', 'gauge', "Frames in the frame cache."),
+                            ('bytes', 'gauge', "Bytes in the frame cache."),
+                            ('max_bytes', 'gauge', "Size limit of the frame cache.")):
+        name = f"rtp_frame_cache_{key}" + ("_total" if kind == 'counter' else "")
+        header(name, kind, text)
+        lines.append(f"{name} {sum(snapshot['frameCache'][key] for snapshot in snapshots)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scraped every few seconds, keep stdout for RTSP logs
+
+
+def startMetricsServer(port, registry=None, host='127.0.0.1'):
+    """Serve registry (serverMetrics by default, or anything with a render()) on
+    http://host:port/metrics from a daemon thread."""
+    handler = type('Handler', (MetricsHandler,), {'registry': registry or serverMetrics})
+    httpd = ThreadingHTTPServer((host, port), handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+# Registry of every session of the server process
+serverMetrics = MetricsRegistry()
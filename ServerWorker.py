@@ -1,7 +1,21 @@
+import math
 from random import randint
+from time import perf_counter, monotonic
 import sys, traceback, threading, socket
 from VideoStream import VideoStream
-from RtpPacket import RtpPacket
+from FrameIndex import FrameIndex
+from RtpPacket import RtpPacketizer, RTP_CLOCK_RATE, HEADER_SIZE
+from RtpPacer import sharedPacer
+from PacketTable import PacketTable, FramePackets
+from ServerMetrics import SessionMetrics, serverMetrics
+from Rtcp import SenderReport, GenericNack, ntpTime, ntpMiddle
+from Fec import FecEncoder
+import Fec
+from PacketHistory import PacketHistory
+from Broadcast import BroadcastChannel
+import Rtcp
+from Tracing import tracer
+import UdpBatch
 
 class ServerWorker:
     SETUP = 'SETUP'
@@ -9,6 +23,7 @@ class ServerWorker:
     PAUSE = 'PAUSE'
     TEARDOWN = 'TEARDOWN'
     DESCRIBE = 'DESCRIBE'
+    SET_PARAMETER = 'SET_PARAMETER'
 
     INIT = 0
     READY = 1
@@ -18,13 +33,89 @@ class ServerWorker:
     OK_200 = 0
     FILE_NOT_FOUND_404 = 1
     CON_ERR_500 = 2
+    PARAMETER_NOT_UNDERSTOOD_451 = 3
+    METHOD_NOT_VALID_455 = 4
 
     clientInfo = {}
 
+    MAX_RTP_PAYLOAD = 1500 # gửi tối đa bao nhiêu bytes
+    END_OF_VIDEO = b"END_OF_VIDEO"
+
+    # target frame rate per mode, matching Client.baseFrameInterval
+    FRAME_RATES = {'normal': 24, 'hd': 30}
+    # title -> {mode: video file}: renditions of one video a session can switch
+    # between with SET_PARAMETER (Server.py --rendition)
+    renditions = {}
+    # packets of a frame are sent in bursts of PACING_BURST spread over
+    # PACING_SPREAD of the frame interval
+    PACING_BURST = 4
+    PACING_SPREAD = 0.5
+
+    # serve frames as memoryview slices of an mmap of the video file
+    useMmap = False
+    # release frames at FRAME_RATES through the shared RtpPacer instead of a sendRtp thread
+    paced = False
+    # hand all packets of a frame (or paced burst) to the kernel in one sendmmsg call
+    batchSend = UdpBatch.available()
+    # cut each video into RTP packets once (PacketTable) and only patch sequence numbers and SSRC per session
+    prepacketize = False
+    # sessions of one video and mode share a live BroadcastChannel: read and
+    # packetized once, joined at the next frame, no seeking or rendition switch
+    broadcast = False
+    # delay between two frames of the unpaced sendRtp loop
+    FRAME_DELAY = 0.05
+    # RTCP: seconds between sender reports, and the loss-based rate control
+    # driven by receiver reports: multiplicative decrease above LOSS_HIGH,
+    # additive increase back to the nominal rate at or below LOSS_LOW
+    RTCP_INTERVAL = 1.0
+    LOSS_HIGH = 0.05
+    LOSS_LOW = 0.01
+    RATE_STEP = 0.05
+    MIN_RATE_SCALE = 0.25
+    # frames of sent packets kept per session for the NACKs of RTCP feedback
+    NACK_HISTORY_FRAMES = 64
+
     def __init__(self, clientInfo):
         self.clientInfo = clientInfo
         self.mode = "normal"
 
+        # per-session RTP numbering: random SSRC and first sequence number (RFC 3550)
+        self.ssrc = randint(0, 0xFFFFFFFF)
+        self.rtpSeq = randint(0, 0xFFFF)
+        self.packetizer = RtpPacketizer(pt=26, ssrc=self.ssrc)  # MJPEG type
+        self.packetTable = None  # shared PacketTable of the video, with prepacketize
+        # XOR parity packets, one per group of media packets of a frame (FEC: header of DESCRIBE)
+        self.fecEncoder = None
+        self.fecPackets = []  # of the frame being sent
+        # packets sent recently, resent on NACK with their own sequence numbers
+        self.history = PacketHistory(self.MAX_RTP_PAYLOAD, self.NACK_HISTORY_FRAMES)
+        self.rtxSeq = randint(0, 0xFFFF)
+        self.channel = None  # BroadcastChannel subscribed to, with broadcast
+        # held while a frame is read and sent, so a seek lands between two frames
+        self.streamLock = threading.Lock()
+
+        # sendRtp thread control: sleeps on sendCond while paused, no polling
+        self.sendCond = threading.Condition()
+        self.sending = False
+        self.resumes = 0  # resumeStream calls, a resume cuts the current frame delay short
+        self.closed = False
+
+        # counters exported by ServerMetrics
+        self.metrics = SessionMetrics()
+        self.lastFrameStart = None  # of the unpaced send loop, for its lag
+        self.sendingFrame = 0  # frame number of the packets being sent, for the trace
+
+        # RTCP
+        self.rateScale = 1.0  # send rate against the nominal frame rate, lowered on reported loss
+        self.nextSenderReport = 0.0
+
+        # paced sending state
+        self.pacedFrame = None
+        self.pacedPackets = []
+        self.pacedIndex = 0
+        self.nextFrameDue = None
+        self.burstGap = 0
+
     def run(self):
         threading.Thread(target=self.recvRtspRequest, daemon=True).start()
 
@@ -33,20 +124,33 @@ class ServerWorker:
         connSocket = self.clientInfo['rtspSocket'][0]
 
         while True:
-            data = connSocket.recv(256)
+            try:
+                data = connSocket.recv(256)
+            except OSError:
+                data = b""
 
-            if data:
-                data_str = data.decode("utf-8").strip()
-                print("Data received:\n" + data_str)
+            if not data:
+                # client gone: stop its sendRtp thread instead of spinning on recv
+                self.pauseStream()
+                self.closeRtpTransport()
+                connSocket.close()
+                return
 
-                if data_str == "STOP_STREAMING":
-                    self.clientInfo['event'].set()  # tạm dừng
-                    continue  # không gọi processRtspRequest
+            data_str = data.decode("utf-8").strip()
+            print("Data received:\n" + data_str)
 
-                self.processRtspRequest(data_str)
+            if data_str == "STOP_STREAMING":
+                self.pauseStream()  # tạm dừng
+                continue  # không gọi processRtspRequest
+
+            self.processRtspRequest(data_str)
 
     def processRtspRequest(self, data):
         """Process RTSP request sent from the client."""
+        with tracer.span("processRtspRequest", 'server', ssrc=self.ssrc, request=data.split(' ', 1)[0]):
+            self._processRtspRequest(data)
+
+    def _processRtspRequest(self, data):
         # Get the request type
         request = data.split('\n')
         line1 = request[0].split(' ')
@@ -63,147 +167,658 @@ class ServerWorker:
             if self.state == self.INIT:
                 print("processing SETUP\n")
                 try:
-                    self.clientInfo['videoStream'] = VideoStream(filename, mode=self.mode)
+                    ports = self.clientPorts(request)
+                    self.clientInfo['videoStream'] = VideoStream(self.renditionFile(filename, self.mode),
+                                                                 mode=self.mode, useMmap=self.useMmap)
                     self.state = self.READY
+                    if self.prepacketize:
+                        self.packetTable = PacketTable.forIndex(self.clientInfo['videoStream'].index,
+                                                                self.MAX_RTP_PAYLOAD, self.frameTicks())
                 except IOError:
                     self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1])
                     return
+                except ValueError:
+                    # no Transport client_port, or a mode VideoStream does not know
+                    self.replyRtsp(self.PARAMETER_NOT_UNDERSTOOD_451, seq[1])
+                    return
 
                 self.clientInfo['session'] = randint(100000, 999999)
-                self.replyRtsp(self.OK_200, seq[1])
-
-                self.clientInfo['rtpPort'] = int(request[2].split('=')[1].strip())
-
-
-                self.clientInfo["rtpSocket"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-                self.clientInfo['event'] = threading.Event()
-                self.clientInfo['event'].clear()
-
-                self.clientInfo['worker'] = threading.Thread(target=self.sendRtp, daemon=True)
-                self.clientInfo['worker'].start()
+                self.metrics.session = self.clientInfo['session']
+                serverMetrics.add(self.metrics)
+                self.clientInfo['rtpPort'], self.clientInfo['rtcpPort'] = ports
+                rtpPort, rtcpPort = self.openRtcp()
+                headers = [f"Range: npt=0.000-{self.duration():.3f}",
+                           f"Transport: RTP/UDP; client_port={self.clientInfo['rtpPort']}-{self.clientInfo['rtcpPort']}; "
+                           f"server_port={rtpPort}-{rtcpPort}"]
+                bitrates = self.renditionBitrates(filename)
+                if bitrates:
+                    headers.append("Renditions: " + ",".join(f"{mode}={rate}" for mode, rate in bitrates.items()))
+                self.replyRtsp(self.OK_200, seq[1], headers)
+
+                if not self.broadcast:
+                    self.openRtpTransport()
+                    return
+                # the client fills its buffer before PLAY: subscribe right away too
+                try:
+                    self.joinBroadcast(filename)
+                except IOError:
+                    print("Cannot start the broadcast of", filename)
 
-        # PLAY
+        # PLAY, optionally from the position in its Range header (also while playing)
         elif requestType == self.PLAY:
-            if self.state == self.READY:
+            if self.state in (self.READY, self.PLAYING):
                 print("processing PLAY\n")
                 self.state = self.PLAYING
-                self.clientInfo['event'].clear()
-                self.replyRtsp(self.OK_200, seq[1])
+                start = self.requestRange(request)
+                headers = []
+                if self.broadcast:
+                    # live: any Range is answered with the next frame of the broadcast
+                    try:
+                        headers = self.joinBroadcast(filename)
+                    except IOError:
+                        self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1])
+                        return
+                    self.replyRtsp(self.OK_200, seq[1], headers)
+                    return
+                if start is not None:
+                    headers = self.seekStream(start, filename)
+                # reply first, so the client knows the RTP-Info before the packets arrive
+                self.replyRtsp(self.OK_200, seq[1], headers)
+                self.resumeStream()
 
         # PAUSE
         elif requestType == self.PAUSE:
             if self.state == self.PLAYING:
                 print("processing PAUSE\n")
                 self.state = self.READY
-                self.clientInfo['event'].set()
+                self.pauseStream()
                 self.replyRtsp(self.OK_200, seq[1])
 
         # TEARDOWN
         elif requestType == self.TEARDOWN:
             print("processing TEARDOWN\n")
-            self.clientInfo['event'].set()
+            self.pauseStream()
             self.replyRtsp(self.OK_200, seq[1])
-            self.clientInfo['rtpSocket'].close()
+            self.closeRtpTransport()
 
         #
         elif requestType == self.DESCRIBE:
             print("processing DESCRIBE\n")
-            self.mode = 'normal'
+            mode = 'normal'
+            fecRatio = None
             for line in request[2:]:
                 if line.upper().startswith("MODE:"):
-                    self.mode = line.split(":", 1)[1].strip()
-                    break
-            self.replyRtsp(self.OK_200, seq[1])
+                    mode = line.split(":", 1)[1].strip()
+                elif line.upper().startswith("FEC:"):
+                    fecRatio = line.split(":", 1)[1]
+            if mode not in self.FRAME_RATES:
+                self.replyRtsp(self.PARAMETER_NOT_UNDERSTOOD_451, seq[1])
+                return
+            self.mode = mode
+            headers = []
+            if fecRatio is not None:
+                try:
+                    group = Fec.groupSize(fecRatio)
+                except ValueError:
+                    self.replyRtsp(self.PARAMETER_NOT_UNDERSTOOD_451, seq[1])
+                    return
+                if self.broadcast:
+                    group = 0  # the shared channel sends no FEC: the reply offers none
+                self.fecEncoder = FecEncoder(group, self.ssrc) if group else None
+                if group:
+                    headers.append(f"FEC: group={group}; pt={Fec.FEC_PT}")
+            self.replyRtsp(self.OK_200, seq[1], headers)
+
+        # SET_PARAMETER Mode: switch to another rendition without a new session
+        elif requestType == self.SET_PARAMETER:
+            if self.state in (self.READY, self.PLAYING):
+                print("processing SET_PARAMETER\n")
+                mode = None
+                for line in request[2:]:
+                    if line.upper().startswith("MODE:"):
+                        mode = line.split(":", 1)[1].strip()
+                if self.broadcast:
+                    # one shared stream per rendition, a session cannot switch alone
+                    self.replyRtsp(self.METHOD_NOT_VALID_455, seq[1])
+                    return
+                if mode not in self.FRAME_RATES:
+                    self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1])
+                    return
+                try:
+                    headers = self.switchRendition(mode, filename)
+                except IOError:
+                    self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1])
+                    return
+                self.replyRtsp(self.OK_200, seq[1], headers)
+
+    @classmethod
+    def addRendition(cls, title, mode, filename):
+        """Register filename as the rendition of title in mode."""
+        if mode not in cls.FRAME_RATES:
+            raise ValueError(f"unknown mode {mode!r}")
+        cls.renditions.setdefault(title, {})[mode] = filename
+
+    def renditionFile(self, title, mode):
+        """Video file of title in mode; title itself when it has no renditions."""
+        return self.renditions.get(title, {}).get(mode, title)
+
+    def renditionBitrates(self, title):
+        """{mode: average bits per second} of the renditions of title, lowest first; empty without any."""
+        bitrates = {}
+        for mode, filename in self.renditions.get(title, {}).items():
+            try:
+                index = FrameIndex.forFile(filename, mode)
+            except OSError:
+                continue
+            if len(index):
+                bitrates[mode] = int(sum(index.lengths) * 8 * self.FRAME_RATES[mode] / len(index))
+        return dict(sorted(bitrates.items(), key=lambda item: item[1]))
+
+    def switchRendition(self, mode, url):
+        """Continue the stream from the same position in the rendition of mode.
+
+        The switch lands between two frames: the first frame of the new
+        rendition is the one at or after the end of the last frame sent, so
+        RTP timestamps keep increasing across the change of frame rate.
+        Returns the RTP-Info reply header: sequence number and RTP timestamp
+        of the first packet of the new rendition.
+        """
+        video = VideoStream(self.renditionFile(url, mode), mode=mode, useMmap=self.useMmap)
+        with self.streamLock:
+            old = self.clientInfo['videoStream']
+            position = old.frameNbr() / self.FRAME_RATES.get(self.mode, 24)
+            self.mode = mode
+            frameIdx = min(math.ceil(position * self.FRAME_RATES[mode] - 1e-9), video.frameCount())
+            video.seek(frameIdx)
+            self.clientInfo['videoStream'] = video
+            if self.prepacketize:
+                self.packetTable = PacketTable.forIndex(video.index, self.MAX_RTP_PAYLOAD, self.frameTicks())
+            seq = self.rtpSeq
+            rtptime = self.rtpTimestamp(frameIdx + 1)
+        old.close()
+        return [f"RTP-Info: url={url};seq={seq};rtptime={rtptime}"]
+
+    def clientPorts(self, request):
+        """(RTP, RTCP) ports of the Transport header's client_port=rtp[-rtcp]; RTCP defaults to RTP + 1."""
+        for line in request[2:]:
+            if line.upper().startswith("TRANSPORT:"):
+                for param in line.split(":", 1)[1].split(';'):
+                    name, sep, value = param.strip().partition('=')
+                    if name == 'client_port' and sep:
+                        ports = value.split('-')
+                        rtpPort = int(ports[0])
+                        return rtpPort, int(ports[1]) if len(ports) > 1 else rtpPort + 1
+        raise ValueError("SETUP without Transport client_port")
+
+    def requestRange(self, request):
+        """Start in seconds of the 'Range: npt=<start>-[<end>]' header, None without one (or npt=now-)."""
+        for line in request[2:]:
+            if line.upper().startswith("RANGE:"):
+                value = line.split(":", 1)[1].strip()
+                if not value.lower().startswith("npt="):
+                    return None
+                start = value[4:].split("-", 1)[0].strip()
+                try:
+                    seconds = 0.0
+                    for part in start.split(":"):  # npt-sec or npt-hhmmss
+                        seconds = seconds * 60 + float(part)
+                    return seconds
+                except ValueError:
+                    return None
+        return None
+
+    def duration(self):
+        """Length of the video in seconds at the frame rate of the mode."""
+        return self.clientInfo['videoStream'].frameCount() * self.frameInterval()
+
+    def seekStream(self, start, url):
+        """Continue the stream from the frame at start seconds.
+
+        The frame index makes this a single positioned read. Returns the Range
+        and RTP-Info reply headers: the sequence number and RTP timestamp of the
+        first packet sent from the new position.
+        """
+        video = self.clientInfo['videoStream']
+        fps = self.FRAME_RATES.get(self.mode, 24)
+        self.pauseStream()
+        with self.streamLock:
+            # at least the last frame is sent, so the client sees the new position
+            frameIdx = min(max(int(round(start * fps)), 0), max(video.frameCount() - 1, 0))
+            video.seek(frameIdx)
+            # drop what is left of the frame being paced
+            self.pacedFrame = None
+            self.pacedPackets = []
+            self.pacedIndex = 0
+            self.fecPackets = []
+            self.nextFrameDue = None
+            seq = self.rtpSeq
+            rtptime = self.rtpTimestamp(frameIdx + 1)
+        return [f"Range: npt={frameIdx / fps:.3f}-{self.duration():.3f}",
+                f"RTP-Info: url={url};seq={seq};rtptime={rtptime}"]
+
+    # RTP transport of the threaded engine: one sendRtp thread per session,
+    # paused and resumed through sendCond, or the shared pacer.
+
+    def openRtcp(self):
+        """Bind the session's RTP and RTCP sockets and receive RTCP on a thread; return both ports."""
+        rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rtpSocket.bind(('', 0))
+        self.clientInfo['rtpSocket'] = rtpSocket
+        rtcpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rtcpSocket.bind(('', 0))
+        self.clientInfo['rtcpSocket'] = rtcpSocket
+        threading.Thread(target=self.recvRtcp, args=(rtcpSocket,), daemon=True).start()
+        return rtpSocket.getsockname()[1], rtcpSocket.getsockname()[1]
+
+    def recvRtcp(self, rtcpSocket):
+        """Receive RTCP reports until closeRtpTransport."""
+        while True:
+            try:
+                data, addr = rtcpSocket.recvfrom(2048)
+            except OSError:
+                return
+            if not data:
+                return  # shut down
+            self.rtcpReceived(data, addr)
+
+    def openRtpTransport(self):
+        """Start streaming on the RTP socket bound by openRtcp."""
+        if self.paced:
+            self.clientInfo['pacer'] = sharedPacer()
+            self.resumeStream()
+            return
+
+        with self.sendCond:
+            self.sending = True
+        self.clientInfo['worker'] = threading.Thread(target=self.sendRtp, daemon=True)
+        self.clientInfo['worker'].start()
+
+    def resumeStream(self):
+        """Resume sending frames."""
+        if 'pacer' in self.clientInfo:
+            self.nextFrameDue = None
+            self.clientInfo['pacer'].add(self)
+        elif 'worker' in self.clientInfo:
+            self.lastFrameStart = None  # a pause is not lag
+            with self.sendCond:
+                self.sending = True
+                self.resumes += 1
+                self.sendCond.notify_all()
+            if not self.clientInfo['worker'].is_alive():
+                # sendRtp stopped at the end of the video, a seek brings it back
+                self.clientInfo['worker'] = threading.Thread(target=self.sendRtp, daemon=True)
+                self.clientInfo['worker'].start()
+
+    def pauseStream(self):
+        """Stop sending frames until resumeStream."""
+        self.pauseBroadcast()
+        if 'pacer' in self.clientInfo:
+            self.clientInfo['pacer'].remove(self)
+        elif 'worker' in self.clientInfo:
+            with self.sendCond:
+                self.sending = False
+                self.sendCond.notify_all()
+
+    def closeRtpTransport(self):
+        """Close the RTP socket."""
+        self.leaveBroadcast()
+        serverMetrics.remove(self.metrics)
+        with self.sendCond:
+            self.closed = True  # ends the sendRtp thread
+            self.sendCond.notify_all()
+        if 'rtpSocket' in self.clientInfo:
+            self.clientInfo['rtpSocket'].close()
+        rtcpSocket = self.clientInfo.pop('rtcpSocket', None)
+        if rtcpSocket is not None:
+            try:
+                rtcpSocket.shutdown(socket.SHUT_RDWR)  # wakes recvRtcp
+            except OSError:
+                pass
+            rtcpSocket.close()
+        # under streamLock: not while sendRtp or the pacer reads a frame; popped so a second call is a no-op
+        with self.streamLock:
+            video = self.clientInfo.pop('videoStream', None)
+        if video is not None:
+            video.close()
+
+    def joinBroadcast(self, url):
+        """Subscribe to the broadcast of the session's video from its next frame; return the RTP-Info reply header.
+
+        The session takes the channel's SSRC and packet history, so its RTCP
+        reports and NACKs are about the shared stream. A session paused in the
+        channel resumes there: same SSRC, and the sequence numbers continue
+        from the next frame of the live stream.
+        """
+        if self.channel is not None and self.channel.stopped.is_set():
+            self.channel = None  # ended with the video, a new one starts from the beginning
+        if self.channel is None:
+            self.channel, seq, rtptime = BroadcastChannel.join(
+                self.renditionFile(url, self.mode), self.mode, self.FRAME_RATES.get(self.mode, 24),
+                self.MAX_RTP_PAYLOAD, self, self.rtpAddress(), self.useMmap)
+            self.ssrc = self.channel.ssrc
+            self.history = self.channel.history
+        else:
+            seq, rtptime = self.channel.resume(self)
+        return [f"RTP-Info: url={url};seq={seq};rtptime={rtptime}"]
+
+    def pauseBroadcast(self):
+        if self.channel is not None:
+            self.channel.pause(self)
+
+    def leaveBroadcast(self):
+        channel, self.channel = self.channel, None
+        if channel is not None:
+            channel.leave(self)
+
+    def rtpAddress(self):
+        """Return the (address, port) RTP packets are sent to."""
+        address = self.clientInfo['rtspSocket'][1][0] # lấy cái địa chỉ của client
+        port = int(self.clientInfo.get('rtpPort', 0)) # lấy cổng rtp của client
+        return address, port
+
+    def rtcpAddress(self):
+        """Return the (address, port) RTCP reports are sent to."""
+        return self.clientInfo['rtspSocket'][1][0], self.clientInfo.get('rtcpPort', 0)
+
+    def rtcpReceived(self, data, addr):
+        """Handle an RTCP packet from the client: the report blocks and NACKs about this session's stream."""
+        if addr[0] != self.rtpAddress()[0]:
+            return
+        try:
+            reports = Rtcp.parse(data)
+        except ValueError:
+            return
+        for report in reports:
+            if isinstance(report, GenericNack):
+                if report.mediaSsrc == self.ssrc:
+                    self.retransmit(report.lost)
+                continue
+            for block in report.blocks:
+                if block.ssrc == self.ssrc:
+                    self.receiverReport(block)
+
+    def retransmit(self, seqs):
+        """Send the packets with these sequence numbers again, those still in the history."""
+        metrics = self.metrics
+        metrics.nackPackets += len(seqs)
+        for seq in seqs:
+            packet = self.history.lookup(seq)
+            if packet is None:
+                metrics.retransmitMisses += 1
+                continue
+            try:
+                self.transmit(PacketHistory.retransmission(packet, self.rtxSeq))
+            except OSError:
+                metrics.sendErrors += 1
+                return
+            self.rtxSeq = (self.rtxSeq + 1) & 0xFFFF
+            metrics.retransmitHits += 1
+
+    def receiverReport(self, block):
+        """Record a report block in the metrics and adapt the send rate to the loss it reports."""
+        metrics = self.metrics
+        metrics.rtcpReports += 1
+        loss = block.fractionLost / 256
+        metrics.fractionLost = loss
+        metrics.jitterSeconds = block.jitter / RTP_CLOCK_RATE
+        if block.lsr:
+            rtt = (ntpMiddle(ntpTime()) - block.lsr - block.dlsr) & 0xFFFFFFFF
+            if rtt < 0x80000000:
+                metrics.rttSeconds = rtt / 65536
+
+        if loss > self.LOSS_HIGH:
+            self.rateScale = max(self.MIN_RATE_SCALE, self.rateScale * (1 - loss / 2))
+        elif loss <= self.LOSS_LOW:
+            self.rateScale = min(1.0, self.rateScale + self.RATE_STEP)
+        metrics.rateScale = self.rateScale
+
+    def sendSenderReport(self, now):
+        """Send an RTCP SR: wall clock against the RTP timestamp of the frame being sent, and the counts."""
+        self.nextSenderReport = now + self.RTCP_INTERVAL
+        metrics = self.metrics
+        report = SenderReport(self.ssrc, ntpTime(), self.rtpTimestamp(max(self.sendingFrame, 1)),
+                              metrics.packetsSent, metrics.bytesSent - metrics.packetsSent * HEADER_SIZE)
+        self.sendRtcp(report.pack())
+
+    def sendRtcp(self, data):
+        """Send an RTCP packet to the client's RTCP port, from the session's RTCP socket."""
+        rtcpSocket = self.clientInfo.get('rtcpSocket')
+        if rtcpSocket is None:
+            return
+        try:
+            rtcpSocket.sendto(data, self.rtcpAddress())
+        except OSError:
+            pass
+
+    def transmit(self, packet):
+        """Send one (header, payload) RTP packet to the client."""
+        rtp_socket = self.clientInfo['rtpSocket']
+        if hasattr(rtp_socket, 'sendmsg'):
+            # the payload goes to the kernel without being joined to the header
+            rtp_socket.sendmsg(packet, [], 0, self.rtpAddress())
+        else:
+            rtp_socket.sendto(b''.join(packet), self.rtpAddress())
+
+    def transmitBatch(self, packets, frame=None, offset=0):
+        """Send consecutive RTP packets of frame (starting at byte offset), in one sendmmsg call when possible."""
+        traceStart = tracer.clock() if tracer.enabled else None
+        start = perf_counter()
+        try:
+            if self.batchSend and frame is not None:
+                if isinstance(packets, FramePackets):
+                    headers = packets.headerBlock()
+                else:
+                    headers = b''.join([header for header, _ in packets])
+                UdpBatch.sendFrameHeaders(self.clientInfo['rtpSocket'], headers, HEADER_SIZE,
+                                          frame, offset, self.MAX_RTP_PAYLOAD, self.rtpAddress())
+            else:
+                for packet in packets:
+                    self.transmit(packet)
+        except OSError:
+            self.metrics.sendErrors += 1
+            raise
+        if isinstance(packets, FramePackets):
+            size = packets.nbytes()
+        else:
+            size = sum([len(header) + len(payload) for header, payload in packets])
+        self.metrics.sent(len(packets), size, perf_counter() - start)
+        now = monotonic()
+        if now >= self.nextSenderReport:
+            self.sendSenderReport(now)
+        if traceStart is not None:
+            tracer.complete("send", traceStart, 'server', ssrc=self.ssrc, frame=self.sendingFrame,
+                            packets=len(packets))
+
+    def transmitFec(self):
+        """Send the FEC packets of the frame just sent."""
+        fecPackets, self.fecPackets = self.fecPackets, []
+        if not fecPackets:
+            return
+        try:
+            for packet in fecPackets:
+                self.transmit(packet)
+        except OSError:
+            self.metrics.sendErrors += 1
+            raise
+        self.metrics.fecSent(len(fecPackets), sum([len(header) + len(payload) for header, payload in fecPackets]))
+
+    def readFrame(self, video):
+        """Return video.nextFrame(), timed into the session metrics."""
+        traceStart = tracer.clock() if tracer.enabled else None
+        start = perf_counter()
+        data = video.nextFrame()
+        if data:
+            self.metrics.frameRead(perf_counter() - start)
+            if traceStart is not None:
+                tracer.complete("nextFrame", traceStart, 'server', ssrc=self.ssrc, frame=video.frameNbr(),
+                                bytes=len(data))
+        return data
+
+    def frameStarted(self, now):
+        """Record the lag of the unpaced send loop against the target frame rate."""
+        if self.lastFrameStart is not None:
+            self.metrics.lag(now - self.lastFrameStart - self.frameInterval())
+        self.lastFrameStart = now
+
+    def transmitEnd(self):
+        """Tell the client the video is over."""
+        print("End of video reached. Stopping RTP stream.")
+        try:
+            self.clientInfo['rtpSocket'].sendto(self.END_OF_VIDEO, self.rtpAddress())
+        except Exception as e:
+            print("Error sending END_OF_VIDEO:", e)
+
+    def frameInterval(self):
+        """Seconds between two frames at the target frame rate of the mode."""
+        return 1.0 / self.FRAME_RATES.get(self.mode, 24)
+
+    def frameDelay(self):
+        """Delay between two frames of the unpaced loops, stretched when receiver reports show loss."""
+        return self.FRAME_DELAY / self.rateScale
+
+    def sendPacedBurst(self, now):
+        """Send the next burst of packets of the current frame.
+
+        Returns the time the next burst is due, or None at the end of the video.
+        """
+        with self.streamLock:
+            return self._sendPacedBurst(now)
+
+    def _sendPacedBurst(self, now):
+        if self.pacedIndex >= len(self.pacedPackets):
+            video = self.clientInfo.get('videoStream')
+            if video is None:
+                return None  # closed by closeRtpTransport
+            if self.nextFrameDue is not None:
+                self.metrics.lag(now - self.nextFrameDue)
+            data = self.readFrame(video)
+            if not data:
+                self.transmitEnd()
+                return None
+            self.pacedFrame = data
+            self.pacedPackets = self.packetizeFrame(data, video.frameNbr())
+            self.pacedIndex = 0
+
+            interval = self.frameInterval() / self.rateScale
+            if self.nextFrameDue is None or now - self.nextFrameDue > interval:
+                # first frame, or too late to catch up without a burst
+                self.nextFrameDue = now
+            self.nextFrameDue += interval
+            bursts = (len(self.pacedPackets) + self.PACING_BURST - 1) // self.PACING_BURST
+            self.burstGap = interval * self.PACING_SPREAD / bursts
+
+        burst = self.pacedPackets[self.pacedIndex:self.pacedIndex + self.PACING_BURST]
+        self.transmitBatch(burst, self.pacedFrame, self.pacedIndex * self.MAX_RTP_PAYLOAD)
+        self.pacedIndex += len(burst)
+        self.metrics.pendingPackets = len(self.pacedPackets) - self.pacedIndex
+
+        if self.pacedIndex < len(self.pacedPackets):
+            return now + self.burstGap
+        self.transmitFec()
+        self.pacedPackets = []
+        self.pacedFrame = None
+        if self.nextFrameDue is None:
+            # resumed in the middle of this frame: the next one is due now
+            return now
+        return self.nextFrameDue
 
     def sendRtp(self):
-        MAX_RTP_PAYLOAD = 1500 # gửi tối đa bao nhiêu bytes
-        event = self.clientInfo.get('event') # điều khiển luồng gửi video
-        video = self.clientInfo.get('videoStream') # lấy video mà client yêu cầu
         rtp_socket = self.clientInfo.get('rtpSocket') # lấy ra cái socket mà để server gửi ảnh tới client
-        if not (event and video and rtp_socket): # nếu không có thông tin của những cái này thì nó sẽ bị dừng lại
-            print("sendRtp: missing event/video/rtp_socket")
+        if not ('videoStream' in self.clientInfo and rtp_socket): # nếu không có thông tin của những cái này thì nó sẽ bị dừng lại
+            print("sendRtp: missing video/rtp_socket")
             return
 
         while True:
-            # wait short time; if event set -> stop
-            was_set = event.wait(0.05)  # chờ một xíu
-            if was_set or event.is_set():
-                continue  # không break, quay lại vòng lặp chờ Play
+            # paused: sleep until resumeStream or closeRtpTransport
+            with self.sendCond:
+                self.sendCond.wait_for(lambda: self.sending or self.closed)
+                if self.closed:
+                    return
+                resumes = self.resumes
 
-            data = video.nextFrame()  # đọc cái khung tiếp theo
+            with self.streamLock:
+                video = self.clientInfo.get('videoStream') # lấy video mà client yêu cầu (đổi được bằng SET_PARAMETER)
+                if video is None:
+                    return  # closed by closeRtpTransport
+                self.frameStarted(monotonic())
+                data = self.readFrame(video)  # đọc cái khung tiếp theo
 
-            if not data:
-                print("End of video reached. Stopping RTP stream.")
-                try:
-                    # gửi thông điệp tới client qua RTP socket
-                    end_message = b"END_OF_VIDEO"
-                    address = self.clientInfo['rtspSocket'][1][0]
-                    port = int(self.clientInfo.get('rtpPort', 0))
-                    rtp_socket.sendto(end_message, (address, port))
-                except Exception as e:
-                    print("Error sending END_OF_VIDEO:", e)
-                break  # dừng luồng, không reset
-
-            frameNumber = video.frameNbr() # lấy ra cái số thứ tự của khung
-            frame_size = len(data) # chiều dài của khung theo số nguyên, lấy ra chiều dài của khung
-            num_chunks = (frame_size + MAX_RTP_PAYLOAD - 1) // MAX_RTP_PAYLOAD # chia khung đó ra thành nhiều khung để truyền gói đó đi
-
-            # get client address (from RTSP socket info)
-            try:
-                address = self.clientInfo['rtspSocket'][1][0] # lấy cái địa chỉ của client
-                port = int(self.clientInfo.get('rtpPort', 0)) # lấy cổng rtp của client
-            except:
-                print("Connection Error")
-            # print('-'*60)
-            # traceback.print_exc(file=sys.stdout)
-            # print('-'*60)
+                if not data:
+                    self.transmitEnd() # gửi thông điệp tới client qua RTP socket
+                    break  # dừng luồng, không reset
 
-            for i in range(num_chunks):
-
-                start = i * MAX_RTP_PAYLOAD
-                end = min((i + 1) * MAX_RTP_PAYLOAD, frame_size)
-                payload_chunk = data[start:end] # phân mảnh dữ liệu trong video
-                marker_bit = 1 if (i == num_chunks - 1) else 0 # đánh dấu là gói cuối cùng được truyền
+                frameNumber = video.frameNbr() # lấy ra cái số thứ tự của khung
 
                 try:
-                    rtp_packet = self.makeRtp(payload_chunk, frameNumber, marker_bit) # nếu là 1 thì là kết thúc chuỗi, không truyền gì là 0
-                    # ensure bytes
-                    if isinstance(rtp_packet, str):
-                        rtp_packet = rtp_packet.encode('latin1') # mỗi ký tự string là 1 byte
-                    rtp_socket.sendto(rtp_packet, (address, port)) # gửi đến cái rtp của client
+                    self.transmitBatch(self.packetizeFrame(data, frameNumber), data) # gửi đến cái rtp của client
+                    self.transmitFec()
                 except Exception:
                     print("Connection Error sending RTP chunk")
                     traceback.print_exc()
-                    # break out of chunk loop on send error to avoid busy-looping
-                    break
-
-    def makeRtp(self, payload, frameNbr, marker=0):
-        """RTP-packetize the video data."""
-        version = 2
-        padding = 0
-        extension = 0
-        cc = 0
-        pt = 26  # MJPEG type
-        seqnum = frameNbr
-        ssrc = 0
-
-        rtpPacket = RtpPacket()
-
-        rtpPacket.encode(version, padding, extension, cc, seqnum, marker, pt, ssrc, payload)
-        return rtpPacket.getPacket()
-
-    def replyRtsp(self, code, seq):
-        """Send RTSP reply to the client."""
+
+            # frame delay, cut short by a pause, a resume (seek) or the teardown
+            with self.sendCond:
+                self.sendCond.wait_for(lambda: not self.sending or self.closed or self.resumes != resumes,
+                                       self.frameDelay())
+
+    def packetizeFrame(self, data, frameNumber):
+        """Split a frame into (header, payload) RTP packets of at most MAX_RTP_PAYLOAD bytes.
+
+        Every packet gets the next sequence number, all packets of the frame share
+        its 90 kHz timestamp, and the last packet has the marker bit set. Payloads
+        are memoryview slices of the frame. With prepacketize the headers come
+        from the video's PacketTable as one block (FramePackets). With FEC on,
+        the frame's parity packets are left in fecPackets for transmitFec. The
+        packets are kept in the history for NACKs.
+        """
+        traceStart = tracer.clock() if tracer.enabled else None
+        if self.packetTable is not None:
+            packets = self.packetTable.framePackets(frameNumber - 1, data, self.rtpSeq, self.ssrc)
+        else:
+            packets = self.packetizer.packetize(data, self.MAX_RTP_PAYLOAD, self.rtpSeq, self.rtpTimestamp(frameNumber))
+        self.rtpSeq = (self.rtpSeq + len(packets)) & 0xFFFF
+        if self.fecEncoder is not None:
+            self.fecPackets = self.fecEncoder.protect(packets)
+        self.history.record(packets, data, packets.headerBlock() if isinstance(packets, FramePackets) else None)
+        self.sendingFrame = frameNumber
+        if traceStart is not None:
+            tracer.complete("packetize", traceStart, 'server', ssrc=self.ssrc, frame=frameNumber,
+                            packets=len(packets))
+        return packets
+
+    def frameTicks(self):
+        """90 kHz clock ticks between two frames of the mode."""
+        return RTP_CLOCK_RATE // self.FRAME_RATES.get(self.mode, 24)
+
+    def rtpTimestamp(self, frameNumber):
+        """90 kHz media timestamp of frame frameNumber (1-based), derived from the frame index."""
+        return ((frameNumber - 1) * self.frameTicks()) & 0xFFFFFFFF
+
+    def replyRtsp(self, code, seq, headers=()):
+        """Send RTSP reply to the client, with extra 'Name: value' header lines after Session."""
+        session_id = self.clientInfo.get('session', 0)  # nếu chưa có thì dùng 0
         if code == self.OK_200:
             # print("200 OK")
-            session_id = self.clientInfo.get('session', 0)  # nếu chưa có thì dùng 0
             reply = f'RTSP/1.0 200 OK\nCSeq: {seq}\nSession: {session_id}'
-            connSocket = self.clientInfo['rtspSocket'][0]
-            connSocket.send(reply.encode())
+            for header in headers:
+                reply += '\n' + header
+            self.sendRtspReply(reply)
 
-        # Error messages
+        # Error messages, replied too so the client does not wait for them
         elif code == self.FILE_NOT_FOUND_404:
             print("404 NOT FOUND")
+            self.sendRtspReply(f'RTSP/1.0 404 Not Found\nCSeq: {seq}\nSession: {session_id}')
         elif code == self.CON_ERR_500:
             print("500 CONNECTION ERROR")
+            self.sendRtspReply(f'RTSP/1.0 500 Internal Server Error\nCSeq: {seq}\nSession: {session_id}')
+        elif code == self.PARAMETER_NOT_UNDERSTOOD_451:
+            print("451 PARAMETER NOT UNDERSTOOD")
+            self.sendRtspReply(f'RTSP/1.0 451 Parameter Not Understood\nCSeq: {seq}\nSession: {session_id}')
+        elif code == self.METHOD_NOT_VALID_455:
+            print("455 METHOD NOT VALID IN THIS STATE")
+            self.sendRtspReply(f'RTSP/1.0 455 Method Not Valid in This State\nCSeq: {seq}\nSession: {session_id}')
+
+    def sendRtspReply(self, reply):
+        """Write a reply on the RTSP connection."""
+        connSocket = self.clientInfo['rtspSocket'][0]
+        connSocket.send(reply.encode())
@@ -0,0 +1,63 @@
+"""Writes synthetic video files in the server's formats, for benchmarks and
+load tests: 'normal' (5-byte ASCII length before each frame) or 'hd' (frames
+delimited by the JPEG SOI/EOI markers).
+
+Frames are random bytes between SOI and EOI with no 0xFF inside, so they are
+framed like JPEG images but cannot be decoded. Sizes vary by +-20% around the
+requested average, like a real MJPEG stream.
+
+Usage: SyntheticVideo.py Output_file [--mode normal|hd] [--frames N] [--frame-size BYTES]
+"""
+import argparse, os, random
+
+SOI = b'\xff\xd8'
+EOI = b'\xff\xd9'
+
+# average frame size per mode (bytes): an SD and a 720p MJPEG frame
+FRAME_SIZES = {'normal': 12000, 'hd': 150000}
+MAX_NORMAL_FRAME = 99999  # the length header has 5 digits
+
+# 0xFF would start a JPEG marker (a false EOI for the hd scan)
+_NO_FF = bytes(range(255)) + b'\xfe'
+
+
+def makeFrame(size, rng=random):
+    """Return a frame of size bytes: SOI, marker-free noise, EOI."""
+    body = rng.randbytes(max(size - len(SOI) - len(EOI), 0)).translate(_NO_FF)
+    return SOI + body + EOI
+
+
+def frameSizes(count, average, seed=0):
+    """Sizes of count frames varying by +-20% around average."""
+    rng = random.Random(seed)
+    return [int(average * rng.uniform(0.8, 1.2)) for _ in range(count)]
+
+
+def writeVideo(filename, mode='normal', frames=240, frameSize=None, seed=0):
+    """Write a synthetic video of frames frames and return filename."""
+    if mode not in FRAME_SIZES:
+        raise ValueError(f"unknown mode {mode!r}")
+    average = frameSize or FRAME_SIZES[mode]
+    rng = random.Random(seed)
+    with open(filename, 'wb') as f:
+        for size in frameSizes(frames, average, seed):
+            if mode == 'normal':
+                size = min(size, MAX_NORMAL_FRAME)
+                f.write(b'%05d' % size)
+            f.write(makeFrame(size, rng))
+    return filename
+
+
+def main():
+    parser = argparse.ArgumentParser(description="write a synthetic MJPEG-framed video")
+    parser.add_argument('output')
+    parser.add_argument('--mode', choices=sorted(FRAME_SIZES), default='normal')
+    parser.add_argument('--frames', type=int, default=240)
+    parser.add_argument('--frame-size', type=int, default=None, help="average frame size in bytes")
+    args = parser.parse_args()
+    writeVideo(args.output, args.mode, args.frames, args.frame_size)
+    print(f"{args.output}: {args.frames} {args.mode} frames, {os.path.getsize(args.output)} bytes")
+
+
+if __name__ == "__main__":
+    main()
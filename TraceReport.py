@@ -0,0 +1,159 @@
+"""Per-frame latency breakdown from the Chrome traces written with --trace by
+Server.py, ClientLauncher.py and LoadGenerator.py.
+
+Spans carry the SSRC and frame number of the frame they worked on (the
+client derives the frame number from the RTP timestamp), so the server's
+and the client's spans of one frame are joined across the trace files.
+Times are the spans' wall-clock timestamps, which line up for processes on
+the same host. Every frame goes through these stages:
+
+  read       VideoStream.nextFrame on the server
+  packetize  splitting it into RTP packets
+  send       first to last send call (one per paced burst)
+  transit    last packet sent to the frame reassembled by the client
+  buffered   waiting in frameBuffer for the decoder
+  decode     JPEG decode
+  queued     decoded, waiting for its turn in playFromBuffer
+  display    playFromBuffer showing it
+  total      start of the read to the end of the last stage traced
+
+A frame sent twice (seek backwards) merges both passes into one row.
+
+Usage: TraceReport.py TRACE [TRACE ...] [--frames] [--json FILE] [--merge FILE]
+"""
+import argparse, json, statistics
+from collections import defaultdict
+
+STAGES = ['read', 'packetize', 'send', 'transit', 'buffered', 'decode', 'queued', 'display', 'total']
+# span name -> stage whose [first start, last end] it extends
+SPAN_STAGES = {'nextFrame': 'read', 'packetize': 'packetize', 'send': 'send',
+               'receiveRtp': 'receive', 'decode': 'decode', 'playFromBuffer': 'display'}
+
+
+def loadEvents(filenames):
+    """Trace events of every file, in one list."""
+    events = []
+    for filename in filenames:
+        with open(filename) as f:
+            trace = json.load(f)
+        events += trace['traceEvents'] if isinstance(trace, dict) else trace
+    return events
+
+
+def extend(spans, stage, event):
+    start, end = event['ts'], event['ts'] + event['dur']
+    span = spans.get(stage)
+    spans[stage] = (start, end) if span is None else (min(span[0], start), max(span[1], end))
+
+
+def frameSpans(events):
+    """(ssrc, frame) -> stage -> (first start, last end) in microseconds."""
+    frames = defaultdict(dict)
+    owner = {}  # (client pid, frame) -> (ssrc, frame), from the client's receive spans
+    later = []
+    for event in events:
+        stage = SPAN_STAGES.get(event.get('name'))
+        if event.get('ph') != 'X' or stage is None:
+            continue
+        args = event.get('args', {})
+        if 'ssrc' in args:
+            key = (args['ssrc'], args['frame'])
+            extend(frames[key], stage, event)
+            if stage == 'receive':
+                owner[(event['pid'], args['frame'])] = key
+        else:
+            later.append((stage, event))
+    # decode and display spans only know the frame number, their process tells the session
+    for stage, event in later:
+        key = owner.get((event['pid'], event['args']['frame']))
+        if key is not None:
+            extend(frames[key], stage, event)
+    return frames
+
+
+def breakdown(spans):
+    """Stage durations of one frame in ms, None for stages missing from the traces."""
+    def duration(stage):
+        span = spans.get(stage)
+        return span[1] - span[0] if span else None
+
+    def gap(before, after):
+        if before not in spans or after not in spans:
+            return None
+        return spans[after][0] - spans[before][1]
+
+    stages = {
+        'read': duration('read'),
+        'packetize': duration('packetize'),
+        'send': duration('send'),
+        'transit': (spans['receive'][1] - spans['send'][1]
+                    if 'receive' in spans and 'send' in spans else None),
+        'buffered': (spans['decode'][0] - spans['receive'][1]
+                     if 'decode' in spans and 'receive' in spans else None),
+        'decode': duration('decode'),
+        'queued': gap('decode', 'display'),
+        'display': duration('display'),
+        'total': None,
+    }
+    if 'read' in spans:
+        stages['total'] = max(end for _, end in spans.values()) - spans['read'][0]
+    return {stage: None if value is None else value / 1000 for stage, value in stages.items()}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(rows):
+    """Per stage: frames, mean, p50, p95 and max in ms."""
+    summary = {}
+    for stage in STAGES:
+        values = [row[stage] for row in rows if row[stage] is not None]
+        if values:
+            summary[stage] = {'frames': len(values), 'mean': statistics.mean(values),
+                              'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95),
+                              'max': max(values)}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-frame latency breakdown of server and client traces")
+    parser.add_argument('traces', nargs='+', help="Chrome trace files written with --trace")
+    parser.add_argument('--frames', action='store_true', help="also print every frame")
+    parser.add_argument('--json', default=None, help="write the frames and the summary as JSON to this file")
+    parser.add_argument('--merge', default=None, help="write all traces into one file for chrome://tracing")
+    args = parser.parse_args()
+
+    events = loadEvents(args.traces)
+    if args.merge:
+        with open(args.merge, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    rows = []
+    for (ssrc, frame), spans in sorted(frameSpans(events).items()):
+        row = breakdown(spans)
+        row['ssrc'] = ssrc
+        row['frame'] = frame
+        rows.append(row)
+    summary = summarize(rows)
+
+    if args.frames:
+        print(f"{'ssrc':>10} {'frame':>6} " + " ".join(f"{stage:>9}" for stage in STAGES))
+        for row in rows:
+            print(f"{row['ssrc']:>10} {row['frame']:>6} " + " ".join(
+                f"{row[stage]:>9.3f}" if row[stage] is not None else f"{'-':>9}" for stage in STAGES))
+        print()
+    print(f"{'stage (ms)':<10} {'frames':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'max':>9}")
+    for stage, stats in summary.items():
+        print(f"{stage:<10} {stats['frames']:>7} {stats['mean']:>9.3f} {stats['p50']:>9.3f} "
+              f"{stats['p95']:>9.3f} {stats['max']:>9.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'frames': rows, 'summary': summary}, f, indent=2)
+            f.write("\n")
+
+
+if __name__ == "__main__":
+    main()
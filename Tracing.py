@@ -0,0 +1,116 @@
+import atexit, contextlib, json, os, threading, time
+
+# a disabled tracer hands out this span, entering and leaving it does nothing
+_NO_SPAN = contextlib.nullcontext()
+
+
+class Span:
+    """Context manager recording one complete event; args can be filled in inside the block."""
+    __slots__ = ('tracer', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.tracer.clock()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.complete(self.name, self.start, self.cat, **self.args)
+        return False
+
+
+class Tracer:
+    """Collects spans in memory and writes them as a Chrome trace (chrome://tracing, Perfetto).
+
+    Tracing is off until start(). Hot paths only test `enabled` while it is off:
+
+        start = tracer.clock() if tracer.enabled else None
+        ...
+        if start is not None:
+            tracer.complete("nextFrame", start, 'server', frame=n)
+
+    and colder code can use `with tracer.span(name, cat, **args)`. Timestamps
+    are wall-clock nanoseconds, so the traces of a server and of a client on
+    the same host line up (TraceReport.py joins them per frame).
+    """
+
+    # events kept in memory, later ones are counted as dropped
+    MAX_EVENTS = 2000000
+
+    clock = staticmethod(time.time_ns)
+
+    def __init__(self):
+        self.enabled = False
+        self.filename = None
+        self.processName = None
+        self.events = []       # (name, cat, start ns, end ns, thread id, args)
+        self.threadNames = {}  # native thread id -> name
+        self.dropped = 0
+        self.saveLock = threading.Lock()
+        self.exitHook = False
+
+    def start(self, filename, processName=None):
+        """Record spans from now on; they are written to filename by save(), at the latest at exit."""
+        self.filename = filename
+        self.processName = processName
+        self.events = []
+        self.dropped = 0
+        self.enabled = True
+        if not self.exitHook:
+            atexit.register(self.save)
+            self.exitHook = True
+
+    def stop(self):
+        """Stop recording and write the trace."""
+        self.enabled = False
+        self.save()
+
+    def span(self, name, cat='', **args):
+        if not self.enabled:
+            return _NO_SPAN
+        return Span(self, name, cat, args)
+
+    def complete(self, name, start, cat='', **args):
+        """Record a span from start (a clock() value) to now."""
+        end = time.time_ns()
+        if len(self.events) >= self.MAX_EVENTS:
+            self.dropped += 1
+            return
+        tid = threading.get_native_id()
+        if tid not in self.threadNames:
+            self.threadNames[tid] = threading.current_thread().name
+        self.events.append((name, cat, start, end, tid, args))
+
+    def traceEvents(self):
+        """The recorded spans as Chrome trace event dicts (times in microseconds)."""
+        pid = os.getpid()
+        events = []
+        if self.processName:
+            events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0,
+                           'args': {'name': self.processName}})
+        for tid, name in list(self.threadNames.items()):
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+        for name, cat, start, end, tid, args in list(self.events):
+            events.append({'name': name, 'cat': cat, 'ph': 'X', 'ts': start / 1000, 'dur': (end - start) / 1000,
+                           'pid': pid, 'tid': tid, 'args': args})
+        return events
+
+    def save(self):
+        """Write the trace file (again) with every span recorded so far."""
+        if self.filename is None:
+            return
+        with self.saveLock:
+            trace = {'traceEvents': self.traceEvents(), 'displayTimeUnit': 'ms',
+                     'otherData': {'droppedEvents': self.dropped}}
+            temp = self.filename + '.tmp'
+            with open(temp, 'w') as f:
+                json.dump(trace, f)
+            os.replace(temp, self.filename)
+
+
+# Tracer of the process, started by Server.py / ClientLauncher.py --trace
+tracer = Tracer()
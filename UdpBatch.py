@@ -0,0 +1,272 @@
+import ctypes, ctypes.util, os, socket, struct, sys, threading
+from array import array
+
+# Linux limits one sendmmsg call to UIO_MAXIOV messages
+MAX_BATCH = 1024
+PyBUF_SIMPLE = 0
+# array type code of a machine word, iovec arrays are written as pairs of words
+IOV_WORD = 'Q' if ctypes.sizeof(ctypes.c_void_p) == 8 else 'I'
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [('msg_name', ctypes.c_void_p), ('msg_namelen', ctypes.c_uint32),
+                ('msg_iov', ctypes.POINTER(iovec)), ('msg_iovlen', ctypes.c_size_t),
+                ('msg_control', ctypes.c_void_p), ('msg_controllen', ctypes.c_size_t),
+                ('msg_flags', ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+
+class Py_buffer(ctypes.Structure):
+    # obj is a plain pointer so ctypes never touches its reference count
+    _fields_ = [('buf', ctypes.c_void_p), ('obj', ctypes.c_void_p), ('len', ctypes.c_ssize_t),
+                ('itemsize', ctypes.c_ssize_t), ('readonly', ctypes.c_int), ('ndim', ctypes.c_int),
+                ('format', ctypes.c_char_p), ('shape', ctypes.c_void_p), ('strides', ctypes.c_void_p),
+                ('suboffsets', ctypes.c_void_p), ('internal', ctypes.c_void_p)]
+
+
+def _loadSendmmsg():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+_sendmmsg = _loadSendmmsg()
+_getBuffer = ctypes.pythonapi.PyObject_GetBuffer
+_getBuffer.argtypes = [ctypes.py_object, ctypes.POINTER(Py_buffer), ctypes.c_int]
+_getBuffer.restype = ctypes.c_int
+_releaseBuffer = ctypes.pythonapi.PyBuffer_Release
+_releaseBuffer.argtypes = [ctypes.POINTER(Py_buffer)]
+_releaseBuffer.restype = None
+
+
+def available():
+    """True when batches go to the kernel in a single sendmmsg call."""
+    return _sendmmsg is not None
+
+
+def _sockaddr(address):
+    """Build a sockaddr_in for an IPv4 (host, port) pair."""
+    host, port = address[0], address[1]
+    raw = struct.pack('=H', socket.AF_INET) + struct.pack('!H', port) + socket.inet_aton(socket.gethostbyname(host)) + bytes(8)
+    return ctypes.create_string_buffer(raw, len(raw))
+
+
+class _BufferAddresses:
+    """Pins buffers with PyObject_GetBuffer and returns their addresses; releases them on exit."""
+
+    def __init__(self):
+        self.views = []
+        self.addresses = {}  # id(obj) -> address, one lookup per distinct buffer
+
+    def __call__(self, obj):
+        address = self.addresses.get(id(obj))
+        if address is None:
+            view = Py_buffer()
+            _getBuffer(obj, ctypes.byref(view), PyBUF_SIMPLE)
+            self.views.append((obj, view))
+            address = self.addresses[id(obj)] = view.buf or 0
+        return address
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        for _, view in self.views:
+            _releaseBuffer(ctypes.byref(view))
+
+
+class _MessageArrays:
+    """mmsghdr/iovec arrays reused by every sendmmsg call of one thread."""
+
+    def __init__(self):
+        self.size = 0
+        self.addressCache = {}
+        self.namedAddress = None
+        self.namedCount = 0
+
+    def reserve(self, count, iovPerMsg):
+        """Make room for count messages of iovPerMsg buffers each."""
+        if count <= self.size and iovPerMsg == self.iovPerMsg:
+            return
+        self.size = max(count, 2 * self.size, 16)
+        self.iovPerMsg = iovPerMsg
+        self.msgs = (mmsghdr * self.size)()
+        self.iovs = (iovec * (self.size * iovPerMsg))()
+        self.iovView = memoryview(self.iovs).cast('B')
+        base = ctypes.addressof(self.iovs)
+        for i in range(self.size):
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_iov = ctypes.cast(base + i * iovPerMsg * ctypes.sizeof(iovec), ctypes.POINTER(iovec))
+            hdr.msg_iovlen = iovPerMsg
+        self.namedAddress = None
+        self.namedCount = 0
+
+    def setFrameIovecs(self, headerBase, headerSize, payloadBase, chunkSize, lastSize, count):
+        """Point message i at header i of a packed header block and at chunk i of a frame.
+
+        The iovecs are built with array operations and copied in with one
+        memmove, so the cost in Python does not grow with the packet count.
+        """
+        values = array(IOV_WORD, bytes(4 * count * array(IOV_WORD).itemsize))
+        values[0::4] = array(IOV_WORD, range(headerBase, headerBase + count * headerSize, headerSize))
+        values[1::4] = array(IOV_WORD, (headerSize,)) * count
+        values[2::4] = array(IOV_WORD, range(payloadBase, payloadBase + count * chunkSize, chunkSize))
+        values[3::4] = array(IOV_WORD, (chunkSize,)) * count
+        values[-1] = lastSize
+        address, length = values.buffer_info()
+        ctypes.memmove(self.iovs, address, length * values.itemsize)
+
+    def setDestination(self, address, count):
+        """Point the first count messages at address."""
+        if address == self.namedAddress and count <= self.namedCount:
+            return
+        name = self.addressCache.get(address)
+        if name is None:
+            name = self.addressCache[address] = _sockaddr(address)
+        namePtr = ctypes.addressof(name)
+        for i in range(count):
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = namePtr
+            hdr.msg_namelen = len(name)
+        self.namedAddress = address
+        self.namedCount = count
+
+    def send(self, fd, count):
+        done = 0
+        while done < count:
+            n = _sendmmsg(fd, ctypes.addressof(self.msgs) + done * ctypes.sizeof(mmsghdr), count - done, 0)
+            if n < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            done += n
+        return done
+
+
+_arrays = threading.local()
+
+
+def _messageArrays():
+    arrays = getattr(_arrays, 'arrays', None)
+    if arrays is None:
+        arrays = _arrays.arrays = _MessageArrays()
+    return arrays
+
+
+def sendFrame(sock, headers, frame, offset, chunkSize, address):
+    """Send len(headers) RTP packets cut from one frame in a single sendmmsg call.
+
+    Packet i is headers[i] followed by frame[offset + i * chunkSize:][:chunkSize].
+    The headers, all of the same size, are joined into one small buffer; the
+    frame payload is not copied. Returns the number of packets sent.
+    """
+    if not headers:
+        return 0
+    return sendFrameHeaders(sock, b''.join(headers), len(headers[0]), frame, offset, chunkSize, address)
+
+
+def sendFrameHeaders(sock, headerBlock, headerSize, frame, offset, chunkSize, address):
+    """sendFrame for headers already packed back to back in headerBlock, headerSize bytes each."""
+    count = len(headerBlock) // headerSize
+    if count == 0:
+        return 0
+    frame = memoryview(frame)
+    headerBlock = memoryview(headerBlock)
+    if count > MAX_BATCH:
+        sent = 0
+        for first in range(0, count, MAX_BATCH):
+            sent += sendFrameHeaders(sock, headerBlock[first * headerSize:(first + MAX_BATCH) * headerSize],
+                                     headerSize, frame, offset + first * chunkSize, chunkSize, address)
+        return sent
+    if _sendmmsg is None or sock.family != socket.AF_INET:
+        messages = []
+        for i in range(count):
+            start = offset + i * chunkSize
+            messages.append([headerBlock[i * headerSize:(i + 1) * headerSize], frame[start:start + chunkSize]])
+        return sendBatch(sock, messages, address)
+
+    arrays = _messageArrays()
+    arrays.reserve(count, 2)
+    with _BufferAddresses() as addressOf:
+        headerBase = addressOf(headerBlock)
+        frameBase = addressOf(frame)
+        lastSize = min(chunkSize, len(frame) - offset - (count - 1) * chunkSize)
+        arrays.setFrameIovecs(headerBase, headerSize, frameBase + offset, chunkSize, lastSize, count)
+        arrays.setDestination(address, count)
+        return arrays.send(sock.fileno(), count)
+
+
+def sendBatch(sock, messages, address):
+    """Send every message (a list of buffers each) to address.
+
+    Returns the number of messages sent. Uses sendmmsg on Linux and falls
+    back to one sendmsg/sendto per message elsewhere.
+    """
+    return sendBatchTo(sock, [(buffers, address) for buffers in messages])
+
+
+def sendBatchTo(sock, items):
+    """Send (buffers, address) items, possibly to several destinations, in as few syscalls as possible.
+
+    Buffers shared by several items (the same packet sent to many clients)
+    are only pinned once.
+    """
+    if not items:
+        return 0
+    if _sendmmsg is None or sock.family != socket.AF_INET:
+        for buffers, address in items:
+            if hasattr(sock, 'sendmsg'):
+                sock.sendmsg(buffers, [], 0, address)
+            else:
+                sock.sendto(b''.join(buffers), address)
+        return len(items)
+
+    sent = 0
+    for start in range(0, len(items), MAX_BATCH):
+        sent += _sendItems(sock.fileno(), items[start:start + MAX_BATCH])
+    return sent
+
+
+def _sendItems(fd, items):
+    count = len(items)
+    msgs = (mmsghdr * count)()
+    keep = []   # iovec arrays and sockaddrs referenced by msgs
+    names = {}
+    with _BufferAddresses() as addressOf:
+        for i, (buffers, address) in enumerate(items):
+            iovs = (iovec * len(buffers))()
+            for j, buf in enumerate(buffers):
+                iovs[j].iov_base = addressOf(buf)
+                iovs[j].iov_len = memoryview(buf).nbytes
+            keep.append(iovs)
+
+            name = names.get(address)
+            if name is None:
+                name = names[address] = _sockaddr(address)
+            hdr = msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(name)
+            hdr.msg_namelen = len(name)
+            hdr.msg_iov = iovs
+            hdr.msg_iovlen = len(buffers)
+
+        done = 0
+        while done < count:
+            n = _sendmmsg(fd, ctypes.addressof(msgs) + done * ctypes.sizeof(mmsghdr), count - done, 0)
+            if n < 0:
+                err = ctypes.get_errno()
+                raise OSError(err, os.strerror(err))
+            done += n
+        return done
@@ -1,64 +1,91 @@
+import os, mmap
+from FrameIndex import FrameIndex
+from FrameCache import sharedFrameCache
+
+
 class VideoStream:
-    def __init__(self, filename, mode='normal'):
+    def __init__(self, filename, mode='normal', useMmap=False, frameCache=sharedFrameCache):
         """
         mode: 'normal' or 'hd'
         normal: 5 bytes length header
         hd: JPEG-like header (\xff\xd8) and footer (\xff\xd9)
+        useMmap: map the file and return frames as memoryview slices (no copy)
+        frameCache: FrameCache read through by nextFrame, None to always read the file
         """
+        if mode not in ('normal', 'hd'):
+            raise ValueError
         self.filename = filename
         try:
             self.file = open(filename, 'rb')
-        except:
+        except OSError:
+            raise IOError
+        try:
+            # offset/length of every frame, loaded from (or saved to) the sidecar file
+            self.index = FrameIndex.forFile(filename, mode)
+        except OSError:
+            self.file.close()
             raise IOError
 
+        self.map = None
+        self.view = None
+        if useMmap and len(self.index):
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+
+        # the page cache already shares mapped frames between sessions
+        self.frameCache = frameCache if self.map is None else None
+        # size and mtime, as the .idx check: a file replaced in place gets new keys
+        st = os.fstat(self.file.fileno())
+        self.cacheName = (os.path.abspath(filename), st.st_size, st.st_mtime_ns)
+
         self.frameNum = 0
         self.mode = mode
 
+    def readFrame(self, frameIdx):
+        """Read frame frameIdx (0-based) with a single positioned read."""
+        offset, length = self.index.frame(frameIdx)
+        if self.view is not None:
+            return self.view[offset:offset + length]
+        if hasattr(os, 'pread'):
+            return os.pread(self.file.fileno(), length, offset)
+        self.file.seek(offset)
+        return self.file.read(length)
+
     def nextFrame(self):
         """Get next frame depending on mode."""
-        if self.mode == 'normal':
-            # Read 5 bytes for frame length
-            data = self.file.read(5) # Get the framelength from the first 5 bits
-            if data:
-                framelength = int(data)
-
-                # Read the current frame
-                data = self.file.read(framelength)
-                self.frameNum += 1
-            return data
-
-        elif self.mode == 'hd':
-            # Read until we find the JPEG header
-            while True:
-                byte = self.file.read(1)
-                if not byte:
-                    return None  # EOF
-                if byte == b'\xff':
-                    next_byte = self.file.read(1)
-                    if next_byte == b'\xd8':
-                        break  # Start of frame found
-
-            # Start collecting frame bytes
-            data = b'\xff\xd8'
-            while True:
-                chunk = self.file.read(1024)  # Get chunk
-                if not chunk:
-                    break
-                data += chunk
-                # Check if frame ends with \xff\xd9
-                if b'\xff\xd9' in data[-1024:]:
-                    # split at end marker
-                    end_index = data.rfind(b'\xff\xd9') + 2
-                    data = data[:end_index]
-                    break
-
-            self.frameNum += 1
-            return data
+        if self.frameNum >= len(self.index):
+            return None  # EOF
 
+        if self.frameCache is not None:
+            key = (self.cacheName, self.mode, self.frameNum)
+            data = self.frameCache.get(key)
+            if data is None:
+                data = self.readFrame(self.frameNum)
+                self.frameCache.put(key, data)
         else:
-            raise ValueError
+            data = self.readFrame(self.frameNum)
+        self.frameNum += 1
+        return data
+
+    def seek(self, frameIdx):
+        """Make frame frameIdx (0-based) the next one returned by nextFrame."""
+        self.frameNum = min(max(frameIdx, 0), len(self.index))
 
     def frameNbr(self):
         """Get frame number."""
         return self.frameNum
 
+    def frameCount(self):
+        """Get the total number of frames."""
+        return len(self.index)
+
+    def close(self):
+        """Close the video file."""
+        if self.map is not None:
+            try:
+                self.view.release()
+                self.map.close()
+            except BufferError:
+                # frames are still referenced by a sender, the map goes away with them
+                pass
+        self.file.close()